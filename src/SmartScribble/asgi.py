@@ -19,4 +19,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartScribble.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Django must be set up before the consumers are imported
+from document.consumers import prediction_websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django only serves HTTP. WebSocket connections carry the predictions of the editor.
+    if scope['type'] == 'websocket':
+        await prediction_websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
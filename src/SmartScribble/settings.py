@@ -29,6 +29,14 @@ def get_from_environ_or_default(environ_var_name: str, default_value: str) -> st
     return default_value
 
 
+def get_list_from_environ(environ_var_name: str) -> list:
+    return [value for value in get_from_environ_or_default(environ_var_name, '').split(',') if value]
+
+
+def get_dict_from_environ(environ_var_name: str) -> dict:
+    return dict(value.split('=', 1) for value in get_list_from_environ(environ_var_name))
+
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = get_from_environ_or_default('SECRET_KEY', 'i+)-db3v_68ah7-#-qss3vw02$og+cm-6+9_rx4d=9p1)yd#i3')
 
@@ -152,6 +160,23 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Predictions shared by all the workers of a node. Any cache backend can be used, e.g. memcached or redis.
+    'predictions': {
+        'BACKEND': get_from_environ_or_default('PREDICTION_SHARED_CACHE_BACKEND',
+                                               'document.cache_backends.SQLiteCache'),
+        'LOCATION': get_from_environ_or_default('PREDICTION_SHARED_CACHE_LOCATION',
+                                                os.path.join(BASE_DIR, 'cache', 'predictions.sqlite3')),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000000,
+        },
+    },
+}
+
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 LOGIN_REDIRECT_URL = 'profile'
@@ -165,3 +190,83 @@ CKEDITOR_CONFIGS = {
         'width': '100%'
     },
 }
+
+# Prediction
+# Concurrent requests for the same model are grouped into batches. A batch size of 1 disables batching. Requests of
+# GPT-2 models for a document reuse its inference session instead, so they are never batched: batching applies to
+# BERT and ALBERT, and to requests without a document. The editor always sends its document.
+PREDICTION_BATCH_MAX_SIZE = int(get_from_environ_or_default('PREDICTION_BATCH_MAX_SIZE', '8'))
+PREDICTION_BATCH_MAX_WAIT_MS = float(get_from_environ_or_default('PREDICTION_BATCH_MAX_WAIT_MS', '5'))
+# Inference sessions keep the key/value cache of the last prediction of each client of a document (GPT-2 models)
+PREDICTION_MAX_SESSIONS = int(get_from_environ_or_default('PREDICTION_MAX_SESSIONS', '16'))
+# Latest predictions are kept in memory. Setting any limit to 0 disables the cache.
+PREDICTION_CACHE_MAX_ENTRIES = int(get_from_environ_or_default('PREDICTION_CACHE_MAX_ENTRIES', '10000'))
+PREDICTION_CACHE_MAX_BYTES = int(get_from_environ_or_default('PREDICTION_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+# Alias of the cache that stores predictions shared between processes. An empty value disables it.
+PREDICTION_SHARED_CACHE = get_from_environ_or_default('PREDICTION_SHARED_CACHE', '')
+# Maximum number of alternative predictions returned for a single request
+PREDICTION_MAX_CANDIDATES = int(get_from_environ_or_default('PREDICTION_MAX_CANDIDATES', '10'))
+# Files generated for the prediction models (vocabularies, exported models...)
+PREDICTION_ARTIFACTS_DIR = get_from_environ_or_default('PREDICTION_ARTIFACTS_DIR',
+                                                       os.path.join(BASE_DIR, 'prediction_artifacts'))
+# Models (e.g. GPT2,DGPT2) whose head only predicts the most frequent tokens of the local corpus
+PREDICTION_PRUNED_HEAD_MODELS = get_list_from_environ('PREDICTION_PRUNED_HEAD_MODELS')
+PREDICTION_PRUNED_HEAD_SIZE = int(get_from_environ_or_default('PREDICTION_PRUNED_HEAD_SIZE', '8000'))
+PREDICTION_PRUNED_HEAD_MIN_CONFIDENCE = float(get_from_environ_or_default('PREDICTION_PRUNED_HEAD_MIN_CONFIDENCE',
+                                                                          '0.2'))
+# Inference backend of each model (e.g. GPT2=quantized,BERT=onnx): torch, quantized, onnx, torchscript or
+# bfloat16. Models not listed use 'torch' (fp32). The onnx backend needs the files created by the export_onnx
+# command.
+PREDICTION_BACKENDS = get_dict_from_environ('PREDICTION_BACKENDS')
+# Sequence lengths run when a TorchScript model is loaded. They match the buckets used for batching.
+PREDICTION_TORCHSCRIPT_WARMUP_LENGTHS = [int(length) for length in get_from_environ_or_default(
+    'PREDICTION_TORCHSCRIPT_WARMUP_LENGTHS', '8,16,32,64,128').split(',') if length]
+# Memory (MB) the prediction models of a process can use. The least recently used ones are unloaded when it is
+# exceeded. 0 disables the limit.
+PREDICTION_MEMORY_BUDGET_MB = int(get_from_environ_or_default('PREDICTION_MEMORY_BUDGET_MB', '0'))
+# Number of prediction models loaded in parallel in background threads. Loads are serialized when
+# PREDICTION_MEMORY_BUDGET_MB or PREDICTION_LOW_MEMORY_LOADING are set, so the memory of every model is measured alone
+PREDICTION_LOAD_WORKERS = int(get_from_environ_or_default('PREDICTION_LOAD_WORKERS', '2'))
+# Seconds before a model whose load failed is loaded again. The delay doubles with every consecutive failure.
+PREDICTION_LOAD_RETRY_SECONDS = float(get_from_environ_or_default('PREDICTION_LOAD_RETRY_SECONDS', '30'))
+# How models are loaded at startup: 'async' (background threads), 'sync' (before serving requests, so forked
+# workers share them, see gunicorn.conf.py) or 'none' (when they are first used)
+PREDICTION_PRELOAD = get_from_environ_or_default('PREDICTION_PRELOAD', 'async')
+# Map the weights from the files created by the convert_weights command when they exist, so all the processes of
+# a node share one copy
+PREDICTION_MMAP_WEIGHTS = get_from_environ_or_default('PREDICTION_MMAP_WEIGHTS', '1') == '1'
+# Load the prediction models only from the bundles created by the build_prediction_bundle command, never from the
+# network. Bundles are used whenever they exist, even if this is disabled.
+PREDICTION_OFFLINE = get_from_environ_or_default('PREDICTION_OFFLINE', '0') == '1'
+# Compute the checksums of the files of the bundles when they are loaded. Sizes are always checked.
+PREDICTION_BUNDLE_VERIFY_CHECKSUMS = get_from_environ_or_default('PREDICTION_BUNDLE_VERIFY_CHECKSUMS', '0') == '1'
+# Load the checkpoints into models whose weights are not initialized, so the peak memory of a load is about the
+# size of the model instead of twice as much
+PREDICTION_LOW_MEMORY_LOADING = get_from_environ_or_default('PREDICTION_LOW_MEMORY_LOADING', '0') == '1'
+# Serve the prediction endpoints with async views (for ASGI servers, see README). Predictions run in a pool of
+# PREDICTION_INFERENCE_WORKERS threads per model. The operations of torch then use PREDICTION_INFERENCE_TORCH_THREADS
+# threads, a limit shared by all the threads of the process.
+PREDICTION_ASYNC_VIEWS = get_from_environ_or_default('PREDICTION_ASYNC_VIEWS', '0') == '1'
+PREDICTION_INFERENCE_WORKERS = int(get_from_environ_or_default('PREDICTION_INFERENCE_WORKERS', '2'))
+PREDICTION_INFERENCE_TORCH_THREADS = int(get_from_environ_or_default(
+    'PREDICTION_INFERENCE_TORCH_THREADS', str(max(1, (os.cpu_count() or 1) // PREDICTION_INFERENCE_WORKERS))))
+# Path of the WebSocket endpoint of the editor predictions (ASGI servers only). The editor falls back to HTTP
+# requests when it can't connect. An empty value disables it.
+PREDICTION_WEBSOCKET_PATH = get_from_environ_or_default('PREDICTION_WEBSOCKET_PATH', '/ws/predict/')
+# Number of clients (pages or connections of a user in a document) whose latest prediction request is tracked, so
+# the requests superseded by a newer keystroke are dropped before inference. They are tracked per process, so they
+# only take effect with workers that serve several requests at the same time (threaded, async or WebSocket
+# connections).
+PREDICTION_MAX_TRACKED_SEQUENCES = int(get_from_environ_or_default('PREDICTION_MAX_TRACKED_SEQUENCES', '10000'))
+# Admission control of the prediction requests. At most PREDICTION_ADMISSION_SLOTS requests are served at the same
+# time (0 disables the admission control), PREDICTION_ADMISSION_COMPLETION_SLOTS of them long completions and
+# PREDICTION_ADMISSION_USER_SLOTS of them of the same user. Keystrokes are served before completions. Requests that
+# would wait longer than the budget of their class are shed: keystrokes get an empty prediction and completions a
+# 503 response with a Retry-After header. The slots and queues belong to each process, so they need workers that
+# serve several requests at the same time (threaded, see gunicorn.conf.py, or async).
+PREDICTION_ADMISSION_SLOTS = int(get_from_environ_or_default('PREDICTION_ADMISSION_SLOTS',
+                                                             str(PREDICTION_INFERENCE_WORKERS)))
+PREDICTION_ADMISSION_COMPLETION_SLOTS = int(get_from_environ_or_default('PREDICTION_ADMISSION_COMPLETION_SLOTS', '1'))
+PREDICTION_ADMISSION_USER_SLOTS = int(get_from_environ_or_default('PREDICTION_ADMISSION_USER_SLOTS', '2'))
+PREDICTION_KEYSTROKE_BUDGET_MS = int(get_from_environ_or_default('PREDICTION_KEYSTROKE_BUDGET_MS', '250'))
+PREDICTION_COMPLETION_BUDGET_MS = int(get_from_environ_or_default('PREDICTION_COMPLETION_BUDGET_MS', '5000'))
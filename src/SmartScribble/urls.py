@@ -13,11 +13,13 @@
 #  limitations under the License.
 #
 
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path
 
-from document.views import remove_document_view, edit_document_view, predict_view, full_predict_view, save_document_view
+from document.views import remove_document_view, edit_document_view, predict_view, full_predict_view, \
+    save_document_view, prediction_status_view, async_predict_view, async_full_predict_view
 from pages.views import profile_view, change_data_view
 from register.views import register_view, CustomLoginView, change_password_view, change_prediction_model_view, change_email_view, remove_user_view
 
@@ -33,8 +35,10 @@ urlpatterns = [
     path('edit/', edit_document_view, name='edit'),
     path('changedata/', change_data_view, name='changedata'),
     path('changepswd/', change_password_view, name='changepswd'),
-    path('predict/', predict_view, name='prediction'),
-    path('full_predict/', full_predict_view, name='complete_prediction'),
+    path('predict/', async_predict_view if settings.PREDICTION_ASYNC_VIEWS else predict_view, name='prediction'),
+    path('predict/status/', prediction_status_view, name='prediction_status'),
+    path('full_predict/', async_full_predict_view if settings.PREDICTION_ASYNC_VIEWS else full_predict_view,
+         name='complete_prediction'),
     path('changepm/', change_prediction_model_view, name='changepm'),
     path('changemail/', change_email_view, name='changemail'),
     path('remove_user/', remove_user_view, name='remove_user'),
@@ -0,0 +1,323 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import asyncio
+import contextlib
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Hashable, Optional
+
+from django.conf import settings
+
+# Classes of prediction requests, from highest to lowest priority
+KEYSTROKE = 'keystroke'
+COMPLETION = 'completion'
+PRIORITIES = (KEYSTROKE, COMPLETION)
+# Weight of the latest request in the average duration of its class
+DURATION_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """ Raised when a request is shed because it would wait longer than the latency budget of its class """
+
+    def __init__(self, kind: str, retry_after: int):
+        """
+
+        Args:
+            kind: Class of the request
+            retry_after: Seconds the client should wait before trying again
+
+        Returns: An instance of the exception
+
+        """
+        super().__init__(f'{kind} request shed, retry after {retry_after} s')
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    This class decides when the prediction requests are served. Requests take a slot while they are served, and
+    wait in the queue of their class when there is no free slot. Free slots go to keystrokes before completions,
+    and completions can't take every slot, so long generations don't stall the suggestions. Within a class, users
+    are served in turns and none of them can take more than a few slots. Requests that would wait longer than the
+    latency budget of their class are shed.
+    """
+
+    def __init__(self, slots: int, limits: dict, user_limit: int, budgets: dict):
+        """
+
+        Args:
+            slots: Maximum number of requests served at the same time. 0 disables the admission control.
+            limits: Maximum number of requests of every class served at the same time
+            user_limit: Maximum number of requests of a user served at the same time
+            budgets: Maximum seconds a request of every class waits for a slot
+
+        Returns: An instance of an admission controller
+
+        """
+        self._slots = slots
+        self._limits = limits
+        self._user_limit = user_limit
+        self._budgets = budgets
+        # Waiting requests of every class, by user. Users are served in the order of the dictionary.
+        self._queues = {kind: OrderedDict() for kind in PRIORITIES}
+        self._queued = Counter()
+        self._running = Counter()
+        self._user_running = Counter()
+        # Average seconds a request of every class takes once it is admitted
+        self._durations = {}
+        self._lock = threading.Lock()
+        self.admitted = Counter()
+        self.shed = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        """ False if every request is admitted at once """
+        return self._slots > 0
+
+    def _get_capacity(self, kind: str) -> int:
+        """
+
+        Args:
+            kind: Class of requests
+
+        Returns: Maximum number of requests of the class served at the same time
+
+        """
+        return max(1, min(self._slots, self._limits.get(kind, self._slots)))
+
+    def _estimate_wait(self, kind: str) -> float:
+        """
+        The lock must be held
+
+        Args:
+            kind: Class of a new request
+
+        Returns: Seconds a new request of the class is expected to wait for a slot
+
+        """
+        ahead = sum(self._queued[other] for other in PRIORITIES[:PRIORITIES.index(kind) + 1])
+        if not ahead and self._running[kind] < self._get_capacity(kind) and sum(self._running.values()) < self._slots:
+            return 0
+        return (ahead // self._get_capacity(kind) + 1) * self._durations.get(kind, 0)
+
+    def _get_retry_after(self, kind: str) -> int:
+        """
+        The lock must be held
+
+        Args:
+            kind: Class of a shed request
+
+        Returns: Seconds a client should wait before trying again
+
+        """
+        return max(1, math.ceil(max(self._estimate_wait(kind), self._budgets[kind])))
+
+    def _enqueue(self, user: Hashable, kind: str) -> Future:
+        """
+
+        Args:
+            user: User of the request
+            kind: Class of the request
+
+        Returns: Future that is resolved when the request is admitted. AdmissionRejected is raised if the request
+                 is expected to wait longer than the budget of its class.
+
+        """
+        with self._lock:
+            if self._estimate_wait(kind) > self._budgets[kind]:
+                self.shed[kind] += 1
+                raise AdmissionRejected(kind, self._get_retry_after(kind))
+            future = Future()
+            self._queues[kind].setdefault(user, deque()).append(future)
+            self._queued[kind] += 1
+            self._dispatch()
+            return future
+
+    def _next(self, kind: str) -> Optional[tuple]:
+        """
+        Take the next request of a class. Users are served in turns, skipping the ones at their limit.
+        The lock must be held.
+
+        Args:
+            kind: Class of requests
+
+        Returns: User and future of the admitted request, None if no request can be admitted
+
+        """
+        queue = self._queues[kind]
+        for user in list(queue):
+            if self._user_running[user] >= self._user_limit:
+                continue
+            waiting = queue[user]
+            while waiting:
+                future = waiting.popleft()
+                self._queued[kind] -= 1
+                # Requests whose client stopped waiting are skipped
+                if future.set_running_or_notify_cancel():
+                    if waiting:
+                        queue.move_to_end(user)
+                    else:
+                        del queue[user]
+                    return user, future
+            del queue[user]
+        return None
+
+    def _dispatch(self):
+        """ Admit the waiting requests that fit in the free slots. The lock must be held. """
+        for kind in PRIORITIES:
+            while sum(self._running.values()) < self._slots and self._running[kind] < self._get_capacity(kind):
+                admitted = self._next(kind)
+                if admitted is None:
+                    break
+                user, future = admitted
+                self._running[kind] += 1
+                self._user_running[user] += 1
+                self.admitted[kind] += 1
+                future.set_result(None)
+
+    def _withdraw(self, user: Hashable, kind: str, future: Future) -> bool:
+        """
+
+        Args:
+            user: User of the request
+            kind: Class of the request
+            future: Future of the request
+
+        Returns: True if the request left the queue, False if it was admitted meanwhile
+
+        """
+        with self._lock:
+            if not future.cancel():
+                return False
+            waiting = self._queues[kind].get(user)
+            if waiting is not None and future in waiting:
+                waiting.remove(future)
+                self._queued[kind] -= 1
+                if not waiting:
+                    del self._queues[kind][user]
+            return True
+
+    def _shed(self, kind: str):
+        """ Count a request that waited for its whole budget and raise AdmissionRejected """
+        with self._lock:
+            self.shed[kind] += 1
+            retry_after = self._get_retry_after(kind)
+        raise AdmissionRejected(kind, retry_after)
+
+    def _release(self, user: Hashable, kind: str, duration: Optional[float]):
+        """
+
+        Args:
+            user: User of a finished request
+            kind: Class of the request
+            duration: Seconds the request was served, None if it was not served
+
+        """
+        with self._lock:
+            self._running[kind] -= 1
+            self._user_running[user] -= 1
+            if not self._user_running[user]:
+                del self._user_running[user]
+            if duration is not None:
+                average = self._durations.get(kind)
+                self._durations[kind] = duration if average is None else \
+                    DURATION_SMOOTHING * duration + (1 - DURATION_SMOOTHING) * average
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def admit(self, user: Hashable, kind: str, required: bool = True):
+        """
+        Wait for a slot in the calling thread and hold it while the block runs
+
+        Args:
+            user: User of the request
+            kind: Class of the request
+            required: False if the request runs no inference (e.g. its result is cached). It is admitted at once
+                      without taking a slot, so it is never shed and doesn't count in the average duration.
+
+        """
+        if not self.enabled or not required:
+            yield
+            return
+        future = self._enqueue(user, kind)
+        try:
+            future.result(self._budgets[kind])
+        except FutureTimeoutError:
+            if self._withdraw(user, kind, future):
+                self._shed(kind)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(user, kind, time.monotonic() - start)
+
+    @contextlib.asynccontextmanager
+    async def admit_async(self, user: Hashable, kind: str, required: bool = True):
+        """
+        Wait for a slot without blocking the event loop and hold it while the block runs
+
+        Args:
+            user: User of the request
+            kind: Class of the request
+            required: False if the request runs no inference (e.g. its result is cached). It is admitted at once
+                      without taking a slot, so it is never shed and doesn't count in the average duration.
+
+        """
+        if not self.enabled or not required:
+            yield
+            return
+        future = self._enqueue(user, kind)
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self._budgets[kind])
+        except asyncio.TimeoutError:
+            if self._withdraw(user, kind, future):
+                self._shed(kind)
+        except asyncio.CancelledError:
+            # The client went away. If it got a slot meanwhile, the slot is freed without counting as served.
+            if not self._withdraw(user, kind, future):
+                self._release(user, kind, None)
+            raise
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(user, kind, time.monotonic() - start)
+
+    def stats(self) -> dict:
+        """
+
+        Returns: Requests waiting, served, admitted and shed, and average duration, per class
+
+        """
+        with self._lock:
+            return {kind: {
+                'queued': self._queued[kind],
+                'running': self._running[kind],
+                'admitted': self.admitted[kind],
+                'shed': self.shed[kind],
+                'duration_ms': self._durations[kind] * 1000 if kind in self._durations else None,
+            } for kind in PRIORITIES}
+
+
+admission_controller = AdmissionController(
+    settings.PREDICTION_ADMISSION_SLOTS,
+    {COMPLETION: settings.PREDICTION_ADMISSION_COMPLETION_SLOTS},
+    settings.PREDICTION_ADMISSION_USER_SLOTS,
+    {KEYSTROKE: settings.PREDICTION_KEYSTROKE_BUDGET_MS / 1000,
+     COMPLETION: settings.PREDICTION_COMPLETION_BUDGET_MS / 1000})
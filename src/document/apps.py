@@ -3,6 +3,24 @@ import os
 import sys
 
 from django.apps import AppConfig
+from django.conf import settings
+
+# Management commands that serve requests. The rest of commands (migrate, shell...) don't preload the models.
+SERVING_COMMANDS = ('runserver',)
+
+
+def is_serving() -> bool:
+    """
+
+    Returns: False if the process runs tests or a management command that doesn't serve requests
+
+    """
+    if 'test' in sys.argv or 'test' in os.environ:
+        return False
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program in ('manage.py', 'django-admin', 'django-admin.py', '__main__.py'):
+        return len(sys.argv) > 1 and sys.argv[1] in SERVING_COMMANDS
+    return True
 
 
 class DocumentConfig(AppConfig):
@@ -10,10 +28,16 @@ class DocumentConfig(AppConfig):
 
     def ready(self):
         from register.models import PredictionModels
+        from .preload import preload_models
         from .prediction import PredictionService
 
-        if not ('test' in sys.argv or 'test' in os.environ):
+        if is_serving():
             logger = logging.getLogger("DocumentConfig")
-            for model in PredictionModels:
-                logger.info(f"Preloading model {model.name}")
-                PredictionService.instance(model.name)
+            if settings.PREDICTION_PRELOAD == 'sync':
+                logger.info("Preloading models before serving requests")
+                preload_models()
+            elif settings.PREDICTION_PRELOAD == 'async':
+                for model in PredictionModels:
+                    logger.info(f"Preloading model {model.name}")
+                    # Models are loaded in background, so the server starts serving requests at once
+                    PredictionService.load_async(model.name)
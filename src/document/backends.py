@@ -0,0 +1,414 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+
+import torch
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from transformers.modeling_utils import Conv1D
+from transformers.utils import logging
+
+from .pruning import split_head
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+logger = logging.get_logger(__name__)
+
+# Plain fp32 PyTorch model
+TORCH_BACKEND = 'torch'
+# Linear layers of the body with int8 weights. Activations are quantized on the fly.
+QUANTIZED_BACKEND = 'quantized'
+# Body exported with the export_onnx command and run by ONNX Runtime
+ONNX_BACKEND = 'onnx'
+# Body traced with TorchScript and frozen
+TORCHSCRIPT_BACKEND = 'torchscript'
+# Weights and activations in bfloat16. The best tokens are ranked again in fp32.
+BFLOAT16_BACKEND = 'bfloat16'
+BACKENDS = (TORCH_BACKEND, QUANTIZED_BACKEND, ONNX_BACKEND, TORCHSCRIPT_BACKEND, BFLOAT16_BACKEND)
+
+ONNX_OPSET = 11
+# Number of tokens whose bfloat16 logits are computed again in fp32. It covers the alternative predictions.
+BFLOAT16_RERANK_SIZE = 64
+# CPU flags of the instructions that compute bfloat16 natively
+BFLOAT16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16')
+
+
+def convert_conv1d_to_linear(module: torch.nn.Module):
+    """
+    Replace the Conv1D layers of GPT-2 with the equivalent Linear layers, so they can be quantized
+
+    Args:
+        module: Module whose submodules are converted in place
+
+    """
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            input_size, output_size = child.weight.shape
+            linear = torch.nn.Linear(input_size, output_size)
+            # Conv1D stores the transposed weight of a Linear layer
+            linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            convert_conv1d_to_linear(child)
+
+
+def quantize(body: torch.nn.Module) -> torch.nn.Module:
+    """
+    Apply dynamic int8 quantization to the Linear layers of a model body. The language model head is not
+    quantized because it shares its weights with the input embeddings.
+
+    Args:
+        body: Body of a prediction model. It is modified in place.
+
+    Returns: The quantized body
+
+    """
+    if 'fbgemm' not in torch.backends.quantized.supported_engines:
+        # ARM CPUs
+        torch.backends.quantized.engine = 'qnnpack'
+    convert_conv1d_to_linear(body)
+    return torch.quantization.quantize_dynamic(body, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def get_onnx_path(pretrained: str) -> str:
+    """
+
+    Args:
+        pretrained: Name of the pretrained model
+
+    Returns: Path of the ONNX file with the body of the model
+
+    """
+    return os.path.join(settings.PREDICTION_ARTIFACTS_DIR, 'onnx', f'{pretrained}.onnx')
+
+
+def get_input_names(needs_mask: bool) -> list:
+    """
+
+    Args:
+        needs_mask: Whether the model uses mask
+
+    Returns: Names of the inputs of the body, in the order of the exported graph
+
+    """
+    if needs_mask:
+        return ['input_ids', 'attention_mask', 'token_type_ids']
+    return ['input_ids', 'attention_mask']
+
+
+class _ExportableBody(torch.nn.Module):
+    """ This class wraps a model body so that inputs and outputs are flat lists of tensors """
+
+    def __init__(self, body: torch.nn.Module, input_names: list, with_past: bool):
+        super().__init__()
+        self.body = body
+        self.input_names = input_names
+        self.with_past = with_past
+
+    def forward(self, *inputs):
+        named_inputs = dict(zip(self.input_names, inputs))
+        if not self.with_past:
+            return self.body(**named_inputs, return_dict=False)[0]
+        past = inputs[len(self.input_names):]
+        hidden_states, presents = self.body(**named_inputs, past_key_values=past, use_cache=True,
+                                            return_dict=False)[:2]
+        return (hidden_states,) + tuple(presents)
+
+
+def export_onnx(body: torch.nn.Module, needs_mask: bool, path: str, with_past: bool = False):
+    """
+    Export the body of a prediction model to ONNX. The batch and sequence axes are dynamic.
+
+    Args:
+        body: Body of the prediction model
+        needs_mask: Whether the model uses mask
+        path: Path of the ONNX file
+        with_past: Add the key/value cache of previous tokens to the inputs and outputs (only models that don't
+                   use mask)
+
+    """
+    config = body.config
+    with_past = with_past and not needs_mask
+    input_names = get_input_names(needs_mask)
+    output_names = ['hidden_states']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + output_names}
+    sequence_length = 4
+    inputs = [torch.ones(1, sequence_length, dtype=torch.long)]
+    inputs += [torch.ones(1, sequence_length, dtype=torch.long)]
+    if needs_mask:
+        inputs += [torch.zeros(1, sequence_length, dtype=torch.long)]
+    if with_past:
+        # The attention mask also covers the previous tokens
+        past_length = 2
+        dynamic_axes['attention_mask'] = {0: 'batch', 1: 'total_sequence'}
+        inputs[1] = torch.ones(1, past_length + sequence_length, dtype=torch.long)
+        head_size = config.hidden_size // config.num_attention_heads
+        for layer in range(config.num_hidden_layers):
+            inputs.append(torch.zeros(2, 1, config.num_attention_heads, past_length, head_size))
+            input_names.append(f'past_{layer}')
+            output_names.append(f'present_{layer}')
+            dynamic_axes[f'past_{layer}'] = {1: 'batch', 3: 'past_sequence'}
+            dynamic_axes[f'present_{layer}'] = {1: 'batch', 3: 'total_sequence'}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    body.eval()
+    with torch.no_grad():
+        torch.onnx.export(_ExportableBody(body, get_input_names(needs_mask), with_past), tuple(inputs), path,
+                          input_names=input_names, output_names=output_names, dynamic_axes=dynamic_axes,
+                          opset_version=ONNX_OPSET, do_constant_folding=True)
+
+
+class OnnxBody:
+    """
+    This class runs a body exported with export_onnx in ONNX Runtime. It is called like the PyTorch body it
+    replaces.
+    """
+
+    def __init__(self, path: str, config):
+        """
+
+        Args:
+            path: Path of the ONNX file
+            config: Configuration of the model
+
+        Returns: An instance of an ONNX body
+
+        """
+        if onnxruntime is None:
+            raise ImproperlyConfigured('The onnx prediction backend requires the onnxruntime package.')
+        if not os.path.exists(path):
+            raise ImproperlyConfigured(f'{path} does not exist. Create it with the export_onnx command.')
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = torch.get_num_threads()
+        self._session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self._input_names = [graph_input.name for graph_input in self._session.get_inputs()]
+        self._num_layers = len([name for name in self._input_names if name.startswith('past_')])
+        self._num_heads = config.num_attention_heads
+        self._head_size = config.hidden_size // config.num_attention_heads
+
+    @property
+    def supports_past(self) -> bool:
+        """
+
+        Returns: True if the key/value cache of previous tokens can be reused
+
+        """
+        return self._num_layers > 0
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor = None,
+                 token_type_ids: torch.Tensor = None, past_key_values=None, use_cache: bool = False) -> tuple:
+        """
+
+        Args:
+            input_ids: Token ids
+            attention_mask: Attention mask. By default, all the tokens are attended.
+            token_type_ids: Segment ids (only models that use mask)
+            past_key_values: Key/value cache of previous tokens
+            use_cache: Return the key/value cache
+
+        Returns: Hidden states and, if use_cache, key/value cache
+
+        """
+        batch_size, sequence_length = input_ids.shape
+        if past_key_values is None and self.supports_past:
+            past_key_values = [torch.zeros(2, batch_size, self._num_heads, 0, self._head_size)] * self._num_layers
+        past_length = past_key_values[0].shape[-2] if past_key_values is not None else 0
+        if attention_mask is None:
+            attention_mask = torch.ones(batch_size, past_length + sequence_length, dtype=torch.long)
+        elif past_length:
+            attention_mask = torch.cat([torch.ones(batch_size, past_length, dtype=attention_mask.dtype),
+                                        attention_mask], dim=1)
+        feed = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._input_names:
+            feed['token_type_ids'] = token_type_ids if token_type_ids is not None else torch.zeros_like(input_ids)
+        for layer in range(self._num_layers):
+            feed[f'past_{layer}'] = past_key_values[layer]
+        outputs = self._session.run(None, {name: value.contiguous().numpy() for name, value in feed.items()})
+        hidden_states = torch.from_numpy(outputs[0])
+        if not use_cache:
+            return hidden_states,
+        return hidden_states, tuple(torch.from_numpy(present) for present in outputs[1:])
+
+
+class TorchScriptBody:
+    """
+    This class runs the body of a prediction model traced with TorchScript. It is called like the PyTorch body it
+    replaces. The key/value cache of previous tokens is not supported.
+    """
+    supports_past = False
+
+    def __init__(self, body: torch.nn.Module, needs_mask: bool, warmup_lengths: list = ()):
+        """
+
+        Args:
+            body: Body of the prediction model
+            needs_mask: Whether the model uses mask
+            warmup_lengths: Sequence lengths run once the body is traced, so that the optimizations of the graph
+                            are not done while serving predictions
+
+        Returns: An instance of a TorchScript body
+
+        """
+        self._needs_mask = needs_mask
+        body.eval()
+        with torch.no_grad():
+            module = torch.jit.trace(_ExportableBody(body, get_input_names(needs_mask), False),
+                                     self._get_inputs(1, 8), check_trace=False)
+            if hasattr(torch.jit, 'freeze'):
+                # Freezing inlines the weights as constants and enables further optimizations (PyTorch >= 1.7)
+                module = torch.jit.freeze(module)
+        self._module = module
+        self.warm_up(warmup_lengths)
+
+    def _get_inputs(self, batch_size: int, sequence_length: int) -> tuple:
+        """
+
+        Args:
+            batch_size: Number of rows
+            sequence_length: Number of tokens of every row
+
+        Returns: Inputs of the body with the given shape
+
+        """
+        inputs = (torch.ones(batch_size, sequence_length, dtype=torch.long),
+                  torch.ones(batch_size, sequence_length, dtype=torch.long))
+        if self._needs_mask:
+            inputs += (torch.zeros(batch_size, sequence_length, dtype=torch.long),)
+        return inputs
+
+    def warm_up(self, lengths: list):
+        """
+
+        Args:
+            lengths: Sequence lengths. Every graph is run twice because the profiling executor optimizes it
+                     on the second run.
+
+        """
+        with torch.no_grad():
+            for length in lengths:
+                for _ in range(2):
+                    self._module(*self._get_inputs(1, length))
+
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor = None,
+                 token_type_ids: torch.Tensor = None, past_key_values=None, use_cache: bool = False) -> tuple:
+        """
+
+        Args:
+            input_ids: Token ids
+            attention_mask: Attention mask. By default, all the tokens are attended.
+            token_type_ids: Segment ids (only models that use mask)
+            past_key_values: Not supported, it must be None
+            use_cache: Not supported, it must be False
+
+        Returns: Hidden states
+
+        """
+        if past_key_values is not None or use_cache:
+            raise ValueError('TorchScript bodies do not support the key/value cache')
+        inputs = (input_ids, attention_mask if attention_mask is not None else torch.ones_like(input_ids))
+        if self._needs_mask:
+            inputs += (token_type_ids if token_type_ids is not None else torch.zeros_like(input_ids),)
+        return self._module(*inputs),
+
+
+def is_bfloat16_supported() -> bool:
+    """
+
+    Returns: True if the installed PyTorch can run the operations of the models in bfloat16 on CPU
+
+    """
+    try:
+        with torch.no_grad():
+            layer = torch.nn.Linear(8, 8).to(torch.bfloat16)
+            hidden_states = torch.nn.functional.layer_norm(layer(torch.ones(2, 8, dtype=torch.bfloat16)), (8,))
+            torch.softmax(hidden_states, dim=-1).float()
+    except RuntimeError:
+        return False
+    return True
+
+
+def has_native_bfloat16() -> bool:
+    """
+
+    Returns: True if the CPU computes bfloat16 natively. Otherwise, bfloat16 is emulated and slow.
+
+    """
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            return any(flag in cpuinfo.read().split() for flag in BFLOAT16_CPU_FLAGS)
+    except OSError:
+        return False
+
+
+def to_bfloat16(model: torch.nn.Module) -> torch.nn.Module:
+    """
+
+    Args:
+        model: Prediction model. It is modified in place.
+
+    Returns: The model with bfloat16 weights
+
+    """
+    if not is_bfloat16_supported():
+        raise ImproperlyConfigured('The installed PyTorch does not support bfloat16 inference on CPU.')
+    if not has_native_bfloat16():
+        logger.warning('The CPU has no bfloat16 instructions. The bfloat16 backend will be slower than fp32.')
+    return model.to(torch.bfloat16)
+
+
+class Bfloat16Head:
+    """
+    This class applies a bfloat16 language model head and computes the logits of the best tokens again in fp32,
+    so that rounding errors do not change the order of the predictions.
+    """
+
+    def __init__(self, head, rerank_size: int = BFLOAT16_RERANK_SIZE):
+        """
+
+        Args:
+            head: Language model head with bfloat16 weights
+            rerank_size: Number of tokens whose logits are computed in fp32
+
+        Returns: An instance of a bfloat16 head
+
+        """
+        self._head = head
+        self._transform, decoder = split_head(head)
+        self._weight = decoder.weight
+        self._bias = decoder.bias
+        self._rerank_size = rerank_size
+
+    def __call__(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        """
+
+        Args:
+            hidden_states: Hidden states of the predicted items
+
+        Returns: fp32 logits over the full vocabulary
+
+        """
+        transformed_states = self._transform(hidden_states)
+        logits = torch.nn.functional.linear(transformed_states, self._weight, self._bias).float()
+        token_ids = logits.topk(min(self._rerank_size, logits.shape[-1]), dim=-1).indices
+        # Dot products of the best tokens accumulated in fp32
+        best_logits = torch.einsum('bh,bkh->bk', transformed_states.float(), self._weight[token_ids].float())
+        if self._bias is not None:
+            best_logits += self._bias[token_ids].float()
+        return logits.scatter(1, token_ids, best_logits)
@@ -0,0 +1,201 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+MIN_BUCKET_LENGTH = 8
+
+
+def get_length_bucket(length: int) -> int:
+    """
+
+    Args:
+        length: Number of tokens of an input
+
+    Returns: Smallest power of two (at least MIN_BUCKET_LENGTH) that fits the input
+
+    """
+    bucket = MIN_BUCKET_LENGTH
+    while bucket < length:
+        bucket *= 2
+    return bucket
+
+
+class PredictionBatcher:
+    """ This class groups concurrent prediction requests of a model into batches """
+
+    def __init__(self, predict_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait: float):
+        """
+
+        Args:
+            predict_batch: Function that receives a list of inputs and returns a list with one result per input
+            max_batch_size: Maximum number of inputs processed in a single batch
+            max_wait: Maximum time (seconds) a request waits for other requests to join its batch
+
+        Returns: An instance of a prediction batcher
+
+        """
+        self._predict_batch = predict_batch
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+        self._active = 0
+        self._closed = False
+
+    def submit(self, item: Any, bucket: int, cancelled: Callable[[], bool] = None) -> Any:
+        """
+        Queue an input and wait until its batch has been processed
+
+        Args:
+            item: Input for the prediction
+            bucket: Inputs are only batched with inputs of the same bucket
+            cancelled: Function that tells whether the input is no longer needed. It is called when the batch is
+                       formed, and cancelled inputs are not processed.
+
+        Returns: Result of the prediction for this input. CancelledError is raised if the input was cancelled.
+
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                # The model is being unloaded, so its last requests don't start a new worker
+                return self._predict_batch([item])[0]
+            self._ensure_worker()
+            self._active += 1
+            self._queue.put((bucket, item, future, cancelled))
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def close(self):
+        """
+        Stop the worker thread once the queued requests are processed. The worker holds the prediction function,
+        and with it the model, until it stops. Requests submitted later are processed in the calling thread.
+
+        """
+        with self._lock:
+            self._closed = True
+            worker = self._worker
+            if worker is None or not worker.is_alive() or self._pid != os.getpid():
+                return
+            self._queue.put(None)
+        if worker is not threading.current_thread():
+            worker.join()
+        with self._lock:
+            self._worker = None
+            self._queue = None
+
+    def _ensure_worker(self):
+        """
+        Start the worker thread if it is not running. Threads do not survive a fork, so the worker is restarted
+        when the batcher is used from a new process.
+
+        """
+        if self._worker is not None and self._worker.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._active = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, args=(self._queue,), name='PredictionBatcher',
+                                        daemon=True)
+        self._worker.start()
+
+    def _others_waiting(self, collected: int) -> bool:
+        """
+
+        Args:
+            collected: Number of requests already collected for the next batch
+
+        Returns: True if there are submitted requests that are not part of the batch yet
+
+        """
+        with self._lock:
+            return self._active > collected
+
+    def _collect(self, requests: queue.Queue) -> list:
+        """
+
+        Args:
+            requests: Queue of pending requests
+
+        Returns: List of requests that will be processed together
+
+        """
+        pending = [requests.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(pending) < self._max_batch_size:
+            try:
+                pending.append(requests.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            # Don't make a lonely request wait for nobody
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or not self._others_waiting(len(pending)):
+                break
+            try:
+                pending.append(requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return pending
+
+    def _run(self, requests: queue.Queue):
+        """
+        Worker loop: collect requests and process them grouped by bucket
+
+        Args:
+            requests: Queue of pending requests
+
+        """
+        stopped = False
+        while not stopped:
+            buckets = {}
+            for request in self._collect(requests):
+                if request is None:
+                    # The batcher was closed. Nothing is queued after this.
+                    stopped = True
+                    continue
+                bucket, item, future, cancelled = request
+                if cancelled is not None and cancelled():
+                    future.cancel()
+                    continue
+                buckets.setdefault(bucket, []).append((item, future))
+            for batch in buckets.values():
+                self._run_batch(batch)
+
+    def _run_batch(self, batch: list):
+        """
+
+        Args:
+            batch: List of (input, future) pairs
+
+        """
+        try:
+            results = self._predict_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
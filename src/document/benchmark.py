@@ -0,0 +1,115 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import statistics
+import time
+
+# Inputs used when no corpus is given
+SAMPLE_TEXTS = [
+    'How are ',
+    'The weather today is',
+    'Thank you very much for your',
+    'I would like to',
+    'The meeting has been moved to',
+    'Please let me know if you have any',
+    'We are looking forward to',
+    'This document describes the',
+    'In my opinion, the best way to',
+    'The results of the experiment show that',
+    'Once upon a time there was a',
+    'I am writing to you because',
+]
+
+
+def load_texts(path: str = None) -> list:
+    """
+
+    Args:
+        path: Text file with one input per line
+
+    Returns: Inputs for the benchmark
+
+    """
+    if path is None:
+        return list(SAMPLE_TEXTS)
+    with open(path) as texts_file:
+        return [line.rstrip('\n') for line in texts_file if line.strip()]
+
+
+def measure(prediction_model, texts: list, repeat: int) -> tuple:
+    """
+    Measure the latency of the predictions. Caches are not used.
+
+    Args:
+        prediction_model: Prediction model
+        texts: Inputs
+        repeat: Number of times every input is predicted
+
+    Returns: Predicted sentences and latencies in milliseconds
+
+    """
+    # Warm-up, so lazily built structures are not measured
+    predictions = [prediction_model._run_prediction(text) for text in texts]
+    latencies = []
+    for _ in range(repeat):
+        for text in texts:
+            start = time.perf_counter()
+            prediction_model._run_prediction(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return predictions, latencies
+
+
+def summarize(latencies: list) -> dict:
+    """
+
+    Args:
+        latencies: Latencies in milliseconds
+
+    Returns: Statistics of the latencies
+
+    """
+    latencies = sorted(latencies)
+    return {
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def compare(reference, candidate, texts: list, repeat: int) -> dict:
+    """
+
+    Args:
+        reference: Prediction model used as reference
+        candidate: Prediction model compared with the reference
+        texts: Inputs
+        repeat: Number of times every input is predicted
+
+    Returns: Latency of both models, speedup of the candidate, fraction of equal predictions and number of
+                 changed predictions
+
+    """
+    reference_predictions, reference_latencies = measure(reference, texts, repeat)
+    candidate_predictions, candidate_latencies = measure(candidate, texts, repeat)
+    reference_summary = summarize(reference_latencies)
+    candidate_summary = summarize(candidate_latencies)
+    agreement = sum(reference_prediction == candidate_prediction for reference_prediction, candidate_prediction
+                    in zip(reference_predictions, candidate_predictions))
+    return {
+        'reference': reference_summary,
+        'candidate': candidate_summary,
+        'speedup': reference_summary['mean_ms'] / candidate_summary['mean_ms'],
+        'top1_agreement': agreement / len(texts),
+        'top1_changes': len(texts) - agreement,
+    }
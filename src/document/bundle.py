@@ -0,0 +1,152 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import torch
+import transformers
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .weights import assign_weights, create_empty_model, create_pretrained_model, load_flat_weights, save_flat_weights
+
+BUNDLE_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+TOKENIZER_DIR = 'tokenizer'
+WEIGHTS_FILE = 'weights.bin'
+
+
+def get_bundle_path(pretrained: str) -> str:
+    """
+
+    Args:
+        pretrained: Name of the pretrained model
+
+    Returns: Directory of the bundle of the model
+
+    """
+    return os.path.join(settings.PREDICTION_ARTIFACTS_DIR, 'bundles', f'{pretrained}')
+
+
+def get_checksum(path: str) -> str:
+    """
+
+    Args:
+        path: Path of a file
+
+    Returns: SHA-256 of the file
+
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as bundle_file:
+        for chunk in iter(lambda: bundle_file.read(2 ** 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_bundle(tokenizer, head_model, pretrained: str, path: str) -> dict:
+    """
+    Write the tokenizer files, the configuration and the flat weights of a model in a directory, with a manifest
+    that contains the checksum of every file. An existing bundle is replaced only once the new one is complete.
+
+    Args:
+        tokenizer: Class of tokenizer
+        head_model: Class of prediction model
+        pretrained: Name of the pretrained model
+        path: Directory of the bundle
+
+    Returns: Manifest of the bundle
+
+    """
+    building_path = f'{path}.building'
+    shutil.rmtree(building_path, ignore_errors=True)
+    os.makedirs(building_path)
+    tokenizer.from_pretrained(pretrained).save_pretrained(os.path.join(building_path, TOKENIZER_DIR))
+    model = create_pretrained_model(head_model, pretrained)
+    model.config.save_pretrained(building_path)
+    save_flat_weights(model, os.path.join(building_path, WEIGHTS_FILE))
+
+    files = {}
+    for directory, _, names in os.walk(building_path):
+        for name in names:
+            file_path = os.path.join(directory, name)
+            files[os.path.relpath(file_path, building_path)] = {
+                'size': os.path.getsize(file_path),
+                'sha256': get_checksum(file_path),
+            }
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'pretrained': pretrained,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'transformers': transformers.__version__,
+        'torch': torch.__version__,
+        'files': files,
+    }
+    with open(os.path.join(building_path, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(building_path, path)
+    return manifest
+
+
+def read_manifest(path: str, verify_checksums: bool = False) -> dict:
+    """
+
+    Args:
+        path: Directory of the bundle
+        verify_checksums: Compute the checksums of the files. Otherwise, only their sizes are checked.
+
+    Returns: Manifest of the bundle. ImproperlyConfigured is raised if the bundle is missing or corrupted.
+
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ImproperlyConfigured(f'There is no bundle in {path}. Create it with the build_prediction_bundle '
+                                   f'command.')
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ImproperlyConfigured(f'The bundle in {path} has version {manifest.get("version")}, '
+                                   f'{BUNDLE_VERSION} is required.')
+    for name, description in manifest['files'].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != description['size']:
+            raise ImproperlyConfigured(f'{file_path} is missing or incomplete.')
+        if verify_checksums and get_checksum(file_path) != description['sha256']:
+            raise ImproperlyConfigured(f'The checksum of {file_path} does not match the manifest.')
+    return manifest
+
+
+def load_bundle(tokenizer, head_model, path: str) -> tuple:
+    """
+    Load a model only from the files of its bundle. The network is never used.
+
+    Args:
+        tokenizer: Class of tokenizer
+        head_model: Class of prediction model
+        path: Directory of the bundle
+
+    Returns: The tokenizer and the model
+
+    """
+    read_manifest(path, settings.PREDICTION_BUNDLE_VERIFY_CHECKSUMS)
+    loaded_tokenizer = tokenizer.from_pretrained(os.path.join(path, TOKENIZER_DIR), local_files_only=True)
+    model = create_empty_model(head_model, head_model.config_class.from_pretrained(path, local_files_only=True))
+    assign_weights(model, load_flat_weights(os.path.join(path, WEIGHTS_FILE)))
+    return loaded_tokenizer, model
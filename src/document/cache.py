@@ -0,0 +1,179 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+class PredictionCache:
+    """ This class stores the latest predictions. It is bounded by number of entries and size """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        """
+
+        Args:
+            max_entries: Maximum number of stored predictions
+            max_bytes: Maximum size of the stored keys and predictions
+
+        Returns: An instance of a prediction cache
+
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _get_size(key: tuple, value) -> int:
+        """
+
+        Args:
+            key: Key of an entry
+            value: Value of an entry, a prediction or a list of predictions and probabilities
+
+        Returns: Approximate size of the entry in bytes
+
+        """
+        size = sum(sys.getsizeof(part) for part in key) + sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(item) + sum(sys.getsizeof(part) for part in item) for item in value)
+        return size
+
+    def get(self, key: tuple):
+        """
+
+        Args:
+            key: Model name and normalized input
+
+        Returns: The stored prediction or None if it is not stored
+
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def contains(self, key: tuple) -> bool:
+        """
+
+        Args:
+            key: Model name and normalized input
+
+        Returns: True if the prediction is stored. Unlike get, it doesn't count as a hit or a miss.
+
+        """
+        with self._lock:
+            return key in self._entries
+
+    def set(self, key: tuple, value):
+        """
+
+        Args:
+            key: Model name and normalized input
+            value: Prediction or candidates
+
+        """
+        size = self._get_size(key, value)
+        if size > self._max_bytes or self._max_entries < 1:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._get_size(key, self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                old_key, old_value = self._entries.popitem(last=False)
+                self._bytes -= self._get_size(old_key, old_value)
+
+    def stats(self) -> dict:
+        """
+
+        Returns: Counters of the cache
+
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+class SharedPredictionCache:
+    """
+    This class stores predictions in a cache of the Django cache framework, so they can be shared by several
+    processes and kept across restarts
+    """
+
+    def __init__(self, alias: str):
+        """
+
+        Args:
+            alias: Name of the cache in the CACHES setting
+
+        Returns: An instance of a shared prediction cache
+
+        """
+        self._cache = caches[alias]
+
+    @staticmethod
+    def make_key(model: str, revision: str, text: str) -> str:
+        """
+
+        Args:
+            model: Name of the model
+            revision: Revision of the weights of the model
+            text: Normalized input
+
+        Returns: Key of the prediction. It is safe for any cache backend.
+
+        """
+        return f'prediction:{model}:{revision}:{hashlib.sha1(text.encode()).hexdigest()}'
+
+    def get(self, model: str, revision: str, text: str):
+        """
+
+        Args:
+            model: Name of the model
+            revision: Revision of the weights of the model
+            text: Normalized input
+
+        Returns: The stored prediction or None if it is not stored
+
+        """
+        return self._cache.get(self.make_key(model, revision, text))
+
+    def set(self, model: str, revision: str, text: str, value):
+        """
+
+        Args:
+            model: Name of the model
+            revision: Revision of the weights of the model
+            text: Normalized input
+            value: Prediction or candidates
+
+        """
+        self._cache.set(self.make_key(model, revision, text), value)
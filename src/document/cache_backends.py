@@ -0,0 +1,107 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class SQLiteCache(BaseCache):
+    """
+    Persistent cache stored in a single SQLite file. All the processes of a node that use the same file share
+    the entries, and the entries survive restarts.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+    # Counting the entries is not free, so the size is only checked every few writes
+    cull_check_interval = 100
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = os.path.abspath(location)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+
+        Returns: Connection of the current thread and process to the cache file
+
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _get_key(self, key, version) -> str:
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        row = self._connection().execute('SELECT value, expires FROM cache WHERE key = ?',
+                                         (self._get_key(key, version),)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._connection().execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                                   (self._get_key(key, version), pickle.dumps(value, self.pickle_protocol),
+                                    self.get_backend_timeout(timeout)))
+        self._writes += 1
+        if self._writes % self.cull_check_interval == 0:
+            self._cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.has_key(key, version):
+            return False
+        self.set(key, value, timeout, version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._connection().execute('UPDATE cache SET expires = ? WHERE key = ?',
+                                            (self.get_backend_timeout(timeout), self._get_key(key, version)))
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        cursor = self._connection().execute('DELETE FROM cache WHERE key = ?', (self._get_key(key, version),))
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version) is not self
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def _cull(self):
+        """ Remove expired entries and, if the cache is still full, a fraction of the oldest ones """
+        connection = self._connection()
+        if connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0] <= self._max_entries:
+            return
+        connection.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?', (time.time(),))
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries and self._cull_frequency:
+            connection.execute('DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid LIMIT ?)',
+                               (count // self._cull_frequency,))
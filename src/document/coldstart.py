@@ -0,0 +1,141 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Cold start of a prediction model. It is run in a new process for every measurement, so nothing is imported or
+loaded beforehand:
+
+    python -m document.coldstart GPT2
+
+The measurements are written to the standard output as a JSON object.
+"""
+import argparse
+import contextlib
+import importlib
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from document.benchmark import load_texts
+from document.memory import get_rss
+
+# Stages of the cold start, in the order they happen
+STAGES = ('django_setup', 'import', 'tokenizer_load', 'model_load', 'first_prediction', 'tenth_prediction')
+# Number of predictions made after loading the model
+PREDICTIONS = 10
+# Preloading and caches would hide the cost of the stages
+ENVIRONMENT = {
+    'PREDICTION_PRELOAD': 'none',
+    'PREDICTION_CACHE_MAX_ENTRIES': '0',
+    'PREDICTION_SHARED_CACHE': '',
+}
+
+
+@contextlib.contextmanager
+def measure_stage(stages: dict, stage: str):
+    """
+    Measure the time spent in the block and the resident memory of the process after it
+
+    Args:
+        stages: Measurements of the stages, updated with the new one
+        stage: Name of the stage
+
+    """
+    start = time.perf_counter()
+    yield
+    stages[stage] = {'seconds': time.perf_counter() - start, 'rss_mb': get_rss() / 2 ** 20}
+
+
+def run(prediction_model: str, texts: list) -> dict:
+    """
+
+    Args:
+        prediction_model: Name of the prediction model
+        texts: Inputs of the predictions. They are reused if there are less than PREDICTIONS.
+
+    Returns: Time and resident memory after every stage, and versions of the main dependencies
+
+    """
+    stages = {}
+    start_rss = get_rss() / 2 ** 20
+    with measure_stage(stages, 'django_setup'):
+        import django
+        django.setup()
+    with measure_stage(stages, 'import'):
+        prediction = importlib.import_module('document.prediction')
+        # Prediction dependencies are imported on first use, so they are imported explicitly here
+        prediction.torch.load()
+        prediction.transformers.load()
+    tokenizer, _, pretrained, _ = prediction.PredictionService.get_params(prediction_model)
+    with measure_stage(stages, 'tokenizer_load'):
+        tokenizer.from_pretrained(pretrained)
+    with measure_stage(stages, 'model_load'):
+        # The tokenizer is loaded again, from the files downloaded in the previous stage
+        model = prediction.PredictionService.instance(prediction_model)
+    for index, text in enumerate(itertools.islice(itertools.cycle(texts), PREDICTIONS)):
+        if index == 0:
+            with measure_stage(stages, 'first_prediction'):
+                model.get_prediction(text)
+        elif index == PREDICTIONS - 1:
+            with measure_stage(stages, 'tenth_prediction'):
+                model.get_prediction(text)
+        else:
+            model.get_prediction(text)
+    return {
+        'start_rss_mb': start_rss,
+        'stages': stages,
+        'versions': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'torch': prediction.torch.__version__,
+            'transformers': prediction.transformers.__version__,
+        },
+    }
+
+
+def summarize_runs(runs: list) -> dict:
+    """
+
+    Args:
+        runs: Measurements of several cold starts of the same model
+
+    Returns: Median time and resident memory of every stage
+
+    """
+    return {
+        stage: {
+            'seconds': statistics.median(run_result['stages'][stage]['seconds'] for run_result in runs),
+            'rss_mb': statistics.median(run_result['stages'][stage]['rss_mb'] for run_result in runs),
+        }
+        for stage in STAGES
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold start of a prediction model')
+    parser.add_argument('model', help='Name of the prediction model')
+    parser.add_argument('--texts', help='Text file with one input per line')
+    arguments = parser.parse_args()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartScribble.settings')
+    os.environ.update(ENVIRONMENT)
+    json.dump(run(arguments.model, load_texts(arguments.texts)), sys.stdout)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import asyncio
+import itertools
+import json
+import logging
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http.request import split_domain_port, validate_host
+
+from .admission import KEYSTROKE, AdmissionRejected, admission_controller
+from .inference import inference_executor
+from .prediction import PredictionService, sequence_tracker
+from .views import get_empty_prediction_response, get_prediction_response, get_shed_prediction_response
+
+# Close code of rejected connections. Codes from 4000 to 4999 are reserved for applications.
+CLOSE_FORBIDDEN = 4403
+# Identifiers of the connections, part of the keys of their inference sessions and sequence numbers
+connection_ids = itertools.count(1)
+
+logger = logging.getLogger(__name__)
+
+
+def get_headers(scope: dict) -> dict:
+    """
+
+    Args:
+        scope: ASGI connection scope
+
+    Returns: Headers of the connection, with lowercase names
+
+    """
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+
+def is_allowed_origin(headers: dict) -> bool:
+    """
+    Browsers send the origin of the page that opens a WebSocket. Connections opened by pages of other sites are
+    rejected, since they would be authenticated with the session cookie of the user.
+
+    Args:
+        headers: Headers of the connection
+
+    Returns: True if the connection comes from a page of this site
+
+    """
+    origin = urlparse(headers.get('origin', ''))
+    host = headers.get('host', '')
+    if not origin.netloc or origin.netloc != host:
+        return False
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+def authenticate(headers: dict):
+    """
+
+    Args:
+        headers: Headers of the connection
+
+    Returns: Id and prediction model of the user of the session cookie, None if there is no authenticated user
+
+    """
+    cookie = SimpleCookie()
+    cookie.load(headers.get('cookie', ''))
+    if settings.SESSION_COOKIE_NAME not in cookie:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(cookie[settings.SESSION_COOKIE_NAME].value)
+    user = get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated:
+        return None
+    return user.pk, user.settings.prediction_model
+
+
+def is_integer(value) -> bool:
+    """
+
+    Args:
+        value: Value of a decoded JSON message
+
+    Returns: True if the value is an integer. JSON booleans are decoded as bool, which is a subclass of int.
+
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_message(text: str) -> tuple:
+    """
+
+    Args:
+        text: Message of the client: {"seq": 1, "input": "Hello, how", "id": "3", "k": 5}. The document (id) and
+              the number of candidates (k) are optional.
+
+    Returns: Sequence number, input text, document and number of candidates (None for a single prediction)
+
+    """
+    message = json.loads(text)
+    if not isinstance(message, dict) or not is_integer(message.get('seq')) or not isinstance(message.get('input'), str):
+        raise ValueError('Wrong message')
+    document = message.get('id')
+    # The document is part of the keys of the sessions and the sequence numbers, so it must be hashable
+    if document is not None and not isinstance(document, str) and not is_integer(document):
+        raise ValueError('Wrong document')
+    k = message.get('k')
+    if k is not None:
+        if not is_integer(k):
+            raise ValueError('Wrong number of candidates')
+        k = max(min(k, settings.PREDICTION_MAX_CANDIDATES), 1)
+    return message['seq'], message['input'], document, k
+
+
+class PredictionConsumer:
+    """
+    This class serves the predictions of an editor through a WebSocket connection. The user is authenticated once,
+    when the connection is opened, so every keystroke only costs a message and the prediction.
+    """
+
+    def __init__(self, scope: dict, receive, send):
+        """
+
+        Args:
+            scope: ASGI connection scope
+            receive: ASGI function that receives the events of the connection
+            send: ASGI function that sends events through the connection
+
+        Returns: An instance of a prediction consumer
+
+        """
+        self._scope = scope
+        self._receive = receive
+        self._send = send
+        self._user_pk = None
+        self._prediction_model = None
+        self._connection_id = next(connection_ids)
+        self._tasks = set()
+
+    async def run(self):
+        """ Serve the connection until it is closed """
+        try:
+            while True:
+                event = await self._receive()
+                if event['type'] == 'websocket.connect':
+                    await self._connect()
+                elif event['type'] == 'websocket.receive':
+                    self._start(event.get('text') or (event.get('bytes') or b'').decode())
+                elif event['type'] == 'websocket.disconnect':
+                    break
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    async def _connect(self):
+        """ Accept the connection if it comes from a page of this site and the user is authenticated """
+        headers = get_headers(self._scope)
+        user = await sync_to_async(authenticate)(headers) if is_allowed_origin(headers) else None
+        if user is None:
+            await self._send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+            return
+        self._user_pk, self._prediction_model = user
+        await self._send({'type': 'websocket.accept'})
+
+    def _start(self, text: str):
+        """
+        Predict in a new task, so the messages that arrive meanwhile are received. The message supersedes the
+        previous ones of its document as soon as it is received.
+
+        Args:
+            text: Message of the client
+
+        """
+        try:
+            seq, input_text, document, k = parse_message(text)
+        except (ValueError, TypeError):
+            coroutine = self._send_json({'error': 'Wrong message.'})
+        else:
+            # The sequence numbers of the connection only supersede its own messages, not those of other
+            # connections with the same document open
+            session_key = (self._user_pk, document, self._connection_id)
+            coroutine = self._predict(sequence_tracker.advance(session_key, seq), input_text, session_key, k)
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _predict(self, seq: int, input_text: str, session_key: tuple, k):
+        """
+
+        Args:
+            seq: Sequence number of the message
+            input_text: Input text
+            session_key: User, document and connection of the message
+            k: Number of candidates, None for a single prediction
+
+        """
+        prediction_model = PredictionService.get_ready_instance(self._prediction_model)
+        if prediction_model is None:
+            # Messages are not blocked while the model of the user is loading
+            response = get_empty_prediction_response(input_text, k)
+        else:
+            # The fallback model serves the messages while the model of the user is loading
+            served_model = PredictionService.get_instance_name(prediction_model) or self._prediction_model
+            try:
+                # Only inferences take an admission slot
+                async with admission_controller.admit_async(self._user_pk, KEYSTROKE,
+                                                            not prediction_model.is_cached(input_text, k)):
+                    response = await inference_executor.run(served_model, get_prediction_response,
+                                                            prediction_model, input_text, session_key, k, seq)
+            except AdmissionRejected:
+                response = get_shed_prediction_response(input_text, k)
+            except asyncio.CancelledError:
+                # The connection was closed. CancelledError is an Exception before Python 3.8.
+                raise
+            except Exception:
+                logger.exception(f'Prediction of {self._prediction_model} failed')
+                response = dict(get_empty_prediction_response(input_text, k), error='Prediction failed.')
+        if response.get('superseded'):
+            # The client only shows the answer of its latest message
+            return
+        response['seq'] = seq
+        await self._send_json(response)
+
+    async def _send_json(self, message: dict):
+        await self._send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+
+async def prediction_websocket_application(scope: dict, receive, send):
+    """
+    ASGI application of the WebSocket connections. Only the prediction path is served.
+
+    Args:
+        scope: ASGI connection scope
+        receive: ASGI function that receives the events of the connection
+        send: ASGI function that sends events through the connection
+
+    """
+    if settings.PREDICTION_WEBSOCKET_PATH and scope['path'] == settings.PREDICTION_WEBSOCKET_PATH:
+        await PredictionConsumer(scope, receive, send).run()
+        return
+    event = await receive()
+    if event['type'] == 'websocket.connect':
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
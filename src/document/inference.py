@@ -0,0 +1,119 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from django.conf import settings
+
+from .lazy import torch
+
+# Process whose torch threads were limited
+_threads_pid = None
+_threads_lock = threading.Lock()
+
+
+def set_inference_threads():
+    """
+    Limit the threads of the intra-op pool of torch to PREDICTION_INFERENCE_TORCH_THREADS when the predictions run
+    in the inference threads of the async views. The pool is shared by every thread of the process, so it is set
+    once per process. Sync views keep the default of torch.
+
+    """
+    global _threads_pid
+    if not settings.PREDICTION_ASYNC_VIEWS:
+        return
+    with _threads_lock:
+        if _threads_pid != os.getpid():
+            torch.set_num_threads(settings.PREDICTION_INFERENCE_TORCH_THREADS)
+            _threads_pid = os.getpid()
+
+
+class InferenceExecutor:
+    """
+    This class runs the calls to the prediction models in a bounded pool of threads per model, so async views
+    can wait for them without blocking the event loop, and a slow model doesn't take the threads of the rest
+    """
+
+    def __init__(self):
+        """
+
+        Returns: An instance of an inference executor
+
+        """
+        self._executors = {}
+        self._pending = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self, prediction_model: str) -> ThreadPoolExecutor:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: Pool of threads of the model. Pools are created again in forked processes.
+
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executors = {}
+                self._pending = {}
+                self._pid = os.getpid()
+                set_inference_threads()
+            executor = self._executors.get(prediction_model)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=settings.PREDICTION_INFERENCE_WORKERS,
+                                              thread_name_prefix=f'inference-{prediction_model}')
+                self._executors[prediction_model] = executor
+                self._pending[prediction_model] = 0
+            return executor
+
+    def _finish(self, prediction_model: str, _):
+        with self._lock:
+            self._pending[prediction_model] -= 1
+
+    async def run(self, prediction_model: str, function: Callable, *args, **kwargs):
+        """
+
+        Args:
+            prediction_model: Name of the prediction model the function uses
+            function: Blocking function
+            *args: Positional arguments of the function
+            **kwargs: Keyword arguments of the function
+
+        Returns: Result of the function, run in a thread of the model
+
+        """
+        executor = self._get_executor(prediction_model)
+        with self._lock:
+            self._pending[prediction_model] += 1
+        future = executor.submit(function, *args, **kwargs)
+        future.add_done_callback(lambda done: self._finish(prediction_model, done))
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict:
+        """
+
+        Returns: Number of calls running or waiting for a thread, per model
+
+        """
+        with self._lock:
+            return dict(self._pending) if self._pid == os.getpid() else {}
+
+
+inference_executor = InferenceExecutor()
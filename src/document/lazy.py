@@ -0,0 +1,71 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import importlib
+import sys
+import threading
+
+
+class LazyModule:
+    """
+    This class stands for a module that is imported the first time one of its attributes is used, so heavy
+    dependencies are not imported by the code paths that don't need them
+    """
+
+    def __init__(self, name: str):
+        """
+
+        Args:
+            name: Absolute name of the module
+
+        Returns: An instance of a lazy module
+
+        """
+        self.__name = name
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+
+        Returns: True if the module has been imported, by this facade or by any other code
+
+        """
+        return self.__module is not None or self.__name in sys.modules
+
+    def load(self):
+        """
+
+        Returns: The imported module
+
+        """
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    self.__module = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.load(), attribute)
+
+    def __dir__(self) -> list:
+        return dir(self.load())
+
+    def __repr__(self) -> str:
+        return f'<lazy module {self.__name!r}{"" if self.is_loaded else " (not loaded)"}>'
+
+
+torch = LazyModule('torch')
+transformers = LazyModule('transformers')
@@ -0,0 +1,103 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from document.coldstart import STAGES, summarize_runs
+from register.models import PredictionModels
+
+
+class Command(BaseCommand):
+    help = 'Measure the cold start of the prediction models, every run in a new process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', choices=PredictionModels.names, default=PredictionModels.names)
+        parser.add_argument('--runs', type=int, default=3, help='Cold starts of every model')
+        parser.add_argument('--texts', help='Text file with one input per line')
+        parser.add_argument('--output', default='coldstart.json', help='JSON file where the report is written')
+        parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+
+    @staticmethod
+    def _get_commit() -> str:
+        """
+
+        Returns: Commit of the working tree, None if it is not a git repository
+
+        """
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, stdout=subprocess.PIPE,
+                                  stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    @staticmethod
+    def _run(prediction_model: str, texts: str) -> dict:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+            texts: Text file with one input per line
+
+        Returns: Measurements of a cold start of the model in a new process, including the whole process time
+
+        """
+        command = [sys.executable, '-m', 'document.coldstart', prediction_model]
+        if texts:
+            command += ['--texts', os.path.abspath(texts)]
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=settings.BASE_DIR, stdout=subprocess.PIPE, check=True,
+                                   universal_newlines=True)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['process_seconds'] = time.perf_counter() - start
+        return result
+
+    def handle(self, *args, **options):
+        report = {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': self._get_commit(),
+            'runs': options['runs'],
+            'models': {},
+        }
+        for prediction_model in options['models']:
+            runs = [self._run(prediction_model, options['texts']) for _ in range(options['runs'])]
+            report['versions'] = runs[-1]['versions']
+            report['models'][prediction_model] = dict(summarize_runs(runs),
+                                                      process_seconds=min(run['process_seconds'] for run in runs))
+            self.stdout.write(f'{prediction_model}: ' + ', '.join(
+                f"{stage} {report['models'][prediction_model][stage]['seconds']:.2f} s" for stage in STAGES))
+
+        with open(options['output'], 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            self.stdout.write(f"Compared with {baseline.get('commit')}:")
+            for prediction_model, stages in report['models'].items():
+                if prediction_model not in baseline['models']:
+                    continue
+                for stage in STAGES:
+                    before = baseline['models'][prediction_model][stage]
+                    after = stages[stage]
+                    self.stdout.write(f"  {prediction_model} {stage}: {before['seconds']:.3f} s -> "
+                                      f"{after['seconds']:.3f} s, {before['rss_mb']:.0f} MB -> "
+                                      f"{after['rss_mb']:.0f} MB")
@@ -0,0 +1,87 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+
+from django.core.management.base import BaseCommand
+
+from document.benchmark import compare, load_texts
+from document.backends import BFLOAT16_BACKEND, ONNX_BACKEND, QUANTIZED_BACKEND, TORCH_BACKEND, \
+    TORCHSCRIPT_BACKEND
+from document.memory import PeakMemoryMonitor, get_model_size, get_rss
+from document.prediction import PredictionService
+from register.models import PredictionModels
+
+# Options of PredictionService._create for the reference model and for every variant
+REFERENCE = {'pruned_head': False, 'backend': TORCH_BACKEND, 'low_memory': False}
+VARIANTS = {
+    'pruned': {'pruned_head': True},
+    'quantized': {'backend': QUANTIZED_BACKEND},
+    'onnx': {'backend': ONNX_BACKEND},
+    'torchscript': {'backend': TORCHSCRIPT_BACKEND},
+    'bfloat16': {'backend': BFLOAT16_BACKEND},
+    'low_memory': {'low_memory': True},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare latency, memory and predictions of a variant of the prediction models with the reference ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('variant', choices=sorted(VARIANTS))
+        parser.add_argument('--models', nargs='+', choices=PredictionModels.names, default=PredictionModels.names)
+        parser.add_argument('--texts', help='Text file with one input per line')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', help='JSON file where the report is written')
+
+    @staticmethod
+    def _load(prediction_model: str, options: dict) -> tuple:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+            options: Options of the model
+
+        Returns: The model, the memory (MB) the process grew while loading it and the peak increase (MB)
+
+        """
+        rss = get_rss()
+        with PeakMemoryMonitor() as monitor:
+            model = PredictionService._create(prediction_model, **options)
+        return model, (get_rss() - rss) / 2 ** 20, monitor.increase / 2 ** 20
+
+    def handle(self, *args, **options):
+        texts = load_texts(options['texts'])
+        report = {}
+        for prediction_model in options['models']:
+            reference, reference_memory, reference_peak = self._load(prediction_model, REFERENCE)
+            candidate, candidate_memory, candidate_peak = self._load(prediction_model,
+                                                                     dict(REFERENCE, **VARIANTS[options['variant']]))
+            result = compare(reference, candidate, texts, options['repeat'])
+            result['reference']['load_rss_mb'] = reference_memory
+            result['candidate']['load_rss_mb'] = candidate_memory
+            result['reference']['load_peak_mb'] = reference_peak
+            result['candidate']['load_peak_mb'] = candidate_peak
+            result['reference']['weights_mb'] = get_model_size(reference._model) / 2 ** 20
+            result['candidate']['weights_mb'] = get_model_size(candidate._model) / 2 ** 20
+            result['candidate'].update(candidate.stats())
+            report[prediction_model] = result
+            self.stdout.write(f"{prediction_model}: {result['reference']['mean_ms']:.1f} ms -> "
+                              f"{result['candidate']['mean_ms']:.1f} ms (x{result['speedup']:.2f}), "
+                              f"top-1 agreement {result['top1_agreement']:.1%} ({result['top1_changes']} changed)")
+            del reference, candidate
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
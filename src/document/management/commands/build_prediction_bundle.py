@@ -0,0 +1,43 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from document.bundle import build_bundle, get_bundle_path, read_manifest
+from document.prediction import PredictionService
+from register.models import PredictionModels
+
+
+class Command(BaseCommand):
+    help = 'Build the bundles that contain everything needed to load the prediction models without network'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', choices=PredictionModels.names, default=PredictionModels.names)
+        parser.add_argument('--check', action='store_true',
+                            help='Verify the checksums of the existing bundles instead of building them')
+
+    def handle(self, *args, **options):
+        for prediction_model in options['models']:
+            tokenizer, head_model, pretrained, _ = PredictionService.get_params(prediction_model)
+            path = get_bundle_path(pretrained)
+            if options['check']:
+                try:
+                    manifest = read_manifest(path, verify_checksums=True)
+                except ImproperlyConfigured as error:
+                    raise CommandError(f'{prediction_model}: {error}')
+            else:
+                manifest = build_bundle(tokenizer, head_model, pretrained, path)
+            self.stdout.write(f'{prediction_model}: {path} (version {manifest["version"]}, '
+                              f'created {manifest["created"]}, {len(manifest["files"])} files)')
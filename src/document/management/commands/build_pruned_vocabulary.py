@@ -0,0 +1,46 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import html
+
+from django.core.management.base import BaseCommand
+from django.utils.html import strip_tags
+
+from document.models import Document
+from document.prediction import PredictionService
+from document.pruning import count_tokens, save_vocabulary
+from register.models import PredictionModels
+
+
+class Command(BaseCommand):
+    help = 'Count the tokens of a local corpus to build the vocabulary of the pruned heads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', nargs='*', help='Text files. By default, the documents of the users are used.')
+        parser.add_argument('--models', nargs='+', choices=PredictionModels.names, default=PredictionModels.names)
+
+    def handle(self, *args, **options):
+        if options['corpus']:
+            texts = []
+            for path in options['corpus']:
+                with open(path) as corpus_file:
+                    texts.append(corpus_file.read())
+        else:
+            texts = [html.unescape(strip_tags(body)) for body in Document.objects.values_list('body', flat=True)]
+
+        for prediction_model in options['models']:
+            tokenizer, _, pretrained, _ = PredictionService.get_params(prediction_model)
+            counter = count_tokens(tokenizer.from_pretrained(pretrained), texts)
+            save_vocabulary(pretrained, counter)
+            self.stdout.write(f'{prediction_model}: {len(counter)} different tokens')
@@ -0,0 +1,33 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from django.core.management.base import BaseCommand
+
+from document.prediction import PredictionService
+from document.weights import get_weights_path, save_flat_weights
+from register.models import PredictionModels
+
+
+class Command(BaseCommand):
+    help = 'Write the weights of the prediction models in flat files that can be mapped in memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', choices=PredictionModels.names, default=PredictionModels.names)
+
+    def handle(self, *args, **options):
+        for prediction_model in options['models']:
+            _, head_model, pretrained, _ = PredictionService.get_params(prediction_model)
+            path = get_weights_path(pretrained)
+            save_flat_weights(head_model.from_pretrained(pretrained), path)
+            self.stdout.write(f'{prediction_model}: {path}')
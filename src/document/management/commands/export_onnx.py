@@ -0,0 +1,36 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from django.core.management.base import BaseCommand
+
+from document.backends import export_onnx, get_onnx_path
+from document.prediction import PredictionService
+from register.models import PredictionModels
+
+
+class Command(BaseCommand):
+    help = 'Export the body of the prediction models to ONNX for the onnx prediction backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', choices=PredictionModels.names, default=PredictionModels.names)
+        parser.add_argument('--with-past', action='store_true',
+                            help='Reuse the key/value cache of previous tokens (models that do not use mask)')
+
+    def handle(self, *args, **options):
+        for prediction_model in options['models']:
+            _, head_model, pretrained, needs_mask = PredictionService.get_params(prediction_model)
+            path = get_onnx_path(pretrained)
+            export_onnx(head_model.from_pretrained(pretrained).base_model, needs_mask, path,
+                        with_past=options['with_past'])
+            self.stdout.write(f'{prediction_model}: {path}')
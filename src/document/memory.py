@@ -0,0 +1,123 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import resource
+import threading
+
+
+def get_rss() -> int:
+    """
+
+    Returns: Resident set size of the current process in bytes
+
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Only the peak is available without procfs. It is in kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_model_size(model) -> int:
+    """
+
+    Args:
+        model: PyTorch module
+
+    Returns: Size of the weights of the module in bytes. Shared tensors are counted once.
+
+    """
+    tensors = {}
+    values = list(model.state_dict().values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (tuple, list)):
+            # Packed weight and bias of quantized layers
+            values.extend(value)
+        elif hasattr(value, 'data_ptr'):
+            tensors[value.data_ptr()] = value.numel() * value.element_size()
+    return sum(tensors.values())
+
+
+def get_memory_usage() -> dict:
+    """
+
+    Returns: Resident memory of the process in bytes: total, shared with other processes (e.g. pages inherited
+             from the parent and not written since the fork), private and proportional set size. Only the total
+             is available without procfs.
+
+    """
+    fields = {'Rss': 0, 'Pss': 0, 'Shared_Clean': 0, 'Shared_Dirty': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    # smaps_rollup (Linux >= 4.14) sums all the mappings. smaps lists every mapping, so the values are added up.
+    path = '/proc/self/smaps_rollup' if os.path.exists('/proc/self/smaps_rollup') else '/proc/self/smaps'
+    try:
+        with open(path) as smaps:
+            for line in smaps:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    fields[name] += int(value.split()[0]) * 1024
+    except OSError:
+        return {'rss': get_rss()}
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'shared': fields['Shared_Clean'] + fields['Shared_Dirty'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+class PeakMemoryMonitor:
+    """ This class samples the resident memory of the process in a background thread to find its peak """
+
+    def __init__(self, interval: float = 0.01):
+        """
+
+        Args:
+            interval: Seconds between samples
+
+        Returns: An instance of a peak memory monitor
+
+        """
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.start = 0
+        self.peak = 0
+
+    def __enter__(self):
+        self.start = self.peak = get_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss())
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.peak = max(self.peak, get_rss())
+
+    @property
+    def increase(self) -> int:
+        """
+
+        Returns: Difference between the peak and the memory when the monitor started, in bytes
+
+        """
+        return self.peak - self.start
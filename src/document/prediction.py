@@ -12,53 +12,282 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-import torch
-from transformers import AlbertTokenizer, AlbertForMaskedLM, GPT2Tokenizer, GPT2LMHeadModel, BertTokenizer, \
-    BertForMaskedLM, BatchEncoding, pipeline
-from transformers.utils import logging
+import contextlib
+import gc
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from django.conf import settings
 
 from register.models import PredictionModels
+from .batching import PredictionBatcher, get_length_bucket
+from .cache import PredictionCache, SharedPredictionCache
+from .lazy import LazyModule, torch, transformers
+from .memory import PeakMemoryMonitor, get_model_size, get_rss
+from .sessions import InferenceSessionStore, get_common_prefix_length, truncate_past
+from .singleflight import SingleFlight
+from .supersession import PredictionSuperseded, SequenceTracker
+from .vocabulary import VocabularyIndex
+
+# These modules depend on torch and transformers. They are imported when the first model is loaded.
+backends = LazyModule('document.backends')
+bundle = LazyModule('document.bundle')
+pruning = LazyModule('document.pruning')
+weights = LazyModule('document.weights')
+
+CANDIDATE_OVERSAMPLING = 4
+# Names of the language model head in GPT-2, BERT and ALBERT models
+LM_HEAD_MODULES = ('lm_head', 'cls', 'predictions')
+
+# States of a prediction model in a process
+MODEL_UNLOADED = 'unloaded'
+MODEL_LOADING = 'loading'
+MODEL_READY = 'ready'
+MODEL_FAILED = 'failed'
+# Model used while the model chosen by a user is loading
+FALLBACK_MODEL = PredictionModels.DGPT2.name
+# Maximum seconds between loads of a model that keeps failing
+MAX_LOAD_RETRY_DELAY = 3600
+
+logger = logging.getLogger(__name__)
+
+prediction_cache = PredictionCache(settings.PREDICTION_CACHE_MAX_ENTRIES, settings.PREDICTION_CACHE_MAX_BYTES)
+shared_prediction_cache = SharedPredictionCache(settings.PREDICTION_SHARED_CACHE) \
+    if settings.PREDICTION_SHARED_CACHE else None
+# Latest request of every inference session. Older requests are dropped before inference.
+sequence_tracker = SequenceTracker(settings.PREDICTION_MAX_TRACKED_SEQUENCES)
+# Predictions being computed. Identical requests that miss the cache at the same time share one computation.
+single_flight = SingleFlight()
 
 
 class PredictionModel:
     """ This class contains the logic of a prediction model """
 
-    def __init__(self, tokenizer, head_model, pretrained: str, needs_mask: bool):
+    def __init__(self, tokenizer, head_model, pretrained: str, needs_mask: bool, pruned_vocabulary: list = None,
+                 backend: str = None, low_memory: bool = False):
         """
 
         Args:
-            tokenizer:  Class of tokenizer
-            head_model: Class of prediction model
+            tokenizer:  Class of tokenizer or its name in transformers
+            head_model: Class of prediction model or its name in transformers
             pretrained: Name of the pretrained model
             needs_mask: Boolean
+            pruned_vocabulary: Ids of the tokens the pruned head predicts. None to use the full head.
+            backend: Inference backend, one of BACKENDS. By default, torch.
+            low_memory: Avoid holding the checkpoint and randomly initialized weights at the same time
 
         Returns: An instance of a prediction model
 
         """
-        logging.set_verbosity_warning()
-        self._tokenizer = tokenizer.from_pretrained(pretrained)
-        self._model = head_model.from_pretrained(pretrained)
+        backend = backend or backends.TORCH_BACKEND
+        if backend not in backends.BACKENDS:
+            raise ValueError(f'Unknown prediction backend: {backend}')
+        transformers.logging.set_verbosity_warning()
+        if isinstance(tokenizer, str):
+            tokenizer = getattr(transformers, tokenizer)
+        if isinstance(head_model, str):
+            head_model = getattr(transformers, head_model)
+        self._name = pretrained
+        self._revision = None
+        self._tokenizer, self._model = self._load(tokenizer, head_model, pretrained, low_memory)
         self._need_mask = needs_mask
         # Set the model in evaluation mode to deactivate the DropOut modules
         self._model.eval()
+        self._body = self._model.base_model
+        self._head = self._get_head(self._model)
+        self._backend = backend
+        if backend == backends.QUANTIZED_BACKEND:
+            self._body = backends.quantize(self._body)
+        elif backend == backends.ONNX_BACKEND:
+            self._body = backends.OnnxBody(backends.get_onnx_path(pretrained), self._model.config)
+        elif backend == backends.TORCHSCRIPT_BACKEND:
+            self._body = backends.TorchScriptBody(self._body, needs_mask,
+                                                  settings.PREDICTION_TORCHSCRIPT_WARMUP_LENGTHS)
+        elif backend == backends.BFLOAT16_BACKEND:
+            # The body and the head are converted in place
+            self._model = backends.to_bfloat16(self._model)
+        # Inference sessions need a body that returns the key/value cache
+        self._supports_past = not needs_mask and getattr(self._body, 'supports_past', True)
+        self._pruned_head = None
+        if pruned_vocabulary:
+            self._pruned_head = pruning.PrunedHead(self._head, pruned_vocabulary,
+                                                   settings.PREDICTION_PRUNED_HEAD_MIN_CONFIDENCE)
+        if backend == backends.BFLOAT16_BACKEND:
+            self._head = backends.Bfloat16Head(self._head)
+        if self._tokenizer.pad_token is None:
+            # GPT-2 has no padding token. Any token is valid because padded positions are masked out.
+            self._tokenizer.pad_token = self._tokenizer.eos_token
+        self._batcher = None
+        if settings.PREDICTION_BATCH_MAX_SIZE > 1:
+            self._batcher = PredictionBatcher(self._predict_batch, settings.PREDICTION_BATCH_MAX_SIZE,
+                                              settings.PREDICTION_BATCH_MAX_WAIT_MS / 1000)
+        self._sessions = InferenceSessionStore(settings.PREDICTION_MAX_SESSIONS)
+        self._vocabulary = None
+        self._vocabulary_lock = threading.Lock()
 
-    def _tokenize(self, text: str) -> BatchEncoding:
+    @staticmethod
+    def _load(tokenizer, head_model, pretrained: str, low_memory: bool) -> tuple:
         """
 
         Args:
-            text: Text to tokenize
+            tokenizer: Class of tokenizer
+            head_model: Class of prediction model
+            pretrained: Name of the pretrained model
+            low_memory: Load the checkpoint into a model whose weights are not initialized
 
-        Returns: Tokenized text
+        Returns: The tokenizer and the model. They are loaded from the bundle of the model if it exists (always in
+                 offline mode). Otherwise, the weights are mapped from the flat weights file if it exists.
+
+        """
+        bundle_path = bundle.get_bundle_path(pretrained)
+        if settings.PREDICTION_OFFLINE or os.path.exists(os.path.join(bundle_path, bundle.MANIFEST_FILE)):
+            return bundle.load_bundle(tokenizer, head_model, bundle_path)
+        path = weights.get_weights_path(pretrained)
+        if settings.PREDICTION_MMAP_WEIGHTS and os.path.exists(path):
+            model = weights.create_empty_model(head_model, head_model.config_class.from_pretrained(pretrained))
+            weights.assign_weights(model, weights.load_flat_weights(path))
+        elif low_memory:
+            model = weights.create_empty_model(head_model, head_model.config_class.from_pretrained(pretrained))
+            weights.load_pretrained_weights(model, pretrained)
+        else:
+            model = weights.create_pretrained_model(head_model, pretrained)
+        return tokenizer.from_pretrained(pretrained), model
+
+    @staticmethod
+    def _get_head(model):
+        """
+
+        Args:
+            model: Prediction model
 
+        Returns: Language model head, the module that projects hidden states onto the vocabulary
+
+        """
+        for name in LM_HEAD_MODULES:
+            if hasattr(model, name):
+                return getattr(model, name)
+        raise ValueError()
+
+    @property
+    def revision(self) -> str:
+        """
+
+        Returns: Fingerprint of the configuration and weights of the model. It changes when the model is upgraded.
+
+        """
+        if self._revision is None:
+            digest = hashlib.sha1(self._model.config.to_json_string().encode())
+            digest.update(f'backend:{self._backend}'.encode())
+            if self._pruned_head is not None:
+                digest.update(f'pruned:{len(self._pruned_head.token_ids)}'.encode())
+            with torch.no_grad():
+                for name, parameter in self._model.named_parameters():
+                    # A sample of every tensor is enough to tell revisions apart
+                    values = parameter.detach().flatten()
+                    digest.update(name.encode())
+                    digest.update(values[::max(1, values.numel() // 64)].float().numpy().tobytes())
+            self._revision = digest.hexdigest()[:16]
+        return self._revision
+
+    @property
+    def vocabulary(self) -> VocabularyIndex:
+        """
+
+        Returns: Index of the words of the vocabulary of the tokenizer. It is built the first time it is used.
+
+        """
+        if self._vocabulary is None:
+            with self._vocabulary_lock:
+                if self._vocabulary is None:
+                    self._vocabulary = VocabularyIndex(self._tokenizer)
+        return self._vocabulary
+
+    def freeze(self):
+        """
+        Prepare the model to be shared by forked processes. Structures that are built lazily are built now, so
+        that every process does not build its own copy.
+        """
+        self._model.requires_grad_(False)
+        _ = self.revision, self.vocabulary
+
+    def get_size(self) -> int:
         """
+
+        Returns: Size of the weights of the model in bytes
+
+        """
+        return get_model_size(self._model)
+
+    def close(self):
+        """ Stop the batching thread of the model. Otherwise, it keeps the model in memory after it is unloaded. """
+        if self._batcher is not None:
+            self._batcher.close()
+
+    def stats(self) -> dict:
+        """
+
+        Returns: Counters of the optimizations used by the model
+
+        """
+        stats = {'sessions': len(self._sessions)}
+        if self._pruned_head is not None:
+            stats['pruned_head_predictions'] = self._pruned_head.predictions
+            stats['pruned_head_fallbacks'] = self._pruned_head.fallbacks
+        return stats
+
+    def _get_partial_word(self, text: str) -> str:
+        """
+
+        Args:
+            text: Input text
+
+        Returns: Word that is being typed at the end of the text. It is empty if the last word is complete, there
+                 is no text before it or no token of the vocabulary continues it.
+
+        """
+        context, _, partial_word = text.rpartition(' ')
+        if not partial_word or not context.strip() or not self.vocabulary.has_continuations(partial_word):
+            return ''
+        return partial_word
+
+    def _prepare_text(self, text: str) -> str:
+        """
+
+        Args:
+            text: Input text
+
+        Returns: Text in the format expected by the model
+
+        """
+        # The word being typed is predicted as a whole, so it is not part of the input
+        partial_word = self._get_partial_word(text)
+        if partial_word:
+            text = text[:-len(partial_word)]
         if self._need_mask:
             text = text.rsplit(' ', 1)[0]
             text += f' {self._tokenizer.mask_token}.'
         else:
             text = text.rstrip()
-        return self._tokenizer(text, return_tensors='pt')
+        return text
 
-    def _get_predicted_item_position(self, prediction_inputs: BatchEncoding) -> int:
+    def _tokenize(self, text: str) -> 'transformers.BatchEncoding':
+        """
+
+        Args:
+            text: Text to tokenize
+
+        Returns: Tokenized text
+
+        """
+        return self._tokenizer(self._prepare_text(text), return_tensors='pt')
+
+    def _get_predicted_item_position(self, prediction_inputs: 'transformers.BatchEncoding') -> int:
         """
 
         Args:
@@ -72,58 +301,278 @@ class PredictionModel:
         return torch.nonzero(prediction_inputs['input_ids'][0] == self._tokenizer.mask_token_id,
                              as_tuple=False).item()
 
-    def _predict(self, text: str) -> str:
+    def _get_item_position(self, input_ids: list) -> int:
+        """
+
+        Args:
+            input_ids: Token ids of an input without padding
+
+        Returns: Position of the predicted item
+
+        """
+        if not self._need_mask:
+            return len(input_ids) - 1
+        return input_ids.index(self._tokenizer.mask_token_id)
+
+    def _decode_prediction(self, input_ids: list, predicted_token_index: int) -> str:
         """
 
+        Args:
+            input_ids: Token ids of an input without padding
+            predicted_token_index: Predicted token
+
+        Returns: Predicted sentence
+
+        """
+        if not self._need_mask:
+            return self._tokenizer.decode(input_ids + [predicted_token_index])
+        predicted_sentence = self._tokenizer.decode(input_ids + [predicted_token_index], skip_special_tokens=True)
+        return ''.join(predicted_sentence.rsplit('.', 1))
+
+    def _predict(self, text: str, session_key=None, seq: int = None) -> str:
+        """
+        Predictions are looked up in the caches first. Concurrent requests of the same input share one computation.
+
         Args:
             text: Input text for the prediction
+            session_key: Identifier of the inference session whose state can be reused
+            seq: Sequence number of the request in the session. PredictionSuperseded is raised if a newer request
+                 arrives before the prediction is computed.
 
         Returns: Input text plus a predicted item
 
         """
-        prediction_inputs = self._tokenize(text)
-        if self._need_mask:
-            return self._predict_with_mask(prediction_inputs)
-        else:
-            return self._predict_no_mask(prediction_inputs)
+        return self._get_cached(text, (), lambda: self._run_prediction(text, session_key, seq), session_key, seq)
 
-    def _predict_no_mask(self, prediction_inputs: BatchEncoding) -> str:
+    def _get_cache_key(self, text: str, variant: tuple) -> tuple:
         """
-        This function is used with language models that don't use mask.
 
         Args:
-            prediction_inputs: Inputs for the prediction model (tokenized text)
+            text: Input text
+            variant: Parameters of the request, besides the input, the result depends on
 
-        Returns: Predicted sentence
+        Returns: Key of the result in the cache of the process and in the single flight group
 
         """
-        with torch.no_grad():
-            outputs = self._model(**prediction_inputs)
-            predictions = outputs[0]
-        predicted_token_index = torch.argmax(
-            predictions[0, self._get_predicted_item_position(prediction_inputs)]).item()
-        predicted_sentence = self._tokenizer.decode(
-            prediction_inputs.input_ids.tolist()[0] + [predicted_token_index])
-        return predicted_sentence
+        return (self._name, self._prepare_text(text), self._get_partial_word(text)) + variant
 
-    def _predict_with_mask(self, prediction_inputs: BatchEncoding) -> str:
+    def is_cached(self, text: str, k: int = None) -> bool:
         """
-        This function is used with masked language models.
 
         Args:
-            prediction_inputs: Inputs for the prediction model (tokenized text)
+            text: Input text
+            k: Number of candidates, None for a single prediction
+
+        Returns: True if the result is in the cache of the process or being computed by another request, so the
+                 request doesn't run an inference of its own
+
+        """
+        cache_key = self._get_cache_key(text, () if k is None else (k,))
+        return prediction_cache.contains(cache_key) or single_flight.is_running(cache_key)
+
+    def _get_cached(self, text: str, variant: tuple, compute: Callable, session_key=None, seq: int = None):
+        """
+        Look up a result in the caches. On a miss, concurrent requests of the same result share one computation.
+
+        Args:
+            text: Input text
+            variant: Parameters of the request, besides the input, the result depends on
+            compute: Function without arguments that computes the result
+            session_key: Identifier of the inference session of the request
+            seq: Sequence number of the request in the session
+
+        Returns: The result, from the caches or computed
+
+        """
+        cache_key = self._get_cache_key(text, variant)
+        result = prediction_cache.get(cache_key)
+        if result is not None:
+            return result
+        # If the request that computes the result is superseded, the waiting requests compute it themselves
+        return single_flight.do(cache_key, lambda: self._compute_cached(cache_key, compute, session_key, seq),
+                                retry_on=PredictionSuperseded)
+
+    def _compute_cached(self, cache_key: tuple, compute: Callable, session_key=None, seq: int = None):
+        """
+        Compute a result that is not in the process cache and store it
+
+        Args:
+            cache_key: Key of the result in the process cache
+            compute: Function without arguments that computes the result
+            session_key: Identifier of the inference session of the request
+            seq: Sequence number of the request in the session
+
+        Returns: The result, from the shared cache or computed
+
+        """
+        # Model name, prepared text, partial word and variant
+        shared_key = '\0'.join(str(part) for part in cache_key[1:])
+        result = None
+        if shared_prediction_cache is not None:
+            result = shared_prediction_cache.get(self._name, self.revision, shared_key)
+        if result is None:
+            sequence_tracker.check(session_key, seq)
+            result = compute()
+            if shared_prediction_cache is not None:
+                shared_prediction_cache.set(self._name, self.revision, shared_key, result)
+        prediction_cache.set(cache_key, result)
+        return result
+
+    def _run_prediction(self, text: str, session_key=None, seq: int = None) -> str:
+        """
+
+        Args:
+            text: Input text for the prediction
+            session_key: Identifier of the inference session whose state can be reused
+            seq: Sequence number of the request in the session
+
+        Returns: Input text plus a predicted item
+
+        """
+        input_ids, logits = self._get_logits(text, session_key, seq)
+        if logits is None:
+            return ''
+        return self._decode_prediction(input_ids, torch.argmax(logits).item())
+
+    def _get_logits(self, text: str, session_key=None, seq: int = None) -> tuple:
+        """
+        If a word is being typed, only the tokens that continue it can be predicted. The typed word itself can be
+        predicted too: if it is the most likely token, the word is complete and the next one is predicted.
+
+        Args:
+            text: Input text for the prediction
+            session_key: Identifier of the inference session whose state can be reused
+            seq: Sequence number of the request in the session
+
+        Returns: Token ids of the input and logits of the predicted item (None if the input is empty)
+
+        """
+        input_ids, logits = self._compute_logits(text, session_key, seq)
+        partial_word = self._get_partial_word(text)
+        if logits is None or not partial_word:
+            return input_ids, logits
+        word_token_ids = self.vocabulary.get_word_token_ids(partial_word)
+        token_ids = torch.tensor(self.vocabulary.get_token_ids(partial_word) + word_token_ids)
+        restricted_logits = torch.full_like(logits, float('-inf'))
+        restricted_logits[token_ids] = logits[token_ids]
+        if self._pruned_head is not None and torch.isinf(restricted_logits).all():
+            # No token of the pruned vocabulary continues the word
+            prediction_inputs = self._tokenize(text)
+            logits, _ = self._forward(prediction_inputs, [self._get_predicted_item_position(prediction_inputs)],
+                                      full_head=True)
+            restricted_logits[token_ids] = logits[0][token_ids]
+        if torch.argmax(restricted_logits).item() in word_token_ids:
+            # The word is complete, as if it was followed by a space
+            return self._compute_logits(f'{text} ', session_key, seq)
+        return input_ids, restricted_logits
+
+    def _compute_logits(self, text: str, session_key=None, seq: int = None) -> tuple:
+        """
+
+        Args:
+            text: Input text for the prediction
+            session_key: Identifier of the inference session whose state can be reused
+            seq: Sequence number of the request in the session. Superseded requests are dropped while they wait
+                 for the inference session or for their batch.
 
-        Returns: Predicted text
+        Returns: Token ids of the input and logits of the predicted item (None if the input is empty)
 
         """
+        if session_key is None and self._batcher is None:
+            prediction_inputs = self._tokenize(text)
+            input_ids = prediction_inputs.input_ids.tolist()[0]
+            if not input_ids:
+                return input_ids, None
+            logits, _ = self._forward(prediction_inputs, [self._get_predicted_item_position(prediction_inputs)])
+            return input_ids, logits[0]
+
+        encoding = self._tokenizer(self._prepare_text(text))
+        input_ids = encoding['input_ids']
+        if not input_ids:
+            return input_ids, None
+        if session_key is not None and self._supports_past:
+            # Reusing the key/value cache of the document only costs the new tokens, which is usually cheaper than
+            # waiting for a batch of full inputs, so these requests are not batched
+            return input_ids, self._get_session_logits(input_ids, session_key, seq)
+        if self._batcher is not None:
+            try:
+                return input_ids, self._batcher.submit(encoding, get_length_bucket(len(input_ids)),
+                                                       lambda: sequence_tracker.is_superseded(session_key, seq))
+            except CancelledError:
+                sequence_tracker.check(session_key, seq)
+                raise
+        return input_ids, self._predict_batch([encoding])[0]
+
+    def _get_session_logits(self, input_ids: list, session_key, seq: int = None) -> 'torch.Tensor':
+        """
+        This function is used with language models that don't use mask. Only the tokens that changed since the
+        previous prediction of the session are processed.
+
+        Args:
+            input_ids: Token ids of the input
+            session_key: Identifier of the inference session
+            seq: Sequence number of the request in the session
+
+        Returns: Logits of the next token
+
+        """
+        session = self._sessions.get(session_key)
+        with session.lock:
+            # A newer request may have arrived while this one waited for the session
+            sequence_tracker.check(session_key, seq)
+            reused = get_common_prefix_length(session.input_ids, input_ids)
+            if reused < len(input_ids) or reused < len(session.input_ids):
+                # The last token is always processed again to obtain its logits
+                reused = min(reused, len(input_ids) - 1)
+                past = truncate_past(session.past, reused) if reused else None
+                logits, session.past = self._forward({'input_ids': torch.tensor([input_ids[reused:]])}, [-1],
+                                                     past=past, use_cache=True)
+                session.input_ids = input_ids
+                session.logits = logits[0]
+            return session.logits
+
+    def _predict_batch(self, encodings: list) -> list:
+        """
+        Run a single forward pass for several inputs. Inputs are padded to the longest one.
+
+        Args:
+            encodings: List of tokenized inputs
+
+        Returns: List of logits of the predicted item, one per input
+
+        """
+        prediction_inputs = self._tokenizer.pad(encodings, return_tensors='pt')
+        logits, _ = self._forward(prediction_inputs,
+                                  [self._get_item_position(encoding['input_ids']) for encoding in encodings])
+        return list(logits)
+
+    def _forward(self, prediction_inputs, positions: list, past=None, use_cache: bool = False,
+                 full_head: bool = False) -> tuple:
+        """
+        Run the transformer and project only the hidden states of the predicted items onto the vocabulary. The
+        rest of positions never go through the language model head.
+
+        Args:
+            prediction_inputs: Inputs for the prediction model (tokenized text), one row per input
+            positions: Position of the predicted item in every row
+            past: Key/value cache of previous tokens (only models that don't use mask)
+            use_cache: Return the key/value cache (only models that don't use mask)
+            full_head: Use the full language model head even if the model has a pruned head
+
+        Returns: Logits of the predicted items (one row per input) and key/value cache
+
+        """
+        if not self._need_mask:
+            prediction_inputs = dict(prediction_inputs, past_key_values=past, use_cache=use_cache)
         with torch.no_grad():
-            outputs = self._model(**prediction_inputs)
-            predictions = outputs[0]
-        predicted_token_index = torch.argmax(
-            predictions[0, self._get_predicted_item_position(prediction_inputs)]).item()
-        predicted_sentence = self._tokenizer.decode(
-            prediction_inputs.input_ids.tolist()[0] + [predicted_token_index], skip_special_tokens=True)
-        return ''.join(predicted_sentence.rsplit('.', 1))
+            outputs = self._body(**prediction_inputs)
+            hidden_states = outputs[0][torch.arange(len(positions)), torch.tensor(positions)]
+            if self._pruned_head is None or full_head:
+                logits = self._head(hidden_states)
+            else:
+                logits = self._pruned_head(hidden_states)
+        # Reduced precision backends are compared and ranked in fp32
+        return logits.float(), outputs[1] if use_cache else None
 
     @staticmethod
     def _get_last_word(text: str) -> str:
@@ -142,17 +591,30 @@ class PredictionModel:
         words = text.split()
         return words[-1] if words[-1] != '&nbsp;' else ' '
 
-    def get_prediction(self, text: str) -> str:
+    def get_prediction(self, text: str, session_key=None, seq: int = None) -> str:
         """
 
         Args:
             text: Input text for prediction
+            session_key: Identifier of the inference session (e.g. user and document) of the request
+            seq: Sequence number of the request in the session (see sequence_tracker)
 
         Returns: Predicted item
 
         """
-        predicted_sentence = self._predict(text)
+        return self._format_prediction(text, self._predict(text, session_key, seq))
+
+    @staticmethod
+    def _format_prediction(text: str, predicted_sentence: str) -> str:
+        """
+
+        Args:
+            text: Input text for prediction
+            predicted_sentence: Input text plus a predicted item
+
+        Returns: Predicted item, empty if the predicted sentence does not continue the input text
 
+        """
         if not predicted_sentence.lower().startswith(text.lower()):
             return ''
 
@@ -163,6 +625,57 @@ class PredictionModel:
         else:
             return prediction
 
+    def get_candidates(self, text: str, k: int, session_key=None, seq: int = None) -> list:
+        """
+        Get the most likely predictions. All of them come from the same forward pass, and they are cached like
+        single predictions.
+
+        Args:
+            text: Input text for prediction
+            k: Maximum number of candidates
+            session_key: Identifier of the inference session (e.g. user and document) of the request
+            seq: Sequence number of the request in the session (see sequence_tracker)
+
+        Returns: List of candidates (prediction and probability), from most to least likely
+
+        """
+        sequence_tracker.check(session_key, seq)
+        scored_sentences = self._get_cached(text, (k,), lambda: self._compute_candidates(text, k, session_key, seq),
+                                            session_key, seq)
+        candidates = []
+        predictions = set()
+        for predicted_sentence, probability in scored_sentences:
+            prediction = self._format_prediction(text, predicted_sentence)
+            if prediction and prediction not in predictions:
+                predictions.add(prediction)
+                candidates.append({'prediction': prediction, 'probability': probability})
+                if len(candidates) == k:
+                    break
+        return candidates
+
+    def _compute_candidates(self, text: str, k: int, session_key=None, seq: int = None) -> list:
+        """
+
+        Args:
+            text: Input text for prediction
+            k: Maximum number of candidates
+            session_key: Identifier of the inference session of the request
+            seq: Sequence number of the request in the session
+
+        Returns: Input text plus the most likely predicted items, with their probabilities, from most to least
+                 likely. Some of them may not continue the input text, so there are more than k.
+
+        """
+        input_ids, logits = self._get_logits(text, session_key, seq)
+        if logits is None:
+            return []
+        probabilities = torch.softmax(logits.float(), dim=-1)
+        top_probabilities, top_indices = torch.topk(probabilities, min(k * CANDIDATE_OVERSAMPLING,
+                                                                       probabilities.numel()))
+        # Tokens with probability 0 can't be predicted
+        return [(self._decode_prediction(input_ids, token_index), probability)
+                for probability, token_index in zip(top_probabilities.tolist(), top_indices.tolist()) if probability]
+
     def get_full_prediction(self, text: str) -> str:
         """
 
@@ -172,7 +685,7 @@ class PredictionModel:
         Returns: Predicted long sentence
 
         """
-        generator = pipeline('text-generation', model=self._model, tokenizer=self._tokenizer)
+        generator = transformers.pipeline('text-generation', model=self._model, tokenizer=self._tokenizer)
         prediction = generator(text, num_return_sequences=1, no_repeat_ngram_size=2, max_length=len(text) + 20,
                                early_stopping=True, num_beams=5)[0]['generated_text']
         last_point = prediction.rfind('.')
@@ -187,14 +700,52 @@ class PredictionModel:
 
 
 class PredictionService:
-    """ This class represents the collection of prediction models """
-    __instances = {}
+    """
+    This class represents the collection of prediction models. Models can be loaded in background threads. When
+    the loaded models exceed the memory budget, the least recently used ones are unloaded.
+    """
+    # Loaded models, from least to most recently used
+    __instances = OrderedDict()
+    # Memory (bytes) the process grew when every model was loaded, and its peak during the load
+    __footprints = {}
+    __load_peaks = {}
+    __states = {}
+    # Number of consecutive failed loads of every model and time of the last one
+    __failures = {}
+    # Protects the dictionaries above and the load counters. It is never held while a model is loaded.
+    __lock = threading.Lock()
+    # Models being loaded and loads started, to tell whether the memory measure of a load includes other loads
+    __loading = 0
+    __load_starts = 0
+    # Held during a load when its measure is used to keep the memory budget, so loads are serialized
+    __measure_lock = threading.Lock()
     __params = {
-        PredictionModels.GPT2.name: (GPT2Tokenizer, GPT2LMHeadModel, 'gpt2-medium', False),
-        PredictionModels.DGPT2.name: (GPT2Tokenizer, GPT2LMHeadModel, 'distilgpt2', False),
-        PredictionModels.BERT.name: (BertTokenizer, BertForMaskedLM, 'bert-base-cased', True),
-        PredictionModels.ALBERT.name: (AlbertTokenizer, AlbertForMaskedLM, 'albert-large-v2', True),
+        # Classes are named, so transformers is not imported until a model is loaded
+        PredictionModels.GPT2.name: ('GPT2Tokenizer', 'GPT2LMHeadModel', 'gpt2-medium', False),
+        PredictionModels.DGPT2.name: ('GPT2Tokenizer', 'GPT2LMHeadModel', 'distilgpt2', False),
+        PredictionModels.BERT.name: ('BertTokenizer', 'BertForMaskedLM', 'bert-base-cased', True),
+        PredictionModels.ALBERT.name: ('AlbertTokenizer', 'AlbertForMaskedLM', 'albert-large-v2', True),
     }
+    # Held while a model is loaded, so it is loaded only once
+    __load_locks = {prediction_model: threading.Lock() for prediction_model in __params}
+    __executor = None
+    __executor_pid = None
+    __futures = {}
+
+    @staticmethod
+    def get_params(prediction_model: str) -> tuple:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: Class of tokenizer, class of model, name of the pretrained model and whether it needs mask
+
+        """
+        if prediction_model not in PredictionService.__params:
+            raise ValueError()
+        tokenizer, head_model, pretrained, needs_mask = PredictionService.__params[prediction_model]
+        return getattr(transformers, tokenizer), getattr(transformers, head_model), pretrained, needs_mask
 
     @staticmethod
     def instance(prediction_model: str) -> PredictionModel:
@@ -209,21 +760,320 @@ class PredictionService:
         """
         if prediction_model not in PredictionService.__params:
             raise ValueError()
-        if prediction_model not in PredictionService.__instances:
-            if prediction_model not in PredictionService.__instances:
-                PredictionService.__instances[prediction_model] = PredictionService._create(prediction_model)
-        return PredictionService.__instances[prediction_model]
+        instance = PredictionService._get_loaded(prediction_model)
+        if instance is not None:
+            return instance
+        with PredictionService.__load_locks[prediction_model]:
+            # Another thread may have loaded the model while this one was waiting
+            instance = PredictionService._get_loaded(prediction_model)
+            if instance is not None:
+                return instance
+            with PredictionService._get_measure_lock():
+                return PredictionService._load_measured(prediction_model)
+
+    @staticmethod
+    def _get_measure_lock():
+        """
+
+        Returns: Lock that serializes the loads when the memory budget or the low memory loading are used, so the
+                 memory measured for a model doesn't include the memory of models loaded at the same time
+
+        """
+        if settings.PREDICTION_MEMORY_BUDGET_MB or settings.PREDICTION_LOW_MEMORY_LOADING:
+            return PredictionService.__measure_lock
+        return contextlib.nullcontext()
+
+    @staticmethod
+    def _load_measured(prediction_model: str) -> PredictionModel:
+        """
+        Load a model and measure its memory. The load lock of the model must be held.
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: The loaded prediction model
+
+        """
+        with PredictionService.__lock:
+            PredictionService.__states[prediction_model] = MODEL_LOADING
+            # Make room before loading if the model was loaded before and its footprint is known
+            evicted = PredictionService._evict(PredictionService.__footprints.get(prediction_model, 0))
+        PredictionService._unload(evicted)
+        with PredictionService.__lock:
+            overlapped = PredictionService.__loading > 0
+            PredictionService.__loading += 1
+            PredictionService.__load_starts += 1
+            load_starts = PredictionService.__load_starts
+        rss = get_rss()
+        try:
+            with PeakMemoryMonitor() as monitor:
+                instance = PredictionService._create(prediction_model)
+        except Exception:
+            with PredictionService.__lock:
+                PredictionService.__loading -= 1
+                PredictionService.__states[prediction_model] = MODEL_FAILED
+                failures, _ = PredictionService.__failures.get(prediction_model, (0, None))
+                PredictionService.__failures[prediction_model] = (failures + 1, time.monotonic())
+            raise
+        footprint = max(0, get_rss() - rss)
+        with PredictionService.__lock:
+            PredictionService.__loading -= 1
+            overlapped = overlapped or PredictionService.__load_starts != load_starts
+        if overlapped:
+            # The process memory also grew because of other models, so only the weights of this one are counted
+            footprint = instance.get_size()
+            logger.info(f'{prediction_model} loaded along with other models. Weights: {footprint / 2 ** 20:.0f} MB')
+        else:
+            logger.info(f'{prediction_model} loaded. Peak memory increase: {monitor.increase / 2 ** 20:.0f} MB')
+        with PredictionService.__lock:
+            PredictionService.__footprints[prediction_model] = footprint
+            if overlapped:
+                PredictionService.__load_peaks.pop(prediction_model, None)
+            else:
+                PredictionService.__load_peaks[prediction_model] = monitor.increase
+            PredictionService.__instances[prediction_model] = instance
+            PredictionService.__states[prediction_model] = MODEL_READY
+            PredictionService.__failures.pop(prediction_model, None)
+            evicted = PredictionService._evict()
+        PredictionService._unload(evicted)
+        return instance
+
+    @staticmethod
+    def _get_loaded(prediction_model: str) -> Optional[PredictionModel]:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: The prediction model if it is loaded, None otherwise
+
+        """
+        with PredictionService.__lock:
+            instance = PredictionService.__instances.get(prediction_model)
+            if instance is not None:
+                PredictionService.__instances.move_to_end(prediction_model)
+            return instance
+
+    @staticmethod
+    def get_ready_instance(prediction_model: str) -> Optional[PredictionModel]:
+        """
+        Get a prediction model without waiting for it to be loaded. If it is not loaded, it starts loading in
+        background and the fallback model is returned if it is loaded. Models whose load failed are loaded again
+        after a delay.
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: The prediction model, the fallback model or None if neither is loaded
+
+        """
+        if prediction_model not in PredictionService.__params:
+            raise ValueError()
+        instance = PredictionService._get_loaded(prediction_model)
+        if instance is not None:
+            return instance
+        if PredictionService._can_load(prediction_model):
+            PredictionService.load_async(prediction_model)
+        fallback = PredictionService._get_loaded(FALLBACK_MODEL)
+        if fallback is None and PredictionService._can_load(FALLBACK_MODEL):
+            PredictionService.load_async(FALLBACK_MODEL)
+        return fallback
+
+    @staticmethod
+    def _can_load(prediction_model: str) -> bool:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: False if the last load of the model failed recently. The delay before loading it again doubles
+                 with every consecutive failure, from PREDICTION_LOAD_RETRY_SECONDS to MAX_LOAD_RETRY_DELAY.
+
+        """
+        with PredictionService.__lock:
+            if PredictionService.__states.get(prediction_model) != MODEL_FAILED:
+                return True
+            failures, failed_at = PredictionService.__failures[prediction_model]
+        delay = min(settings.PREDICTION_LOAD_RETRY_SECONDS * 2 ** (failures - 1), MAX_LOAD_RETRY_DELAY)
+        return time.monotonic() - failed_at >= delay
+
+    @staticmethod
+    def load_async(prediction_model: str) -> Optional[Future]:
+        """
+        Load a prediction model in a background thread. Several models are loaded in parallel, unless their memory is
+        measured to keep the memory budget.
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: Future of the loaded model, None if it is already loaded
+
+        """
+        if prediction_model not in PredictionService.__params:
+            raise ValueError()
+        with PredictionService.__lock:
+            if prediction_model in PredictionService.__instances:
+                return None
+            future = PredictionService.__futures.get(prediction_model)
+            if future is not None and not future.done():
+                return future
+            if PredictionService.__executor is None or PredictionService.__executor_pid != os.getpid():
+                # Threads do not survive a fork, so every process needs its own executor
+                PredictionService.__executor = ThreadPoolExecutor(settings.PREDICTION_LOAD_WORKERS,
+                                                                  thread_name_prefix='prediction-loader')
+                PredictionService.__executor_pid = os.getpid()
+            PredictionService.__states[prediction_model] = MODEL_LOADING
+            future = PredictionService.__executor.submit(PredictionService._load, prediction_model)
+            PredictionService.__futures[prediction_model] = future
+            return future
+
+    @staticmethod
+    def _load(prediction_model: str) -> PredictionModel:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: The loaded prediction model
+
+        """
+        try:
+            return PredictionService.instance(prediction_model)
+        except Exception:
+            logger.exception(f'The prediction model {prediction_model} could not be loaded')
+            raise
+
+    @staticmethod
+    def get_instance_name(instance: PredictionModel) -> Optional[str]:
+        """
+
+        Args:
+            instance: Loaded prediction model, e.g. returned by get_ready_instance
+
+        Returns: Name of the prediction model, None if it is no longer loaded
+
+        """
+        with PredictionService.__lock:
+            for prediction_model, loaded in PredictionService.__instances.items():
+                if loaded is instance:
+                    return prediction_model
+        return None
+
+    @staticmethod
+    def get_state(prediction_model: str) -> str:
+        """
+
+        Args:
+            prediction_model: Name of the prediction model
+
+        Returns: State of the prediction model in this process
+
+        """
+        with PredictionService.__lock:
+            return PredictionService.__states.get(prediction_model, MODEL_UNLOADED)
+
+    @staticmethod
+    def get_states() -> dict:
+        """
+
+        Returns: State of every prediction model in this process
+
+        """
+        return {prediction_model: PredictionService.get_state(prediction_model)
+                for prediction_model in PredictionService.__params}
+
+    @staticmethod
+    def get_footprints() -> dict:
+        """
+
+        Returns: Memory (bytes) used by every loaded model
+
+        """
+        with PredictionService.__lock:
+            return {prediction_model: PredictionService.__footprints[prediction_model]
+                    for prediction_model in PredictionService.__instances}
+
+    @staticmethod
+    def get_load_peaks() -> dict:
+        """
+
+        Returns: Peak memory increase (bytes) while every loaded model was loaded
+
+        """
+        with PredictionService.__lock:
+            return {prediction_model: PredictionService.__load_peaks[prediction_model]
+                    for prediction_model in PredictionService.__instances}
+
+    @staticmethod
+    def _evict(required: int = 0) -> list:
+        """
+        Remove the least recently used models until the loaded ones and the required memory fit in the budget. The
+        lock must be held.
+
+        Args:
+            required: Memory (bytes) that is going to be used by a model that is not loaded yet
+
+        Returns: The removed models. They must be unloaded with _unload once the lock is released.
+
+        """
+        budget = settings.PREDICTION_MEMORY_BUDGET_MB * 2 ** 20
+        if not budget:
+            return []
+        footprints = PredictionService.__footprints
+        instances = PredictionService.__instances
+        evicted = []
+        while instances and sum(footprints[name] for name in instances) + required > budget:
+            if not required and len(instances) == 1:
+                # The model that has just been loaded is kept even if it does not fit
+                break
+            prediction_model, instance = instances.popitem(last=False)
+            PredictionService.__states[prediction_model] = MODEL_UNLOADED
+            logger.warning(f'Unloading {prediction_model} to keep the prediction models within the memory budget')
+            evicted.append(instance)
+        return evicted
+
+    @staticmethod
+    def _unload(evicted: list):
+        """
+        Free the memory of removed models
+
+        Args:
+            evicted: Models removed by _evict
+
+        """
+        if not evicted:
+            return
+        while evicted:
+            # Waits for the batch in progress, so the lock is not held
+            evicted.pop().close()
+        # Release the tensors of the unloaded models now, not when the collector runs
+        gc.collect()
 
     @staticmethod
-    def _create(prediction_model):
+    def _create(prediction_model, pruned_head: bool = None, backend: str = None, low_memory: bool = None):
         """
         Create a prediction model
 
         Args:
             prediction_model: Prediction model name
+            pruned_head: Use a pruned language model head. By default, it depends on the settings.
+            backend: Inference backend. By default, it depends on the settings.
+            low_memory: Load the model with low peak memory. By default, it depends on the settings.
 
         Returns: The created prediction model
 
         """
         tokenizer, head_model, pretrained, needs_mask = PredictionService.__params[prediction_model]
-        return PredictionModel(tokenizer, head_model, pretrained, needs_mask)
+        if pruned_head is None:
+            pruned_head = prediction_model in settings.PREDICTION_PRUNED_HEAD_MODELS
+        if backend is None:
+            backend = settings.PREDICTION_BACKENDS.get(prediction_model)
+        if low_memory is None:
+            low_memory = settings.PREDICTION_LOW_MEMORY_LOADING
+        pruned_vocabulary = None
+        if pruned_head:
+            pruned_vocabulary = pruning.load_vocabulary(pretrained, settings.PREDICTION_PRUNED_HEAD_SIZE)
+            if pruned_vocabulary is None:
+                logger.warning(f'There is no pruned vocabulary for {prediction_model}. The full head is used.')
+        return PredictionModel(tokenizer, head_model, pretrained, needs_mask, pruned_vocabulary=pruned_vocabulary,
+                               backend=backend, low_memory=low_memory)
@@ -0,0 +1,32 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import gc
+
+from register.models import PredictionModels
+from .prediction import PredictionService
+
+
+def preload_models():
+    """
+    Load all the prediction models in the current process before it is forked (e.g. in the gunicorn master), so
+    that the workers share their weights copy-on-write instead of loading their own copy.
+    """
+    for model in PredictionModels:
+        PredictionService.instance(model.name).freeze()
+    # Objects that survive are moved to the permanent generation. The collector of the workers never visits them,
+    # so it does not write to their pages. Tensor data is stored out of the Python objects, so reference counting
+    # does not write to the pages of the weights either.
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,150 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+import os
+from collections import Counter
+from typing import Iterable, Optional
+
+import torch
+from django.conf import settings
+
+
+def get_vocabulary_path(pretrained: str) -> str:
+    """
+
+    Args:
+        pretrained: Name of the pretrained model
+
+    Returns: Path of the file with the most frequent tokens of the model
+
+    """
+    return os.path.join(settings.PREDICTION_ARTIFACTS_DIR, 'vocabulary', f'{pretrained}.json')
+
+
+def count_tokens(tokenizer, texts: Iterable[str]) -> Counter:
+    """
+
+    Args:
+        tokenizer: Tokenizer of a model
+        texts: Corpus
+
+    Returns: Number of occurrences of every token in the corpus
+
+    """
+    counter = Counter()
+    for text in texts:
+        for line in text.splitlines():
+            counter.update(tokenizer(line, add_special_tokens=False)['input_ids'])
+    return counter
+
+
+def save_vocabulary(pretrained: str, counter: Counter):
+    """
+
+    Args:
+        pretrained: Name of the pretrained model
+        counter: Number of occurrences of every token
+
+    """
+    path = get_vocabulary_path(pretrained)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as vocabulary_file:
+        json.dump([token_id for token_id, _ in counter.most_common()], vocabulary_file)
+
+
+def load_vocabulary(pretrained: str, size: int) -> Optional[list]:
+    """
+
+    Args:
+        pretrained: Name of the pretrained model
+        size: Number of tokens
+
+    Returns: Ids of the most frequent tokens, None if the vocabulary of the model was not built
+
+    """
+    path = get_vocabulary_path(pretrained)
+    if not os.path.exists(path):
+        return None
+    with open(path) as vocabulary_file:
+        return json.load(vocabulary_file)[:size]
+
+
+def split_head(head) -> tuple:
+    """
+
+    Args:
+        head: Language model head of a GPT-2, BERT or ALBERT model
+
+    Returns: Transformation applied to the hidden states and linear layer that projects them onto the vocabulary
+
+    """
+    if hasattr(head, 'predictions'):
+        # BERT
+        return head.predictions.transform, head.predictions.decoder
+    if hasattr(head, 'decoder'):
+        # ALBERT
+        return lambda hidden_states: head.LayerNorm(head.activation(head.dense(hidden_states))), head.decoder
+    # GPT-2
+    return lambda hidden_states: hidden_states, head
+
+
+class PrunedHead:
+    """
+    This class projects hidden states onto the most frequent tokens only. When the prediction is not confident
+    enough, the full language model head is used.
+    """
+
+    def __init__(self, head, token_ids: list, min_confidence: float):
+        """
+
+        Args:
+            head: Language model head of the model
+            token_ids: Ids of the tokens that can be predicted
+            min_confidence: Minimum probability of the best token. Below it, the full head is used.
+
+        Returns: An instance of a pruned head
+
+        """
+        self._head = head
+        self._transform, decoder = split_head(head)
+        self._vocabulary_size = decoder.weight.shape[0]
+        self.token_ids = torch.tensor(token_ids)
+        self._weight = decoder.weight.detach()[self.token_ids].clone()
+        self._bias = decoder.bias.detach()[self.token_ids].clone() if decoder.bias is not None else None
+        self._min_confidence = min_confidence
+        self.predictions = 0
+        self.fallbacks = 0
+
+    def __call__(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        """
+
+        Args:
+            hidden_states: Hidden states of the predicted items
+
+        Returns: Logits over the full vocabulary. Tokens out of the pruned vocabulary get -inf unless the full
+                 head was used.
+
+        """
+        pruned_logits = torch.nn.functional.linear(self._transform(hidden_states), self._weight, self._bias)
+        logits = torch.full((pruned_logits.shape[0], self._vocabulary_size), float('-inf'),
+                            dtype=pruned_logits.dtype)
+        logits[:, self.token_ids] = pruned_logits
+        confidence = torch.softmax(pruned_logits, dim=-1).max(dim=-1).values
+        fallback_rows = torch.nonzero(confidence < self._min_confidence, as_tuple=True)[0]
+        if len(fallback_rows):
+            logits[fallback_rows] = self._head(hidden_states[fallback_rows]).to(logits.dtype)
+        self.predictions += len(logits)
+        self.fallbacks += len(fallback_rows)
+        return logits
@@ -0,0 +1,99 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+
+def get_common_prefix_length(first: list, second: list) -> int:
+    """
+
+    Args:
+        first: List of token ids
+        second: List of token ids
+
+    Returns: Number of leading tokens both lists share
+
+    """
+    length = 0
+    for first_token, second_token in zip(first, second):
+        if first_token != second_token:
+            break
+        length += 1
+    return length
+
+
+def truncate_past(past, length: int):
+    """
+
+    Args:
+        past: Key/value cache returned by a causal language model
+        length: Number of positions to keep
+
+    Returns: Key/value cache of the first positions
+
+    """
+    # Each layer is either a stacked (2, batch, heads, seq, head_dim) tensor or a (key, value) pair
+    return tuple(layer[..., :length, :] if hasattr(layer, 'shape') else tuple(t[..., :length, :] for t in layer)
+                 for layer in past)
+
+
+class InferenceSession:
+    """ This class keeps the state of the last prediction made for a user in a document """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.input_ids = []
+        self.past = None
+        self.logits = None
+
+
+class InferenceSessionStore:
+    """ This class contains the inference sessions of a model. Least recently used sessions are discarded """
+
+    def __init__(self, max_sessions: int):
+        """
+
+        Args:
+            max_sessions: Maximum number of sessions kept
+
+        Returns: An instance of a session store
+
+        """
+        self._max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, key: Hashable) -> InferenceSession:
+        """
+
+        Args:
+            key: Identifier of the session, e.g. (user, document)
+
+        Returns: The session, a new one if it does not exist
+
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = InferenceSession()
+                while len(self._sessions) > self._max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(key)
+            return session
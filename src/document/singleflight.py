@@ -0,0 +1,110 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+
+class SingleFlight:
+    """
+    This class runs a single computation of every key at a time. Callers that ask for a key being computed wait
+    for the running computation and share its result instead of computing it again.
+    """
+
+    def __init__(self):
+        """
+
+        Returns: An instance of a single flight group
+
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: Hashable, function: Callable, retry_on: tuple = ()):
+        """
+
+        Args:
+            key: Identifier of the computation
+            function: Function without arguments that computes the result. It is called only if no computation
+                      of the key is running.
+            retry_on: Exceptions of the running computation that don't apply to the waiting callers. When it
+                      raises one of them, they try again, so one of them runs its own function.
+
+        Returns: Result of the function
+
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                is_leader = future is None
+                if is_leader:
+                    future = Future()
+                    self._calls[key] = future
+                    self.leaders += 1
+                else:
+                    self.followers += 1
+            if is_leader:
+                return self._run(key, future, function)
+            try:
+                return future.result()
+            except retry_on:
+                continue
+
+    def is_running(self, key: Hashable) -> bool:
+        """
+
+        Args:
+            key: Identifier of the computation
+
+        Returns: True if a computation of the key is running, so a caller would share its result
+
+        """
+        with self._lock:
+            return key in self._calls
+
+    def _run(self, key: Hashable, future: Future, function: Callable):
+        """
+
+        Args:
+            key: Identifier of the computation
+            future: Future the waiting callers wait on
+            function: Function that computes the result
+
+        Returns: Result of the function
+
+        """
+        try:
+            result = function()
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            # Callers that got the future before it is removed get the result. The next ones compute it again.
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+
+        Returns: Number of computations in progress, computations run and callers that shared a result
+
+        """
+        with self._lock:
+            return {'in_flight': len(self._calls), 'leaders': self.leaders, 'followers': self.followers}
@@ -0,0 +1,109 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+
+class PredictionSuperseded(Exception):
+    """ Raised when a newer request of the same user and document arrived before the prediction started """
+
+
+class SequenceTracker:
+    """
+    This class keeps the sequence number of the latest prediction request of every client (page or connection) of
+    a user in a document. Requests with older sequence numbers are superseded: their answer would never be shown,
+    so they are not computed.
+
+    The sequence numbers are kept in the memory of the process. A request is only superseded by the newer requests
+    the same process receives while it waits, so this only has an effect with workers that serve several requests
+    at the same time (threaded or async workers, and the WebSocket connection of an editor).
+    """
+
+    def __init__(self, max_keys: int):
+        """
+
+        Args:
+            max_keys: Maximum number of users and documents tracked. The least recently used are forgotten.
+
+        Returns: An instance of a sequence tracker
+
+        """
+        self._max_keys = max_keys
+        self._latest = OrderedDict()
+        self._lock = threading.Lock()
+        self.superseded = 0
+
+    def advance(self, key: Hashable, seq: int = None) -> int:
+        """
+        Register a new request
+
+        Args:
+            key: User and document of the request
+            seq: Sequence number sent by the client. By default, requests are numbered in order of arrival.
+
+        Returns: Sequence number of the request
+
+        """
+        with self._lock:
+            latest = self._latest.get(key)
+            if seq is None:
+                seq = latest + 1 if latest is not None else 1
+            if latest is None or seq > latest:
+                self._latest[key] = seq
+            if key in self._latest:
+                self._latest.move_to_end(key)
+            while len(self._latest) > self._max_keys:
+                self._latest.popitem(last=False)
+            return seq
+
+    def is_superseded(self, key: Hashable, seq: int) -> bool:
+        """
+
+        Args:
+            key: User and document of the request
+            seq: Sequence number of the request
+
+        Returns: True if a newer request of the same user and document has arrived
+
+        """
+        if key is None or seq is None:
+            return False
+        with self._lock:
+            latest = self._latest.get(key)
+        return latest is not None and seq < latest
+
+    def check(self, key: Hashable, seq: int):
+        """
+        Raise PredictionSuperseded if the request is superseded. Every dropped request is counted once.
+
+        Args:
+            key: User and document of the request
+            seq: Sequence number of the request
+
+        """
+        if self.is_superseded(key, seq):
+            with self._lock:
+                self.superseded += 1
+            raise PredictionSuperseded(f'Request {seq} of {key} was superseded')
+
+    def stats(self) -> dict:
+        """
+
+        Returns: Number of tracked users and documents and number of dropped requests
+
+        """
+        with self._lock:
+            return {'tracked': len(self._latest), 'superseded': self.superseded}
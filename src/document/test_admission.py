@@ -0,0 +1,163 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from document.admission import COMPLETION, KEYSTROKE, AdmissionController, AdmissionRejected
+
+
+class AdmissionControllerTest(TestCase):
+
+    def setUp(self):
+        self.order = []
+
+    @staticmethod
+    def create_controller(slots: int = 1, completion_slots: int = 1, user_limit: int = 2, budget: float = 5):
+        return AdmissionController(slots, {COMPLETION: completion_slots}, user_limit,
+                                   {KEYSTROKE: budget, COMPLETION: budget})
+
+    @staticmethod
+    def wait_queued(controller: AdmissionController, kind: str, queued: int):
+        while controller.stats()[kind]['queued'] < queued:
+            time.sleep(0.01)
+
+    def request(self, controller: AdmissionController, user, kind: str):
+        with controller.admit(user, kind):
+            self.order.append((user, kind))
+
+    def test_free_slot_admits_at_once(self):
+        controller = self.create_controller()
+        with controller.admit('user', KEYSTROKE):
+            self.assertEqual(controller.stats()[KEYSTROKE]['running'], 1)
+        self.assertEqual(controller.stats()[KEYSTROKE]['running'], 0)
+        self.assertEqual(controller.stats()[KEYSTROKE]['admitted'], 1)
+
+    def test_keystrokes_are_served_before_completions(self):
+        controller = self.create_controller()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with controller.admit('first', KEYSTROKE):
+                completion = executor.submit(self.request, controller, 'second', COMPLETION)
+                self.wait_queued(controller, COMPLETION, 1)
+                keystroke = executor.submit(self.request, controller, 'third', KEYSTROKE)
+                self.wait_queued(controller, KEYSTROKE, 1)
+            completion.result()
+            keystroke.result()
+        self.assertEqual(self.order, [('third', KEYSTROKE), ('second', COMPLETION)])
+
+    def test_completions_do_not_take_every_slot(self):
+        controller = self.create_controller(slots=2)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with controller.admit('first', COMPLETION):
+                completion = executor.submit(self.request, controller, 'second', COMPLETION)
+                self.wait_queued(controller, COMPLETION, 1)
+                with controller.admit('third', KEYSTROKE):
+                    self.assertEqual(controller.stats()[COMPLETION]['queued'], 1)
+            completion.result()
+
+    def test_user_limit_lets_other_users_in(self):
+        controller = self.create_controller(slots=2, user_limit=1)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with controller.admit('first', KEYSTROKE):
+                same_user = executor.submit(self.request, controller, 'first', KEYSTROKE)
+                self.wait_queued(controller, KEYSTROKE, 1)
+                with controller.admit('second', KEYSTROKE):
+                    self.assertEqual(controller.stats()[KEYSTROKE]['queued'], 1)
+            same_user.result()
+
+    def test_users_are_served_in_turns(self):
+        controller = self.create_controller()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            with controller.admit('holder', KEYSTROKE):
+                for queued, user in enumerate(['first', 'first', 'first', 'second'], 1):
+                    executor.submit(self.request, controller, user, KEYSTROKE)
+                    self.wait_queued(controller, KEYSTROKE, queued)
+        self.assertEqual([user for user, _ in self.order], ['first', 'second', 'first', 'first'])
+
+    def test_waiting_longer_than_budget_sheds_request(self):
+        controller = self.create_controller(budget=0.05)
+        with controller.admit('first', KEYSTROKE):
+            with self.assertRaises(AdmissionRejected) as context:
+                with controller.admit('second', KEYSTROKE):
+                    pass
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        self.assertEqual(controller.stats()[KEYSTROKE]['shed'], 1)
+        self.assertEqual(controller.stats()[KEYSTROKE]['queued'], 0)
+
+    def test_expected_wait_over_budget_sheds_request_at_once(self):
+        controller = self.create_controller(budget=0.1)
+        with controller.admit('first', KEYSTROKE):
+            time.sleep(0.2)
+        with controller.admit('first', KEYSTROKE):
+            start = time.monotonic()
+            with self.assertRaises(AdmissionRejected):
+                with controller.admit('second', KEYSTROKE):
+                    pass
+            self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_request_without_inference_takes_no_slot(self):
+        controller = self.create_controller(budget=0.05)
+        with controller.admit('first', KEYSTROKE):
+            with controller.admit('second', KEYSTROKE, required=False):
+                self.assertEqual(controller.stats()[KEYSTROKE]['running'], 1)
+        self.assertEqual(controller.stats()[KEYSTROKE]['admitted'], 1)
+        self.assertEqual(controller.stats()[KEYSTROKE]['shed'], 0)
+
+    def test_disabled_controller_admits_every_request(self):
+        controller = self.create_controller(slots=0)
+        with controller.admit('first', KEYSTROKE), controller.admit('second', KEYSTROKE):
+            pass
+        self.assertEqual(controller.stats()[KEYSTROKE]['shed'], 0)
+
+    def test_async_admission(self):
+        controller = self.create_controller(budget=0.05)
+
+        async def request():
+            async with controller.admit_async('first', KEYSTROKE):
+                with self.assertRaises(AdmissionRejected):
+                    async with controller.admit_async('second', KEYSTROKE):
+                        pass
+
+        async_to_sync(request)()
+        self.assertEqual(controller.stats()[KEYSTROKE]['admitted'], 1)
+        self.assertEqual(controller.stats()[KEYSTROKE]['shed'], 1)
+
+    def test_cancelled_request_does_not_change_average_duration(self):
+        controller = self.create_controller()
+
+        async def waiting_request():
+            async with controller.admit_async('second', KEYSTROKE):
+                self.order.append(('second', KEYSTROKE))
+
+        async def cancel_when_admitted():
+            holder = controller.admit_async('first', KEYSTROKE)
+            await holder.__aenter__()
+            await asyncio.sleep(0.1)
+            waiting = asyncio.ensure_future(waiting_request())
+            while controller.stats()[KEYSTROKE]['queued'] < 1:
+                await asyncio.sleep(0.01)
+            # The slot goes to the waiting request, which is cancelled before it resumes
+            await holder.__aexit__(None, None, None)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+
+        async_to_sync(cancel_when_admitted)()
+        self.assertEqual(self.order, [])
+        self.assertEqual(controller.stats()[KEYSTROKE]['running'], 0)
+        self.assertGreaterEqual(controller.stats()[KEYSTROKE]['duration_ms'], 100)
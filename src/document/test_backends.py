@@ -0,0 +1,105 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import tempfile
+from unittest import skipIf, skipUnless
+
+import torch
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from transformers import GPT2Config, GPT2Model
+from transformers.modeling_utils import Conv1D
+
+from document.backends import Bfloat16Head, OnnxBody, TorchScriptBody, convert_conv1d_to_linear, export_onnx, \
+    is_bfloat16_supported, onnxruntime
+
+
+class ConvertConv1DTest(TestCase):
+
+    def test_linear_layers_match_conv1d_layers(self):
+        torch.manual_seed(0)
+        module = torch.nn.Sequential(Conv1D(6, 4), torch.nn.Sequential(Conv1D(3, 6)))
+        inputs = torch.randn(2, 5, 4)
+        with torch.no_grad():
+            expected = module(inputs)
+            convert_conv1d_to_linear(module)
+            outputs = module(inputs)
+        self.assertIsInstance(module[0], torch.nn.Linear)
+        self.assertIsInstance(module[1][0], torch.nn.Linear)
+        self.assertTrue(torch.allclose(outputs, expected, atol=1e-6))
+
+
+class OnnxBodyTest(TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.body = GPT2Model(GPT2Config(vocab_size=50, n_positions=32, n_ctx=32, n_embd=16, n_layer=2, n_head=2))
+        self.body.eval()
+        self.input_ids = torch.tensor([[1, 2, 3, 4, 5]])
+
+    def test_missing_file(self):
+        with self.assertRaises(ImproperlyConfigured):
+            OnnxBody('nonexistent.onnx', self.body.config)
+
+    @skipIf(onnxruntime is None, 'onnxruntime is not installed')
+    def test_hidden_states_match_torch(self):
+        with tempfile.TemporaryDirectory() as artifacts_dir:
+            path = os.path.join(artifacts_dir, 'body.onnx')
+            export_onnx(self.body, False, path)
+            hidden_states = OnnxBody(path, self.body.config)(self.input_ids)[0]
+        with torch.no_grad():
+            expected = self.body(self.input_ids)[0]
+        self.assertTrue(torch.allclose(hidden_states, expected, atol=1e-4))
+
+    @skipIf(onnxruntime is None, 'onnxruntime is not installed')
+    def test_past_matches_torch(self):
+        with tempfile.TemporaryDirectory() as artifacts_dir:
+            path = os.path.join(artifacts_dir, 'body.onnx')
+            export_onnx(self.body, False, path, with_past=True)
+            onnx_body = OnnxBody(path, self.body.config)
+            self.assertTrue(onnx_body.supports_past)
+            _, past = onnx_body(self.input_ids[:, :3], use_cache=True)
+            hidden_states = onnx_body(self.input_ids[:, 3:], past_key_values=past)[0]
+        with torch.no_grad():
+            expected = self.body(self.input_ids)[0][:, 3:]
+        self.assertTrue(torch.allclose(hidden_states, expected, atol=1e-4))
+
+
+class TorchScriptBodyTest(TestCase):
+
+    def test_hidden_states_match_torch(self):
+        torch.manual_seed(0)
+        body = GPT2Model(GPT2Config(vocab_size=50, n_positions=32, n_ctx=32, n_embd=16, n_layer=2, n_head=2))
+        body.eval()
+        traced_body = TorchScriptBody(body, False, warmup_lengths=[8])
+        input_ids = torch.tensor([[1, 2, 3], [4, 5, 6]])
+        with torch.no_grad():
+            expected = body(input_ids)[0]
+            hidden_states = traced_body(input_ids)[0]
+        self.assertTrue(torch.allclose(hidden_states, expected, atol=1e-5))
+
+
+@skipUnless(is_bfloat16_supported(), 'bfloat16 is not supported')
+class Bfloat16HeadTest(TestCase):
+
+    def test_best_logits_are_computed_in_fp32(self):
+        torch.manual_seed(0)
+        head = torch.nn.Linear(16, 100).to(torch.bfloat16)
+        hidden_states = torch.randn(2, 16).to(torch.bfloat16)
+        with torch.no_grad():
+            logits = Bfloat16Head(head, rerank_size=100)(hidden_states)
+            expected = hidden_states.float() @ head.weight.float().t() + head.bias.float()
+        self.assertEqual(logits.dtype, torch.float32)
+        self.assertTrue(torch.allclose(logits, expected, atol=1e-5))
@@ -0,0 +1,126 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import gc
+import threading
+import weakref
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from django.test import TestCase
+
+from document.batching import PredictionBatcher, get_length_bucket
+
+
+class LengthBucketTest(TestCase):
+
+    def test_short_inputs_share_minimum_bucket(self):
+        self.assertEqual(get_length_bucket(1), get_length_bucket(8))
+
+    def test_bucket_fits_input(self):
+        self.assertEqual(get_length_bucket(9), 16)
+        self.assertEqual(get_length_bucket(100), 128)
+
+
+class PredictionBatcherTest(TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def predict_batch(self, items):
+        self.batches.append(list(items))
+        return [item.upper() for item in items]
+
+    def test_submit_returns_own_result(self):
+        batcher = PredictionBatcher(self.predict_batch, 8, 0.01)
+        self.assertEqual(batcher.submit('you', 8), 'YOU')
+
+    def test_lonely_request_does_not_wait(self):
+        batcher = PredictionBatcher(self.predict_batch, 8, 60)
+        self.assertEqual(batcher.submit('you', 8), 'YOU')
+
+    def test_concurrent_requests_are_batched(self):
+        release = threading.Event()
+
+        def blocking_predict_batch(items):
+            release.wait()
+            return self.predict_batch(items)
+
+        batcher = PredictionBatcher(blocking_predict_batch, 8, 0.05)
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            first = executor.submit(batcher.submit, 'first', 8)
+            others = [executor.submit(batcher.submit, f'text{i}', 8) for i in range(4)]
+            release.set()
+            self.assertEqual(first.result(), 'FIRST')
+            self.assertEqual([other.result() for other in others], [f'TEXT{i}' for i in range(4)])
+        self.assertLess(len(self.batches), 5)
+
+    def test_batch_size_is_limited(self):
+        batcher = PredictionBatcher(self.predict_batch, 2, 0.05)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(lambda i: batcher.submit(str(i), 8), range(6)))
+        self.assertEqual(results, [str(i) for i in range(6)])
+        self.assertTrue(all(len(batch) <= 2 for batch in self.batches))
+
+    def test_buckets_are_not_mixed(self):
+        release = threading.Event()
+
+        def blocking_predict_batch(items):
+            release.wait()
+            return self.predict_batch(items)
+
+        batcher = PredictionBatcher(blocking_predict_batch, 8, 0.05)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(batcher.submit, f'{bucket}', bucket) for bucket in (8, 16, 8, 16)]
+            release.set()
+            [future.result() for future in futures]
+        for batch in self.batches:
+            self.assertEqual(len(set(batch)), 1)
+
+    def test_errors_are_propagated(self):
+        def failing_predict_batch(items):
+            raise RuntimeError('error')
+
+        batcher = PredictionBatcher(failing_predict_batch, 8, 0.01)
+        with self.assertRaises(RuntimeError):
+            batcher.submit('you', 8)
+
+    def test_cancelled_inputs_are_not_processed(self):
+        batcher = PredictionBatcher(self.predict_batch, 8, 0.01)
+        with self.assertRaises(CancelledError):
+            batcher.submit('old', 8, cancelled=lambda: True)
+        self.assertEqual(batcher.submit('new', 8, cancelled=lambda: False), 'NEW')
+        self.assertEqual(self.batches, [['new']])
+
+    def test_closed_batcher_releases_its_owner(self):
+        class Model:
+            def predict_batch(self, items):
+                return items
+
+        owner = Model()
+        batcher = PredictionBatcher(owner.predict_batch, 8, 0.01)
+        batcher.submit('you', 8)
+        worker = batcher._worker
+        reference = weakref.ref(owner)
+        batcher.close()
+        self.assertFalse(worker.is_alive())
+        del owner, batcher
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_closed_batcher_processes_requests_in_calling_thread(self):
+        batcher = PredictionBatcher(self.predict_batch, 8, 0.01)
+        batcher.submit('you', 8)
+        batcher.close()
+        self.assertEqual(batcher.submit('they', 8), 'THEY')
+        self.assertIsNone(batcher._worker)
@@ -0,0 +1,74 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+import os
+import tempfile
+from unittest.mock import Mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+from document.bundle import BUNDLE_VERSION, MANIFEST_FILE, get_bundle_path, get_checksum, read_manifest
+
+
+class ManifestTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.file_path = os.path.join(self.path, 'config.json')
+        with open(self.file_path, 'w') as bundle_file:
+            bundle_file.write('{}')
+        self.write_manifest(BUNDLE_VERSION)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_manifest(self, version: int):
+        manifest = {
+            'version': version,
+            'files': {'config.json': {'size': 2, 'sha256': get_checksum(self.file_path)}},
+        }
+        with open(os.path.join(self.path, MANIFEST_FILE), 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    def test_valid_bundle(self):
+        self.assertEqual(read_manifest(self.path, verify_checksums=True)['version'], BUNDLE_VERSION)
+
+    def test_missing_bundle(self):
+        with self.assertRaises(ImproperlyConfigured):
+            read_manifest(os.path.join(self.path, 'nonexistent'))
+
+    def test_wrong_version(self):
+        self.write_manifest(BUNDLE_VERSION + 1)
+        with self.assertRaises(ImproperlyConfigured):
+            read_manifest(self.path)
+
+    def test_incomplete_file(self):
+        with open(self.file_path, 'w') as bundle_file:
+            bundle_file.write('{')
+        with self.assertRaises(ImproperlyConfigured):
+            read_manifest(self.path)
+
+    def test_modified_file(self):
+        with open(self.file_path, 'w') as bundle_file:
+            bundle_file.write('[]')
+        read_manifest(self.path)
+        with self.assertRaises(ImproperlyConfigured):
+            read_manifest(self.path, verify_checksums=True)
+
+    def test_bundle_path_of_model_without_string_name(self):
+        # Prediction models are created with mocked names in tests
+        self.assertTrue(os.path.basename(get_bundle_path(Mock())).startswith('<Mock'))
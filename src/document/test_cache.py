@@ -0,0 +1,150 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import tempfile
+
+from django.test import TestCase
+
+from document.cache import PredictionCache, SharedPredictionCache
+from document.cache_backends import SQLiteCache
+
+
+class PredictionCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = PredictionCache(2, 1024 * 1024)
+
+    def test_get_stored_prediction(self):
+        self.cache.set(('gpt2', 'How are'), 'How are you')
+        self.assertEqual(self.cache.get(('gpt2', 'How are')), 'How are you')
+
+    def test_get_unknown_prediction(self):
+        self.assertIsNone(self.cache.get(('gpt2', 'How are')))
+
+    def test_keys_include_model(self):
+        self.cache.set(('gpt2', 'How are'), 'How are you')
+        self.assertIsNone(self.cache.get(('bert', 'How are')))
+
+    def test_counters(self):
+        self.cache.set(('gpt2', 'How are'), 'How are you')
+        self.cache.get(('gpt2', 'How are'))
+        self.cache.get(('gpt2', 'Hello'))
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set(('gpt2', 'first'), 'first one')
+        self.cache.set(('gpt2', 'second'), 'second one')
+        self.cache.get(('gpt2', 'first'))
+        self.cache.set(('gpt2', 'third'), 'third one')
+        self.assertEqual(self.cache.get(('gpt2', 'first')), 'first one')
+        self.assertIsNone(self.cache.get(('gpt2', 'second')))
+
+    def test_cache_is_bounded_by_size(self):
+        cache = PredictionCache(100, 400)
+        for i in range(10):
+            cache.set(('gpt2', f'text {i}'), f'text {i} prediction')
+        self.assertLessEqual(cache.stats()['bytes'], 400)
+        self.assertIsNotNone(cache.get(('gpt2', 'text 9')))
+
+    def test_big_entries_are_not_stored(self):
+        cache = PredictionCache(100, 100)
+        cache.set(('gpt2', 'text'), 'x' * 1000)
+        self.assertIsNone(cache.get(('gpt2', 'text')))
+
+    def test_size_of_candidates_includes_predictions(self):
+        cache = PredictionCache(100, 1000)
+        cache.set(('gpt2', 'text', 3), [('text ' + 'x' * 1000, 0.5)])
+        self.assertIsNone(cache.get(('gpt2', 'text', 3)))
+
+    def test_updated_entry_replaces_previous_value(self):
+        self.cache.set(('gpt2', 'How are'), 'How are you')
+        self.cache.set(('gpt2', 'How are'), 'How are they')
+        self.assertEqual(self.cache.get(('gpt2', 'How are')), 'How are they')
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+
+class SharedPredictionCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache = SharedPredictionCache('default')
+
+    def test_get_stored_prediction(self):
+        self.cache.set('gpt2', 'rev1', 'How are', 'How are you')
+        self.assertEqual(self.cache.get('gpt2', 'rev1', 'How are'), 'How are you')
+
+    def test_predictions_are_not_shared_across_revisions(self):
+        self.cache.set('gpt2', 'rev1', 'How are', 'How are you')
+        self.assertIsNone(self.cache.get('gpt2', 'rev2', 'How are'))
+
+    def test_predictions_are_not_shared_across_models(self):
+        self.cache.set('gpt2', 'rev1', 'How are', 'How are you')
+        self.assertIsNone(self.cache.get('distilgpt2', 'rev1', 'How are'))
+
+    def test_keys_are_short_and_have_no_spaces(self):
+        key = SharedPredictionCache.make_key('gpt2', 'rev1', 'How are ' * 100)
+        self.assertLess(len(key), 250)
+        self.assertNotIn(' ', key)
+
+
+class SQLiteCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': 10}})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_stored_value(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_get_unknown_value(self):
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_values_are_persistent(self):
+        self.cache.set('key', 'value')
+        other_cache = SQLiteCache(self.location, {})
+        self.assertEqual(other_cache.get('key'), 'value')
+
+    def test_expired_values_are_not_returned(self):
+        self.cache.set('key', 'value', timeout=0)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_does_not_replace_value(self):
+        self.cache.set('key', 'value')
+        self.assertFalse(self.cache.add('key', 'other value'))
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_delete(self):
+        self.cache.set('key', 'value')
+        self.assertTrue(self.cache.delete('key'))
+        self.assertFalse(self.cache.has_key('key'))
+
+    def test_clear(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertFalse(self.cache.has_key('key'))
+
+    def test_cache_is_culled(self):
+        self.cache.cull_check_interval = 1
+        for i in range(30):
+            self.cache.set(f'key{i}', i)
+        self.assertTrue(self.cache.has_key('key29'))
+        self.assertFalse(self.cache.has_key('key0'))
@@ -0,0 +1,36 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from django.test import TestCase
+
+from document.coldstart import STAGES, measure_stage, summarize_runs
+
+
+def create_run(seconds: float) -> dict:
+    return {'stages': {stage: {'seconds': seconds, 'rss_mb': seconds * 100} for stage in STAGES}}
+
+
+class ColdStartTest(TestCase):
+
+    def test_stage_is_measured(self):
+        stages = {}
+        with measure_stage(stages, 'django_setup'):
+            pass
+        self.assertGreaterEqual(stages['django_setup']['seconds'], 0)
+        self.assertGreater(stages['django_setup']['rss_mb'], 0)
+
+    def test_runs_are_summarized_with_the_median(self):
+        summary = summarize_runs([create_run(1), create_run(5), create_run(2)])
+        self.assertEqual(list(summary), list(STAGES))
+        self.assertEqual(summary['model_load'], {'seconds': 2, 'rss_mb': 200})
@@ -0,0 +1,144 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import asyncio
+import json
+import threading
+from unittest.mock import ANY, patch
+
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from document.consumers import CLOSE_FORBIDDEN, parse_message, prediction_websocket_application
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], PREDICTION_WEBSOCKET_PATH='/ws/predict/')
+class PredictionConsumerTest(TestCase):
+
+    def setUp(self):
+        self.test_user = User.objects.create(username='test_user')
+        self.client.force_login(self.test_user)
+        self.session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def get_communicator(self, path='/ws/predict/', origin='http://testserver', login=True):
+        headers = [(b'host', b'testserver'), (b'origin', origin.encode())]
+        if login:
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}={self.session}'.encode()))
+        scope = {'type': 'websocket', 'path': path, 'headers': headers}
+        return ApplicationCommunicator(prediction_websocket_application, scope)
+
+    async def connect(self, communicator) -> dict:
+        await communicator.send_input({'type': 'websocket.connect'})
+        return await communicator.receive_output(5)
+
+    async def test_anonymous_connection_is_rejected(self):
+        event = await self.connect(self.get_communicator(login=False))
+        self.assertEqual(event, {'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+
+    async def test_connection_from_other_site_is_rejected(self):
+        event = await self.connect(self.get_communicator(origin='http://example.com'))
+        self.assertEqual(event['type'], 'websocket.close')
+
+    async def test_unknown_path_is_rejected(self):
+        event = await self.connect(self.get_communicator(path='/ws/other/'))
+        self.assertEqual(event['type'], 'websocket.close')
+
+    @patch('document.consumers.PredictionService')
+    async def test_prediction_has_the_sequence_number(self, prediction_service_mock):
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_instance_name.return_value = self.test_user.settings.prediction_model
+        communicator = self.get_communicator()
+        self.assertEqual(await self.connect(communicator), {'type': 'websocket.accept'})
+        await communicator.send_input({'type': 'websocket.receive',
+                                       'text': json.dumps({'seq': 7, 'input': 'Hello, how are', 'id': '1'})})
+        event = await communicator.receive_output(5)
+        self.assertEqual(json.loads(event['text']), {'seq': 7, 'prediction': 'you', 'input_text': 'Hello, how are'})
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.assert_called_once_with(
+            'Hello, how are', session_key=(self.test_user.pk, '1', ANY), seq=7)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    async def test_wrong_message(self):
+        communicator = self.get_communicator()
+        await self.connect(communicator)
+        await communicator.send_input({'type': 'websocket.receive', 'text': '{"input": "Hello"}'})
+        event = await communicator.receive_output(5)
+        self.assertIn('error', json.loads(event['text']))
+
+    async def test_message_with_unhashable_document_is_wrong(self):
+        communicator = self.get_communicator()
+        await self.connect(communicator)
+        await communicator.send_input({'type': 'websocket.receive',
+                                       'text': json.dumps({'seq': 1, 'input': 'Hello', 'id': [1]})})
+        event = await communicator.receive_output(5)
+        self.assertEqual(json.loads(event['text']), {'error': 'Wrong message.'})
+        # The connection is still open
+        await communicator.send_input({'type': 'websocket.receive', 'text': '{"input": "Hello"}'})
+        event = await communicator.receive_output(5)
+        self.assertIn('error', json.loads(event['text']))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    @patch('document.consumers.PredictionService')
+    async def test_other_connection_of_document_does_not_supersede_messages(self, prediction_service_mock):
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_instance_name.return_value = self.test_user.settings.prediction_model
+        first, second = self.get_communicator(), self.get_communicator()
+        self.assertEqual(await self.connect(first), {'type': 'websocket.accept'})
+        self.assertEqual(await self.connect(second), {'type': 'websocket.accept'})
+        for communicator, seq in ((first, 1), (second, 1000), (first, 2)):
+            await communicator.send_input({'type': 'websocket.receive',
+                                           'text': json.dumps({'seq': seq, 'input': 'Hello, how are', 'id': '1'})})
+            event = await communicator.receive_output(5)
+            self.assertEqual(json.loads(event['text'])['seq'], seq)
+        for communicator in (first, second):
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+    @patch('document.consumers.logger')
+    @patch('document.consumers.PredictionService')
+    async def test_disconnection_cancels_predictions_quietly(self, prediction_service_mock, logger_mock):
+        release = threading.Event()
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.side_effect = \
+            lambda *args, **kwargs: release.wait(5)
+        prediction_service_mock.get_instance_name.return_value = self.test_user.settings.prediction_model
+        communicator = self.get_communicator()
+        await self.connect(communicator)
+        await communicator.send_input({'type': 'websocket.receive',
+                                       'text': json.dumps({'seq': 1, 'input': 'Hello, how are', 'id': '1'})})
+        await asyncio.sleep(0.1)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+        await asyncio.sleep(0.1)
+        release.set()
+        logger_mock.exception.assert_not_called()
+        self.assertTrue(await communicator.receive_nothing())
+
+
+class ParseMessageTest(SimpleTestCase):
+
+    def test_message(self):
+        self.assertEqual(parse_message('{"seq": 1, "input": "Hello", "id": "3", "k": 50}'),
+                         (1, 'Hello', '3', settings.PREDICTION_MAX_CANDIDATES))
+
+    def test_boolean_sequence_number_is_wrong(self):
+        with self.assertRaises(ValueError):
+            parse_message('{"seq": true, "input": "Hello"}')
+
+    def test_number_of_candidates_must_be_an_integer(self):
+        for k in ('1e999', '2.5', '"5"', 'true'):
+            with self.assertRaises(ValueError):
+                parse_message(f'{{"seq": 1, "input": "Hello", "k": {k}}}')
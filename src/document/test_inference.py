@@ -0,0 +1,42 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import torch
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from document import inference
+from document.inference import InferenceExecutor, set_inference_threads
+
+
+class InferenceThreadsTest(TestCase):
+
+    def setUp(self):
+        self.threads = torch.get_num_threads()
+        inference._threads_pid = None
+
+    def tearDown(self):
+        torch.set_num_threads(self.threads)
+        inference._threads_pid = None
+
+    @override_settings(PREDICTION_ASYNC_VIEWS=True, PREDICTION_INFERENCE_TORCH_THREADS=1)
+    def test_inference_threads_limit_torch_threads(self):
+        self.assertEqual(async_to_sync(InferenceExecutor().run)('model', torch.get_num_threads), 1)
+        # The pool of torch is shared by all the threads of the process
+        self.assertEqual(torch.get_num_threads(), 1)
+
+    @override_settings(PREDICTION_ASYNC_VIEWS=False, PREDICTION_INFERENCE_TORCH_THREADS=1)
+    def test_sync_views_keep_torch_threads(self):
+        set_inference_threads()
+        self.assertEqual(torch.get_num_threads(), self.threads)
@@ -0,0 +1,81 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase
+
+from document.apps import is_serving
+from document.lazy import LazyModule
+
+# Imports the URLconf in a new process and prints the heavy dependencies it imported
+IMPORTED_MODULES_SCRIPT = '''
+import sys
+import django
+django.setup()
+import SmartScribble.urls
+print(','.join(name for name in ('torch', 'transformers', 'numpy') if name in sys.modules))
+'''
+
+
+class LazyModuleTest(TestCase):
+
+    def test_module_is_imported_on_first_use(self):
+        module = LazyModule('json')
+        self.assertEqual(module.dumps([1]), '[1]')
+        self.assertTrue(module.is_loaded)
+        self.assertIs(module.load(), sys.modules['json'])
+
+    def test_missing_module_fails_on_first_use(self):
+        module = LazyModule('document.nonexistent')
+        self.assertFalse(module.is_loaded)
+        with self.assertRaises(ImportError):
+            module.load()
+
+    def test_url_configuration_does_not_import_prediction_dependencies(self):
+        environment = dict(os.environ, PREDICTION_PRELOAD='none')
+        environment.setdefault('DJANGO_SETTINGS_MODULE', 'SmartScribble.settings')
+        result = subprocess.run([sys.executable, '-c', IMPORTED_MODULES_SCRIPT], cwd=settings.BASE_DIR,
+                                env=environment, stdout=subprocess.PIPE, check=True, universal_newlines=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class IsServingTest(TestCase):
+
+    def setUp(self):
+        # The test variable, which selects the test database, means the process runs tests
+        environ = patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop('test', None)
+
+    def test_management_commands_do_not_serve(self):
+        with patch('sys.argv', ['manage.py', 'migrate']):
+            self.assertFalse(is_serving())
+
+    def test_runserver_serves(self):
+        with patch('sys.argv', ['manage.py', 'runserver']):
+            self.assertTrue(is_serving())
+
+    def test_wsgi_server_serves(self):
+        with patch('sys.argv', ['gunicorn', 'SmartScribble.wsgi']):
+            self.assertTrue(is_serving())
+
+    def test_test_environment_does_not_serve(self):
+        with patch('sys.argv', ['gunicorn', 'SmartScribble.wsgi']), patch.dict(os.environ, test='1'):
+            self.assertFalse(is_serving())
@@ -0,0 +1,43 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from document.memory import PeakMemoryMonitor, get_memory_usage, get_rss
+
+
+class MemoryTest(TestCase):
+
+    def test_rss(self):
+        self.assertGreater(get_rss(), 0)
+
+    def test_memory_usage(self):
+        usage = get_memory_usage()
+        self.assertGreater(usage['rss'], 0)
+        self.assertEqual(usage['shared'] + usage['private'], usage['rss'])
+
+    @patch('builtins.open', side_effect=FileNotFoundError)
+    def test_memory_usage_without_procfs(self, open_mock):
+        self.assertEqual(list(get_memory_usage()), ['rss'])
+        self.assertGreater(get_memory_usage()['rss'], 0)
+
+    def test_peak_includes_released_memory(self):
+        with PeakMemoryMonitor(interval=0.001) as monitor:
+            block = bytearray(64 * 2 ** 20)
+            for index in range(0, len(block), 4096):
+                block[index] = 1
+            del block
+        self.assertGreaterEqual(monitor.increase, 32 * 2 ** 20)
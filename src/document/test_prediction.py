@@ -12,23 +12,49 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import gc
 import sys
-from unittest.mock import patch, Mock
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, Mock, PropertyMock
 
-from django.test import TestCase
+import torch
+from django.test import TestCase, override_settings
 from transformers import GPT2Tokenizer, GPT2LMHeadModel, AlbertTokenizer, AlbertForMaskedLM
 
-from document.prediction import PredictionModel
+from document.backends import QUANTIZED_BACKEND
+from document.cache import SharedPredictionCache
+from document.supersession import PredictionSuperseded
+from document.prediction import PredictionModel, sequence_tracker
 from register.models import PredictionModels
 
 
+def create_tokenizer_class():
+    """
+
+    Returns: Mocked class of tokenizer whose vocabulary is empty, so every typed word is complete
+
+    """
+    tokenizer = Mock()
+    tokenizer.from_pretrained.return_value.get_vocab.return_value = {}
+    tokenizer.from_pretrained.return_value.all_special_ids = []
+    return tokenizer
+
+
 class PredictionServiceTest(TestCase):
 
     # noinspection PyUnresolvedReferences
     def setUp(self):
-        del sys.modules['document.prediction']
+        self.prediction_module = sys.modules.pop('document.prediction')
         from document.prediction import PredictionService
 
+    def tearDown(self):
+        # The rest of tests patch the module their PredictionModel comes from
+        sys.modules['document.prediction'] = self.prediction_module
+        sys.modules['document'].prediction = self.prediction_module
+
     def test_nonexistent_prediction_model(self):
         from document.prediction import PredictionService
         with self.assertRaises(ValueError):
@@ -48,6 +74,159 @@ class PredictionServiceTest(TestCase):
         prediction_model_mock.assert_called_once()
         self.assertEqual(model1, model2)
 
+    @override_settings(PREDICTION_MEMORY_BUDGET_MB=250)
+    @patch('document.prediction.get_rss')
+    @patch('document.prediction.PredictionModel')
+    def test_least_recently_used_model_is_unloaded(self, prediction_model_mock, rss_mock):
+        from document.prediction import PredictionService
+        megabyte = 2 ** 20
+        rss_mock.side_effect = [index * 100 * megabyte for index in (0, 1, 1, 2, 2, 3, 3, 4)]
+        PredictionService.instance(PredictionModels.GPT2.name)
+        PredictionService.instance(PredictionModels.DGPT2.name)
+        PredictionService.instance(PredictionModels.GPT2.name)
+        PredictionService.instance(PredictionModels.BERT.name)
+        self.assertEqual(list(PredictionService.get_footprints()),
+                         [PredictionModels.GPT2.name, PredictionModels.BERT.name])
+        PredictionService.instance(PredictionModels.DGPT2.name)
+        self.assertEqual(prediction_model_mock.call_count, 4)
+        self.assertEqual(list(PredictionService.get_footprints()),
+                         [PredictionModels.BERT.name, PredictionModels.DGPT2.name])
+
+    @override_settings(PREDICTION_MEMORY_BUDGET_MB=250, PREDICTION_BATCH_MAX_SIZE=8)
+    @patch('document.prediction.get_rss')
+    def test_unloaded_model_is_freed(self, rss_mock):
+        from document.prediction import PredictionService, PredictionModel as ServicePredictionModel
+        megabyte = 2 ** 20
+        rss_mock.side_effect = [index * 100 * megabyte for index in (0, 2, 2, 4)]
+        references = []
+
+        def create_prediction_model(prediction_model, *args, **kwargs):
+            instance = ServicePredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'distilgpt2', False)
+            # Requests without a document go through the batching thread
+            instance.get_prediction('How are ')
+            references.append(weakref.ref(instance))
+            return instance
+
+        with patch.object(PredictionService, '_create', side_effect=create_prediction_model):
+            PredictionService.instance(PredictionModels.DGPT2.name)
+            PredictionService.instance(PredictionModels.GPT2.name)
+        gc.collect()
+        self.assertIsNone(references[0]())
+        self.assertIsNotNone(references[1]())
+
+    @patch('document.prediction.get_rss')
+    @patch('document.prediction.PredictionModel')
+    def test_parallel_loads_measure_model_weights(self, prediction_model_mock, rss_mock):
+        from document.prediction import PredictionService
+        megabyte = 2 ** 20
+        rss_mock.return_value = 0
+        both_loading = threading.Barrier(2, timeout=5)
+
+        def create_prediction_model(tokenizer, head_model, pretrained, *args, **kwargs):
+            both_loading.wait()
+            rss_mock.return_value += 300 * megabyte
+            model = Mock()
+            model.get_size.return_value = (200 if pretrained == 'distilgpt2' else 100) * megabyte
+            return model
+
+        prediction_model_mock.side_effect = create_prediction_model
+        futures = [PredictionService.load_async(PredictionModels.DGPT2.name),
+                   PredictionService.load_async(PredictionModels.GPT2.name)]
+        for future in futures:
+            future.result()
+        self.assertEqual(PredictionService.get_footprints(),
+                         {PredictionModels.DGPT2.name: 200 * megabyte, PredictionModels.GPT2.name: 100 * megabyte})
+
+    @override_settings(PREDICTION_MEMORY_BUDGET_MB=1000)
+    @patch('document.prediction.get_rss')
+    @patch('document.prediction.PredictionModel')
+    def test_loads_are_serialized_with_memory_budget(self, prediction_model_mock, rss_mock):
+        from document.prediction import PredictionService
+        megabyte = 2 ** 20
+        rss_mock.return_value = 0
+        loading = []
+        max_loading = []
+
+        def create_prediction_model(*args, **kwargs):
+            loading.append(args)
+            max_loading.append(len(loading))
+            time.sleep(0.1)
+            rss_mock.return_value += 300 * megabyte
+            loading.remove(args)
+            return Mock()
+
+        prediction_model_mock.side_effect = create_prediction_model
+        futures = [PredictionService.load_async(PredictionModels.DGPT2.name),
+                   PredictionService.load_async(PredictionModels.GPT2.name)]
+        for future in futures:
+            future.result()
+        self.assertEqual(max(max_loading), 1)
+        self.assertEqual(PredictionService.get_footprints(),
+                         {PredictionModels.DGPT2.name: 300 * megabyte, PredictionModels.GPT2.name: 300 * megabyte})
+
+    @override_settings(PREDICTION_LOAD_RETRY_SECONDS=0.2)
+    @patch('document.prediction.PredictionModel')
+    def test_failed_model_is_loaded_again_after_delay(self, prediction_model_mock):
+        from document.prediction import PredictionService, MODEL_FAILED, MODEL_UNLOADED
+        model = Mock()
+        bert_loads = [OSError('Connection reset'), model]
+
+        def create_prediction_model(tokenizer, head_model, pretrained, *args, **kwargs):
+            if pretrained != 'bert-base-cased':
+                return Mock()
+            result = bert_loads.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        prediction_model_mock.side_effect = create_prediction_model
+        with self.assertRaises(OSError):
+            PredictionService.load_async(PredictionModels.BERT.name).result()
+        PredictionService.get_ready_instance(PredictionModels.BERT.name)
+        self.assertEqual(PredictionService.get_state(PredictionModels.BERT.name), MODEL_FAILED)
+        time.sleep(0.2)
+        PredictionService.get_ready_instance(PredictionModels.BERT.name)
+        self.assertNotIn(PredictionService.get_state(PredictionModels.BERT.name), (MODEL_FAILED, MODEL_UNLOADED))
+        self.assertIs(PredictionService.instance(PredictionModels.BERT.name), model)
+        self.assertIs(PredictionService.get_ready_instance(PredictionModels.BERT.name), model)
+
+    @patch('document.prediction.PredictionModel')
+    def test_concurrent_requests_load_model_once(self, prediction_model_mock):
+        from document.prediction import PredictionService
+
+        def create_prediction_model(*args, **kwargs):
+            time.sleep(0.1)
+            return Mock()
+
+        prediction_model_mock.side_effect = create_prediction_model
+        threads = [threading.Thread(target=PredictionService.instance, args=(PredictionModels.GPT2.name,))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        prediction_model_mock.assert_called_once()
+
+    @patch('document.prediction.PredictionModel')
+    def test_fallback_model_is_used_while_loading(self, prediction_model_mock):
+        from document.prediction import PredictionService, MODEL_LOADING, MODEL_READY
+        release = threading.Event()
+
+        def create_prediction_model(tokenizer, head_model, pretrained, *args, **kwargs):
+            if pretrained == 'gpt2-medium':
+                release.wait(5)
+            return Mock()
+
+        prediction_model_mock.side_effect = create_prediction_model
+        fallback = PredictionService.load_async(PredictionModels.DGPT2.name).result()
+        self.assertIs(PredictionService.get_ready_instance(PredictionModels.GPT2.name), fallback)
+        self.assertEqual(PredictionService.get_instance_name(fallback), PredictionModels.DGPT2.name)
+        self.assertEqual(PredictionService.get_state(PredictionModels.GPT2.name), MODEL_LOADING)
+        release.set()
+        model = PredictionService.load_async(PredictionModels.GPT2.name).result()
+        self.assertEqual(PredictionService.get_state(PredictionModels.GPT2.name), MODEL_READY)
+        self.assertIs(PredictionService.get_ready_instance(PredictionModels.GPT2.name), model)
+
 
 class PredictionModelTest(TestCase):
     def setUp(self):
@@ -131,3 +310,188 @@ class PredictionModelTest(TestCase):
         prediction_model = PredictionModel(Mock(), Mock(), Mock(), True)
         response = prediction_model.get_prediction('How are y')
         self.assertEqual(response, '')
+
+    def test_batched_predictions_match_single_predictions(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        texts = ['How are ', 'The capital of France is']
+        encodings = [prediction_model._tokenizer(prediction_model._prepare_text(text)) for text in texts]
+        for encoding, batched_logits in zip(encodings, prediction_model._predict_batch(encodings)):
+            logits = prediction_model._predict_batch([encoding])[0]
+            self.assertEqual(torch.argmax(batched_logits).item(), torch.argmax(logits).item())
+
+    def test_session_predictions_match_predictions_without_session(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        for text in ['How', 'How are', 'How are ', 'How are y', 'How were ', 'How are you']:
+            self.assertEqual(prediction_model._run_prediction(text, session_key='session'),
+                             prediction_model._run_prediction(text))
+
+    @patch('document.prediction.PredictionModel._run_prediction')
+    def test_cached_prediction_skips_inference(self, run_mock):
+        run_mock.return_value = 'How are you'
+        prediction_model = PredictionModel(create_tokenizer_class(), Mock(), 'cached_model', False)
+        self.assertEqual(prediction_model.get_prediction('How are '), 'you')
+        self.assertEqual(prediction_model.get_prediction('How are'), '&nbsp;you')
+        run_mock.assert_called_once()
+
+    @patch('document.prediction.PredictionModel.revision', new_callable=PropertyMock, return_value='rev1')
+    @patch('document.prediction.PredictionModel._run_prediction')
+    def test_shared_cached_prediction_skips_inference(self, run_mock, revision_mock):
+        shared_cache = SharedPredictionCache('default')
+        shared_cache.set('shared_model', 'rev1', 'How are\0', 'How are you')
+        with patch('document.prediction.shared_prediction_cache', shared_cache):
+            prediction_model = PredictionModel(create_tokenizer_class(), Mock(), 'shared_model', False)
+            self.assertEqual(prediction_model.get_prediction('How are '), 'you')
+        run_mock.assert_not_called()
+
+    @patch('document.prediction.PredictionModel._run_prediction')
+    def test_cached_or_running_prediction_needs_no_inference(self, run_mock):
+        release = threading.Event()
+
+        def blocking_run(text, session_key=None, seq=None):
+            release.wait(5)
+            return 'How are you'
+
+        run_mock.side_effect = blocking_run
+        prediction_model = PredictionModel(create_tokenizer_class(), Mock(), 'is_cached_model', False)
+        self.assertFalse(prediction_model.is_cached('How are '))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(prediction_model.get_prediction, 'How are ')
+            while not prediction_model.is_cached('How are '):
+                time.sleep(0.01)
+            release.set()
+            future.result()
+        self.assertTrue(prediction_model.is_cached('How are '))
+        self.assertFalse(prediction_model.is_cached('How are ', 5))
+
+    @patch('document.prediction.PredictionModel._run_prediction')
+    def test_concurrent_identical_predictions_share_inference(self, run_mock):
+        release = threading.Event()
+
+        def blocking_run(text, session_key=None, seq=None):
+            release.wait()
+            return 'How are you'
+
+        run_mock.side_effect = blocking_run
+        prediction_model = PredictionModel(Mock(), Mock(), 'single_flight_model', False)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(prediction_model.get_prediction, 'How are ', session_key=('user', str(i)))
+                       for i in range(4)]
+            time.sleep(0.1)
+            release.set()
+            self.assertEqual([future.result() for future in futures], ['you'] * 4)
+        run_mock.assert_called_once()
+
+    @patch('document.prediction.PredictionModel._compute_candidates')
+    def test_concurrent_identical_candidates_share_inference(self, compute_mock):
+        release = threading.Event()
+
+        def blocking_compute(text, k, session_key=None, seq=None):
+            release.wait()
+            return [('How are you', 0.5), ('How are we', 0.2)]
+
+        compute_mock.side_effect = blocking_compute
+        prediction_model = PredictionModel(Mock(), Mock(), 'single_flight_candidates_model', False)
+        # The editor asks for 5 candidates, and every document has its own session and sequence numbers
+        session_keys = [('user', f'candidates{i}') for i in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(prediction_model.get_candidates, 'How are ', 5, session_key=session_key,
+                                       seq=sequence_tracker.advance(session_key))
+                       for session_key in session_keys]
+            time.sleep(0.1)
+            release.set()
+            for future in futures:
+                self.assertEqual([candidate['prediction'] for candidate in future.result()], ['you', 'we'])
+        compute_mock.assert_called_once()
+
+    @patch('document.prediction.PredictionModel._run_prediction')
+    def test_superseded_prediction_skips_inference(self, run_mock):
+        run_mock.return_value = 'How are you'
+        prediction_model = PredictionModel(Mock(), Mock(), 'superseded_model', False)
+        session_key = ('user', 'superseded')
+        old_seq = sequence_tracker.advance(session_key)
+        sequence_tracker.advance(session_key)
+        with self.assertRaises(PredictionSuperseded):
+            prediction_model.get_prediction('How are ', session_key=session_key, seq=old_seq)
+        run_mock.assert_not_called()
+
+    @override_settings(PREDICTION_BATCH_MAX_SIZE=8)
+    def test_superseded_request_is_dropped_from_batch(self):
+        # Models that use mask have no inference sessions, so their requests always go through the batcher
+        prediction_model = PredictionModel(AlbertTokenizer, AlbertForMaskedLM, 'albert-base-v2', True)
+        session_key = ('user', 'batched')
+        old_seq = sequence_tracker.advance(session_key)
+        sequence_tracker.advance(session_key)
+        with self.assertRaises(PredictionSuperseded):
+            prediction_model._compute_logits('How are', session_key, old_seq)
+
+    def test_revision_identifies_weights(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        revision = prediction_model.revision
+        with torch.no_grad():
+            prediction_model._model.lm_head.weight[0, 0] += 1
+        prediction_model._revision = None
+        self.assertNotEqual(prediction_model.revision, revision)
+
+    def test_get_candidates_no_mask_model(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        candidates = prediction_model.get_candidates('How are ', 3)
+        self.assertEqual(len(candidates), 3)
+        self.assertEqual(candidates[0]['prediction'], prediction_model.get_prediction('How are '))
+        probabilities = [candidate['probability'] for candidate in candidates]
+        self.assertEqual(probabilities, sorted(probabilities, reverse=True))
+
+    @patch('document.prediction.PredictionModel._decode_prediction')
+    @patch('document.prediction.PredictionModel._get_logits')
+    def test_get_candidates_skips_predictions_that_do_not_continue_input(self, logits_mock, decode_mock):
+        logits_mock.return_value = ([1, 2], torch.tensor([3., 2., 1., 0.]))
+        decode_mock.side_effect = lambda input_ids, token_index: ['How are you', 'Who', 'How are we', 'How'][
+            token_index]
+        prediction_model = PredictionModel(Mock(), Mock(), Mock(), False)
+        candidates = prediction_model.get_candidates('How are ', 2)
+        self.assertEqual([candidate['prediction'] for candidate in candidates], ['you', 'we'])
+
+    def test_get_prediction_no_mask_model_half_word(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        self.assertEqual(prediction_model.get_prediction('How are yo'), 'u')
+
+    def test_get_prediction_complete_word(self):
+        # "you" also starts longer words, but the next word is predicted if it is the most likely token
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        self.assertEqual(prediction_model.get_prediction('How are you'),
+                         '&nbsp;' + prediction_model.get_prediction('How are you '))
+
+    def test_get_prediction_mask_model_half_word(self):
+        prediction_model = PredictionModel(AlbertTokenizer, AlbertForMaskedLM, 'albert-base-v2', True)
+        self.assertEqual(prediction_model.get_prediction('How are yo'), 'u')
+
+    def test_half_word_is_removed_from_model_input(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        self.assertEqual(prediction_model._prepare_text('How are yo'), 'How are')
+        self.assertEqual(prediction_model._prepare_text('How are xqzv'), 'How are xqzv')
+
+    def test_last_position_logits_match_full_model_logits(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False)
+        prediction_inputs = prediction_model._tokenize('How are you')
+        logits, _ = prediction_model._forward(prediction_inputs, [-1])
+        with torch.no_grad():
+            expected_logits = prediction_model._model(**prediction_inputs)[0][0, -1]
+        self.assertTrue(torch.allclose(logits[0], expected_logits, atol=1e-4))
+
+    def test_mask_position_logits_match_full_model_logits(self):
+        prediction_model = PredictionModel(AlbertTokenizer, AlbertForMaskedLM, 'albert-base-v2', True)
+        prediction_inputs = prediction_model._tokenize('How are ')
+        position = prediction_model._get_predicted_item_position(prediction_inputs)
+        logits, _ = prediction_model._forward(prediction_inputs, [position])
+        with torch.no_grad():
+            expected_logits = prediction_model._model(**prediction_inputs)[0][0, position]
+        self.assertTrue(torch.allclose(logits[0], expected_logits, atol=1e-4))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            PredictionModel(Mock(), Mock(), Mock(), False, backend='nonexistent')
+
+    def test_get_prediction_quantized_model(self):
+        prediction_model = PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False, backend=QUANTIZED_BACKEND)
+        self.assertEqual(prediction_model.get_prediction('How are '), 'you')
+        self.assertNotEqual(prediction_model.revision,
+                            PredictionModel(GPT2Tokenizer, GPT2LMHeadModel, 'gpt2', False).revision)
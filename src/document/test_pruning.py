@@ -0,0 +1,59 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import tempfile
+from collections import Counter
+
+import torch
+from django.test import TestCase, override_settings
+
+from document.pruning import PrunedHead, load_vocabulary, save_vocabulary
+
+
+class VocabularyFileTest(TestCase):
+
+    def test_vocabulary_is_sorted_by_frequency(self):
+        with tempfile.TemporaryDirectory() as artifacts_dir, override_settings(PREDICTION_ARTIFACTS_DIR=artifacts_dir):
+            save_vocabulary('model', Counter({3: 1, 7: 5, 1: 2}))
+            self.assertEqual(load_vocabulary('model', 2), [7, 1])
+
+    def test_missing_vocabulary(self):
+        with tempfile.TemporaryDirectory() as artifacts_dir, override_settings(PREDICTION_ARTIFACTS_DIR=artifacts_dir):
+            self.assertIsNone(load_vocabulary('model', 2))
+
+
+class PrunedHeadTest(TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.head = torch.nn.Linear(4, 10)
+        self.hidden_states = torch.randn(3, 4)
+
+    def test_pruned_logits_match_full_head(self):
+        pruned_head = PrunedHead(self.head, [1, 5, 8], min_confidence=0)
+        with torch.no_grad():
+            logits = pruned_head(self.hidden_states)
+            expected = self.head(self.hidden_states)
+        self.assertTrue(torch.allclose(logits[:, [1, 5, 8]], expected[:, [1, 5, 8]]))
+        self.assertTrue(torch.isinf(logits[:, [0, 2, 3, 4, 6, 7, 9]]).all())
+        self.assertEqual(pruned_head.fallbacks, 0)
+        self.assertEqual(pruned_head.predictions, 3)
+
+    def test_low_confidence_uses_full_head(self):
+        pruned_head = PrunedHead(self.head, [1, 5, 8], min_confidence=1.01)
+        with torch.no_grad():
+            logits = pruned_head(self.hidden_states)
+            expected = self.head(self.hidden_states)
+        self.assertTrue(torch.allclose(logits, expected))
+        self.assertEqual(pruned_head.fallbacks, 3)
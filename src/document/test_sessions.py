@@ -0,0 +1,53 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from django.test import TestCase
+
+from document.sessions import InferenceSessionStore, get_common_prefix_length
+
+
+class CommonPrefixTest(TestCase):
+
+    def test_equal_lists(self):
+        self.assertEqual(get_common_prefix_length([1, 2, 3], [1, 2, 3]), 3)
+
+    def test_appended_tokens(self):
+        self.assertEqual(get_common_prefix_length([1, 2], [1, 2, 3, 4]), 2)
+
+    def test_edited_tokens(self):
+        self.assertEqual(get_common_prefix_length([1, 2, 3, 4], [1, 5, 3, 4]), 1)
+
+    def test_empty_list(self):
+        self.assertEqual(get_common_prefix_length([], [1, 2]), 0)
+
+
+class InferenceSessionStoreTest(TestCase):
+
+    def test_same_key_returns_same_session(self):
+        store = InferenceSessionStore(2)
+        self.assertIs(store.get((1, '1')), store.get((1, '1')))
+
+    def test_different_keys_return_different_sessions(self):
+        store = InferenceSessionStore(2)
+        self.assertIsNot(store.get((1, '1')), store.get((1, '2')))
+
+    def test_least_recently_used_session_is_discarded(self):
+        store = InferenceSessionStore(2)
+        first = store.get('first')
+        second = store.get('second')
+        store.get('first')
+        store.get('third')
+        self.assertEqual(len(store), 2)
+        self.assertIs(store.get('first'), first)
+        self.assertIsNot(store.get('second'), second)
@@ -0,0 +1,98 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import TestCase
+
+from document.singleflight import SingleFlight
+from document.supersession import PredictionSuperseded
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.calls = 0
+
+    def compute(self, result):
+        self.calls += 1
+        return result
+
+    def test_do_returns_result(self):
+        self.assertEqual(self.single_flight.do('key', lambda: self.compute('you')), 'you')
+        self.assertEqual(self.single_flight.stats(), {'in_flight': 0, 'leaders': 1, 'followers': 0})
+
+    def test_concurrent_calls_share_computation(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_compute():
+            started.set()
+            release.wait()
+            return self.compute('you')
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(self.single_flight.do, 'key', blocking_compute)
+            started.wait()
+            followers = [executor.submit(self.single_flight.do, 'key', lambda: self.compute('other'))
+                         for _ in range(3)]
+            while self.single_flight.stats()['followers'] < 3:
+                time.sleep(0.01)
+            release.set()
+            self.assertEqual(leader.result(), 'you')
+            self.assertEqual([follower.result() for follower in followers], ['you'] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_different_keys_are_not_shared(self):
+        self.assertEqual(self.single_flight.do('first', lambda: self.compute('first')), 'first')
+        self.assertEqual(self.single_flight.do('second', lambda: self.compute('second')), 'second')
+        self.assertEqual(self.calls, 2)
+
+    def test_sequential_calls_compute_again(self):
+        self.single_flight.do('key', lambda: self.compute('you'))
+        self.single_flight.do('key', lambda: self.compute('you'))
+        self.assertEqual(self.calls, 2)
+
+    def test_errors_are_propagated(self):
+        def failing_compute():
+            raise RuntimeError('error')
+
+        with self.assertRaises(RuntimeError):
+            self.single_flight.do('key', failing_compute)
+        self.assertEqual(self.single_flight.stats()['in_flight'], 0)
+
+    def test_followers_retry_when_leader_is_superseded(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def superseded_compute():
+            started.set()
+            release.wait()
+            raise PredictionSuperseded()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(self.single_flight.do, 'key', superseded_compute, PredictionSuperseded)
+            started.wait()
+            follower = executor.submit(self.single_flight.do, 'key', lambda: self.compute('you'),
+                                       PredictionSuperseded)
+            while self.single_flight.stats()['followers'] < 1:
+                time.sleep(0.01)
+            release.set()
+            with self.assertRaises(PredictionSuperseded):
+                leader.result()
+            self.assertEqual(follower.result(), 'you')
+        self.assertEqual(self.calls, 1)
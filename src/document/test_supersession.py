@@ -0,0 +1,65 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from django.test import TestCase
+
+from document.supersession import PredictionSuperseded, SequenceTracker
+
+
+class SequenceTrackerTest(TestCase):
+
+    def setUp(self):
+        self.tracker = SequenceTracker(2)
+
+    def test_older_requests_are_superseded(self):
+        self.tracker.advance('doc', 1)
+        self.tracker.advance('doc', 2)
+        self.assertTrue(self.tracker.is_superseded('doc', 1))
+        self.assertFalse(self.tracker.is_superseded('doc', 2))
+
+    def test_requests_are_numbered_in_order_of_arrival(self):
+        first = self.tracker.advance('doc')
+        second = self.tracker.advance('doc')
+        self.assertGreater(second, first)
+        self.assertTrue(self.tracker.is_superseded('doc', first))
+
+    def test_late_request_does_not_supersede_newer_one(self):
+        self.tracker.advance('doc', 5)
+        self.assertEqual(self.tracker.advance('doc', 3), 3)
+        self.assertTrue(self.tracker.is_superseded('doc', 3))
+        self.assertFalse(self.tracker.is_superseded('doc', 5))
+
+    def test_documents_are_independent(self):
+        self.tracker.advance('doc1', 1)
+        self.tracker.advance('doc2', 2)
+        self.assertFalse(self.tracker.is_superseded('doc1', 1))
+
+    def test_unnumbered_requests_are_never_superseded(self):
+        self.tracker.advance('doc', 2)
+        self.assertFalse(self.tracker.is_superseded('doc', None))
+        self.assertFalse(self.tracker.is_superseded(None, 1))
+
+    def test_dropped_requests_are_counted(self):
+        self.tracker.advance('doc', 1)
+        self.tracker.advance('doc', 2)
+        with self.assertRaises(PredictionSuperseded):
+            self.tracker.check('doc', 1)
+        self.tracker.check('doc', 2)
+        self.assertEqual(self.tracker.stats(), {'tracked': 1, 'superseded': 1})
+
+    def test_least_recently_used_documents_are_forgotten(self):
+        for index in range(3):
+            self.tracker.advance(f'doc{index}', 2)
+        self.assertEqual(self.tracker.stats()['tracked'], 2)
+        self.assertFalse(self.tracker.is_superseded('doc0', 1))
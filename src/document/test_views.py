@@ -12,14 +12,20 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
-from unittest.mock import patch
+import threading
+from unittest.mock import ANY, Mock, patch
 
-from django.contrib.auth.models import User
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
 
+from document.admission import COMPLETION, KEYSTROKE, AdmissionRejected
 from document.forms import DocumentEditionForm
 from document.models import Document
+from document.prediction import PredictionModel
+from document.test_prediction import create_tokenizer_class
+from document.views import async_full_predict_view, async_predict_view
 from register.models import PredictionModels
 
 
@@ -218,7 +224,7 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
 
         response = self.client.get('/predict/', data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
@@ -229,7 +235,7 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
 
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
@@ -266,7 +272,7 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
         try:
@@ -280,7 +286,7 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
         try:
@@ -294,7 +300,7 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['prediction'], 'you')
@@ -305,10 +311,10 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
-        prediction_service_mock.instance.assert_called_once_with(self.test_user.settings.prediction_model)
+        prediction_service_mock.get_ready_instance.assert_called_once_with(self.test_user.settings.prediction_model)
 
     @patch('document.views.PredictionService')
     def test_view_predicts_with_desired_model_when_changed(self, prediction_service_mock):
@@ -318,16 +324,16 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
-        prediction_service_mock.instance.assert_called_once_with(PredictionModels.GPT2.value)
+        prediction_service_mock.get_ready_instance.assert_called_once_with(PredictionModels.GPT2.value)
 
         self.test_user.settings.prediction_model = PredictionModels.BERT
         self.test_user.save()
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
-        prediction_service_mock.instance.assert_called_with(PredictionModels.BERT.value)
+        prediction_service_mock.get_ready_instance.assert_called_with(PredictionModels.BERT.value)
 
     @patch('document.views.PredictionService')
     def test_view_predicts_with_desired_text(self, prediction_service_mock):
@@ -335,7 +341,249 @@ class PredictViewTest(TestCase):
         data = {
             'input': 'Hello, how are'
         }
-        prediction_service_mock.instance.return_value.get_prediction.return_value = 'you'
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
         response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
-        prediction_service_mock.instance().get_prediction.assert_called_once_with(data['input'])
+        prediction_service_mock.get_ready_instance().get_prediction.assert_called_once_with(
+            data['input'], session_key=(self.test_user.pk, None, None), seq=ANY)
+
+    @patch('document.views.PredictionService')
+    def test_view_predicts_with_document_session(self, prediction_service_mock):
+        self.client.force_login(self.test_user)
+        data = {
+            'input': 'Hello, how are',
+            'id': '3'
+        }
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
+        response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        prediction_service_mock.get_ready_instance().get_prediction.assert_called_once_with(
+            data['input'], session_key=(self.test_user.pk, data['id'], None), seq=ANY)
+
+    @patch('document.views.PredictionService')
+    def test_view_provides_candidates(self, prediction_service_mock):
+        self.client.force_login(self.test_user)
+        data = {
+            'input': 'Hello, how are',
+            'k': '2'
+        }
+        candidates = [{'prediction': 'you', 'probability': 0.5}, {'prediction': 'they', 'probability': 0.2}]
+        prediction_service_mock.get_ready_instance.return_value.get_candidates.return_value = candidates
+        response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['prediction'], 'you')
+        self.assertEqual(response.json()['candidates'], candidates)
+        prediction_service_mock.get_ready_instance().get_candidates.assert_called_once_with(
+            data['input'], 2, session_key=(self.test_user.pk, None, None), seq=ANY)
+
+    @patch('document.prediction.PredictionModel._compute_candidates')
+    @patch('document.views.PredictionService')
+    def test_repeated_candidates_request_skips_inference(self, prediction_service_mock, compute_mock):
+        compute_mock.return_value = [('Hello, how are you', 0.5)]
+        prediction_service_mock.get_ready_instance.return_value = PredictionModel(create_tokenizer_class(), Mock(),
+                                                                                  'repeated_model', False)
+        self.client.force_login(self.test_user)
+        data = {'input': 'Hello, how are', 'k': '5', 'id': 'repeated'}
+        for _ in range(2):
+            response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.json()['candidates'], [{'prediction': '&nbsp;you', 'probability': 0.5}])
+        compute_mock.assert_called_once()
+
+    @patch('document.views.PredictionService')
+    def test_view_limits_number_of_candidates(self, prediction_service_mock):
+        self.client.force_login(self.test_user)
+        data = {
+            'input': 'Hello, how are',
+            'k': '1000'
+        }
+        prediction_service_mock.get_ready_instance.return_value.get_candidates.return_value = []
+        response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['prediction'], '')
+        self.assertLessEqual(prediction_service_mock.get_ready_instance().get_candidates.call_args[0][1], 10)
+
+    def test_view_throws_500_with_wrong_number_of_candidates(self):
+        self.client.force_login(self.test_user)
+        data = {
+            'input': 'Hello, how are',
+            'k': 'many'
+        }
+        response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 500)
+
+    @patch('document.views.PredictionService')
+    def test_view_returns_empty_prediction_while_loading(self, prediction_service_mock):
+        self.client.force_login(self.test_user)
+        data = {
+            'input': 'Hello, how are'
+        }
+        prediction_service_mock.get_ready_instance.return_value = None
+        response = self.client.get(reverse('prediction'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['prediction'], '')
+
+    @patch('document.views.PredictionService')
+    def test_superseded_request_is_not_predicted(self, prediction_service_mock):
+        self.client.force_login(self.test_user)
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'u'
+        self.client.get(reverse('prediction'), {'input': 'Hello, how are yo', 'id': 'superseded', 'seq': '10'},
+                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.reset_mock()
+        response = self.client.get(reverse('prediction'), {'input': 'Hello, how are', 'id': 'superseded', 'seq': '9'},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['superseded'])
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.assert_not_called()
+
+    @patch('document.views.PredictionService')
+    def test_other_client_of_document_does_not_supersede_requests(self, prediction_service_mock):
+        self.client.force_login(self.test_user)
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.return_value = 'you'
+
+        def request(client: str, seq: int):
+            return self.client.get(reverse('prediction'), {'input': 'Hello, how are', 'id': 'shared',
+                                                           'client': client, 'seq': str(seq)},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+        self.assertEqual(request('first', 1)['prediction'], 'you')
+        # A page opened later numbers its requests from a higher value
+        self.assertEqual(request('second', 1000)['prediction'], 'you')
+        self.assertEqual(request('first', 2)['prediction'], 'you')
+        self.assertTrue(request('second', 999)['superseded'])
+
+    def test_view_throws_500_with_wrong_sequence_number(self):
+        self.client.force_login(self.test_user)
+        response = self.client.get(reverse('prediction'), {'input': 'Hello, how are', 'seq': 'last'},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 500)
+
+    @patch('document.views.admission_controller')
+    @patch('document.views.PredictionService')
+    def test_shed_request_gets_empty_prediction(self, prediction_service_mock, admission_controller_mock):
+        admission_controller_mock.admit.side_effect = AdmissionRejected(KEYSTROKE, 1)
+        self.client.force_login(self.test_user)
+        response = self.client.get(reverse('prediction'), {'input': 'Hello, how are'},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'prediction': '', 'input_text': 'Hello, how are', 'shed': True})
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.assert_not_called()
+
+    @patch('document.views.admission_controller')
+    @patch('document.views.PredictionService')
+    def test_cached_request_takes_no_admission_slot(self, prediction_service_mock, admission_controller_mock):
+        prediction_model = prediction_service_mock.get_ready_instance.return_value
+        prediction_model.get_prediction.return_value = 'you'
+        self.client.force_login(self.test_user)
+        for cached in (True, False):
+            prediction_model.is_cached.return_value = cached
+            self.client.get(reverse('prediction'), {'input': 'Hello, how are'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            admission_controller_mock.admit.assert_called_with(self.test_user.pk, KEYSTROKE, not cached)
+        prediction_model.is_cached.assert_called_with('Hello, how are', None)
+
+    @patch('document.views.admission_controller')
+    @patch('document.views.PredictionService')
+    def test_shed_completion_gets_retry_after(self, prediction_service_mock, admission_controller_mock):
+        admission_controller_mock.admit.side_effect = AdmissionRejected(COMPLETION, 3)
+        self.client.force_login(self.test_user)
+        response = self.client.get(reverse('complete_prediction'), {'input': 'Hello, how are'},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+        prediction_service_mock.instance.assert_not_called()
+
+
+class AsyncPredictViewTest(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(username='test_user')
+        self.factory = RequestFactory()
+
+    def get(self, view, user, data: dict):
+        request = self.factory.get('/predict/', data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        request.user = user
+        return async_to_sync(view)(request)
+
+    def test_redirect_if_not_logged(self):
+        response = self.get(async_predict_view, AnonymousUser(), {'input': 'Hello, how are'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/login/'))
+
+    @patch('document.views.PredictionService')
+    def test_prediction_runs_in_an_inference_thread(self, prediction_service_mock):
+        threads = []
+
+        def get_prediction(text, session_key=None, seq=None):
+            threads.append(threading.current_thread().name)
+            return 'you'
+
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.side_effect = get_prediction
+        prediction_service_mock.get_instance_name.return_value = self.test_user.settings.prediction_model
+        response = self.get(async_predict_view, self.test_user, {'input': 'Hello, how are'})
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {'prediction': 'you', 'input_text': 'Hello, how are'})
+        self.assertTrue(threads[0].startswith(f'inference-{self.test_user.settings.prediction_model}'))
+
+    @patch('document.views.PredictionService')
+    def test_fallback_prediction_runs_in_a_thread_of_the_fallback_model(self, prediction_service_mock):
+        threads = []
+
+        def get_prediction(text, session_key=None, seq=None):
+            threads.append(threading.current_thread().name)
+            return 'you'
+
+        prediction_service_mock.get_ready_instance.return_value.get_prediction.side_effect = get_prediction
+        prediction_service_mock.get_instance_name.return_value = PredictionModels.DGPT2.name
+        self.get(async_predict_view, self.test_user, {'input': 'Hello, how are'})
+        prediction_service_mock.get_instance_name.assert_called_once_with(
+            prediction_service_mock.get_ready_instance.return_value)
+        self.assertTrue(threads[0].startswith(f'inference-{PredictionModels.DGPT2.name}'))
+
+    @patch('document.views.PredictionService')
+    def test_empty_prediction_while_loading(self, prediction_service_mock):
+        prediction_service_mock.get_ready_instance.return_value = None
+        response = self.get(async_predict_view, self.test_user, {'input': 'Hello, how are', 'k': '3'})
+        self.assertJSONEqual(response.content, {'prediction': '', 'candidates': [], 'input_text': 'Hello, how are'})
+
+    def test_wrong_request(self):
+        response = self.get(async_predict_view, self.test_user, {'other': 'Hello, how are'})
+        self.assertEqual(response.status_code, 500)
+
+    @patch('document.views.PredictionService')
+    def test_full_prediction(self, prediction_service_mock):
+        prediction_service_mock.instance.return_value.get_full_prediction.return_value = ' you?'
+        response = self.get(async_full_predict_view, self.test_user, {'input': 'Hello, how are'})
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {'prediction': ' you?', 'input_text': 'Hello, how are'})
+        prediction_service_mock.instance.assert_called_once_with(PredictionModels.GPT2.name)
+
+
+class PredictionStatusViewTest(TestCase):
+
+    @patch('document.views.PredictionService')
+    def test_status_is_503_while_loading(self, prediction_service_mock):
+        prediction_service_mock.get_states.return_value = {PredictionModels.GPT2.name: 'loading'}
+        prediction_service_mock.get_footprints.return_value = {}
+        response = self.client.get(reverse('prediction_status'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+
+    @patch('document.views.PredictionService')
+    def test_status_reports_models(self, prediction_service_mock):
+        states = {PredictionModels.GPT2.name: 'loading', PredictionModels.DGPT2.name: 'ready'}
+        prediction_service_mock.get_states.return_value = states
+        prediction_service_mock.get_footprints.return_value = {PredictionModels.DGPT2.name: 2 ** 20}
+        self.client.force_login(User.objects.create(username='staff_user', is_staff=True))
+        response = self.client.get(reverse('prediction_status'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['models'], states)
+        self.assertEqual(response.json()['memory_mb'], {PredictionModels.DGPT2.name: 1})
+
+    @patch('document.views.PredictionService')
+    def test_status_hides_process_details_from_other_users(self, prediction_service_mock):
+        states = {PredictionModels.DGPT2.name: 'ready'}
+        prediction_service_mock.get_states.return_value = states
+        response = self.client.get(reverse('prediction_status'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ready': True, 'models': states})
+        self.client.force_login(User.objects.create(username='test_user'))
+        response = self.client.get(reverse('prediction_status'))
+        self.assertEqual(response.json(), {'ready': True, 'models': states})
@@ -0,0 +1,66 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from unittest.mock import Mock
+
+from django.test import TestCase
+
+from document.vocabulary import VocabularyIndex
+
+
+def create_tokenizer(vocabulary: dict, special_ids=()):
+    tokenizer = Mock()
+    tokenizer.get_vocab.return_value = vocabulary
+    tokenizer.all_special_ids = list(special_ids)
+    tokenizer.convert_tokens_to_string.side_effect = lambda tokens: ''.join(tokens).replace('Ġ', ' ').replace(
+        '▁', ' ')
+    return tokenizer
+
+
+class VocabularyIndexTest(TestCase):
+
+    def setUp(self):
+        self.vocabulary = {'Ġyou': 0, 'Ġyour': 1, 'Ġyes': 2, 'you': 3, 'ĠYoung': 4, 'Ġyo': 5, '<|endoftext|>': 6}
+        self.index = VocabularyIndex(create_tokenizer(self.vocabulary, [6]))
+
+    def test_tokens_with_prefix(self):
+        self.assertCountEqual(self.index.get_token_ids('yo'), [0, 1, 4])
+
+    def test_prefix_is_case_insensitive(self):
+        self.assertCountEqual(self.index.get_token_ids('Yo'), [0, 1, 4])
+
+    def test_tokens_that_do_not_start_a_word_are_ignored(self):
+        self.assertNotIn(3, self.index.get_token_ids('y'))
+
+    def test_special_tokens_are_ignored(self):
+        self.assertEqual(self.index.get_token_ids('<'), [])
+
+    def test_has_continuations(self):
+        self.assertTrue(self.index.has_continuations('you'))
+        self.assertFalse(self.index.has_continuations('your'))
+        self.assertFalse(self.index.has_continuations('x'))
+
+    def test_word_tokens(self):
+        self.assertCountEqual(self.index.get_word_token_ids('You'), [0])
+        self.assertEqual(self.index.get_word_token_ids('yours'), [])
+
+    def test_sentencepiece_vocabulary(self):
+        index = VocabularyIndex(create_tokenizer({'▁you': 0, '▁your': 1, 'ing': 2}))
+        self.assertCountEqual(index.get_token_ids('yo'), [0, 1])
+        self.assertEqual(index.get_token_ids('i'), [])
+
+    def test_wordpiece_vocabulary(self):
+        index = VocabularyIndex(create_tokenizer({'you': 0, 'your': 1, '##you': 2, '[CLS]': 3}, [3]))
+        self.assertCountEqual(index.get_token_ids('yo'), [0, 1])
+        self.assertEqual(len(index), 2)
@@ -0,0 +1,96 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import mmap
+import os
+import tempfile
+import threading
+from unittest.mock import Mock, patch
+
+import torch
+from django.test import TestCase
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from document.weights import assign_weights, create_empty_model, create_pretrained_model, load_flat_weights, \
+    load_pretrained_weights, save_flat_weights, skip_init
+
+
+class FlatWeightsTest(TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.config = GPT2Config(vocab_size=50, n_positions=32, n_ctx=32, n_embd=16, n_layer=2, n_head=2)
+        self.model = GPT2LMHeadModel(self.config)
+        self.model.eval()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'weights.bin')
+        save_flat_weights(self.model, self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_tensors_are_page_aligned(self):
+        tensors = load_flat_weights(self.path)
+        for tensor in tensors.values():
+            if tensor.numel():
+                self.assertEqual(tensor.data_ptr() % mmap.PAGESIZE, 0)
+
+    def test_loaded_model_matches_original(self):
+        model = GPT2LMHeadModel(self.config)
+        model.eval()
+        assign_weights(model, load_flat_weights(self.path))
+        input_ids = torch.tensor([[1, 2, 3]])
+        with torch.no_grad():
+            self.assertTrue(torch.equal(model(input_ids)[0], self.model(input_ids)[0]))
+
+    def test_tied_weights_stay_tied(self):
+        model = GPT2LMHeadModel(self.config)
+        assign_weights(model, load_flat_weights(self.path))
+        self.assertIs(model.lm_head.weight, model.transformer.wte.weight)
+
+
+class EmptyModelTest(TestCase):
+
+    def test_initialization_is_restored(self):
+        config = GPT2Config(vocab_size=50, n_positions=32, n_ctx=32, n_embd=16, n_layer=2, n_head=2)
+        model = create_empty_model(GPT2LMHeadModel, config)
+        self.assertIs(model.lm_head.weight, model.transformer.wte.weight)
+        torch.manual_seed(0)
+        self.assertNotEqual(torch.nn.init.normal_(torch.zeros(10)).abs().sum().item(), 0)
+
+    def test_models_are_not_created_while_initialization_is_skipped(self):
+        head_model = Mock()
+        thread = threading.Thread(target=create_pretrained_model, args=(head_model, 'gpt2'))
+        with skip_init():
+            thread.start()
+            thread.join(0.1)
+            head_model.from_pretrained.assert_not_called()
+        thread.join(5)
+        head_model.from_pretrained.assert_called_once_with('gpt2')
+
+
+class PretrainedWeightsTest(TestCase):
+
+    @patch('document.weights.cached_path')
+    @patch('document.weights.torch.load')
+    def test_only_missing_parameters_are_initialized(self, load_mock, cached_path_mock):
+        config = GPT2Config(vocab_size=50, n_positions=32, n_ctx=32, n_embd=16, n_layer=2, n_head=2)
+        checkpoint = GPT2LMHeadModel(config).state_dict()
+        checkpoint['transformer.ln_f.weight'].fill_(2)
+        del checkpoint['transformer.ln_f.bias']
+        load_mock.return_value = dict(checkpoint)
+        model = create_empty_model(GPT2LMHeadModel, config)
+        load_pretrained_weights(model, 'gpt2')
+        self.assertTrue(torch.equal(model.transformer.ln_f.weight, torch.full((16,), 2.)))
+        self.assertTrue(torch.equal(model.transformer.ln_f.bias, torch.zeros(16)))
@@ -13,15 +13,23 @@
 #  limitations under the License.
 #
 
+import os
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseServerError, JsonResponse, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
+from .admission import COMPLETION, KEYSTROKE, AdmissionRejected, admission_controller
 from .forms import DocumentEditionForm, ChangeNameDocumentForm, ChangeDescriptionDocumentForm
+from .inference import inference_executor
+from .memory import get_memory_usage
 from .models import Document
-from .prediction import PredictionService
+from .prediction import MODEL_READY, PredictionService, prediction_cache, sequence_tracker, single_flight
+from .supersession import PredictionSuperseded
 from register.models import PredictionModels
 
 
@@ -84,7 +92,8 @@ def edit_document_view(request):
             'formName': ChangeNameDocumentForm(initial={'id': doc_id}),
             'formDescription': ChangeDescriptionDocumentForm(initial={'id': doc_id}),
             'title': doc.title,
-            'description': doc.description, }
+            'description': doc.description,
+            'prediction_websocket_path': settings.PREDICTION_WEBSOCKET_PATH, }
 
     return render(request, 'document/textEditor.html', data)
 
@@ -111,6 +120,156 @@ def save_document_view(request):
         return HttpResponseServerError('Error saving')
 
 
+INPUT_KEY = 'input'
+DOCUMENT_KEY = 'id'
+CLIENT_KEY = 'client'
+CANDIDATES_KEY = 'k'
+SEQUENCE_KEY = 'seq'
+
+
+def _get_user_data(request):
+    """
+
+    Args:
+        request: HTTP request
+
+    Returns: Id and prediction model of the user, None if the user is not authenticated
+
+    """
+    if not request.user.is_authenticated:
+        return None
+    return request.user.pk, request.user.settings.prediction_model
+
+
+def _parse_predict_request(request, user_pk):
+    """
+
+    Args:
+        request: HTTP request
+        user_pk: Id of the user
+
+    Returns: Input text, inference session key, number of candidates (None for a single prediction) and sequence
+             number of the request (None if the client doesn't number its requests), or the error response if the
+             request is wrong
+
+    """
+    if not (request.method == 'GET' and request.is_ajax() and INPUT_KEY in request.GET):
+        return HttpResponseServerError('Empty request.')
+    text = request.GET[INPUT_KEY]
+    # Consecutive requests of a page of a user in a document share an inference session and their sequence numbers.
+    # Other tabs and devices with the same document open are other clients, so they don't supersede these requests.
+    session_key = (user_pk, request.GET.get(DOCUMENT_KEY), request.GET.get(CLIENT_KEY))
+    k = None
+    if CANDIDATES_KEY in request.GET:
+        try:
+            k = max(min(int(request.GET[CANDIDATES_KEY]), settings.PREDICTION_MAX_CANDIDATES), 1)
+        except ValueError:
+            return HttpResponseServerError('Wrong request.')
+    seq = None
+    if SEQUENCE_KEY in request.GET:
+        try:
+            seq = int(request.GET[SEQUENCE_KEY])
+        except ValueError:
+            return HttpResponseServerError('Wrong request.')
+    return text, session_key, k, seq
+
+
+def get_empty_prediction_response(text: str, k) -> dict:
+    """
+
+    Args:
+        text: Input text
+        k: Number of candidates, None for a single prediction
+
+    Returns: Response of a prediction request that can't be served
+
+    """
+    response = {'prediction': '', 'input_text': text}
+    if k is not None:
+        response['candidates'] = []
+    return response
+
+
+def get_prediction_response(prediction_model, text: str, session_key, k, seq: int = None) -> dict:
+    """
+
+    Args:
+        prediction_model: Prediction model
+        text: Input text
+        session_key: Identifier of the inference session
+        k: Number of candidates, None for a single prediction
+        seq: Sequence number of the request in the inference session
+
+    Returns: Response of a prediction request. It is empty and marked as superseded if a newer request of the
+             session arrived before the prediction was computed.
+
+    """
+    try:
+        sequence_tracker.check(session_key, seq)
+        if k is None:
+            prediction = prediction_model.get_prediction(text, session_key=session_key, seq=seq)
+            return {'prediction': prediction, 'input_text': text}
+        candidates = prediction_model.get_candidates(text, k, session_key=session_key, seq=seq)
+    except PredictionSuperseded:
+        return dict(get_empty_prediction_response(text, k), superseded=True)
+    prediction = candidates[0]['prediction'] if candidates else ''
+    return {'prediction': prediction, 'candidates': candidates, 'input_text': text}
+
+
+def get_shed_prediction_response(text: str, k) -> dict:
+    """
+
+    Args:
+        text: Input text
+        k: Number of candidates, None for a single prediction
+
+    Returns: Response of a prediction request shed by the admission control. It is as cheap as an empty one.
+
+    """
+    return dict(get_empty_prediction_response(text, k), shed=True)
+
+
+def _get_shed_completion_response(exception: AdmissionRejected) -> JsonResponse:
+    """
+
+    Args:
+        exception: Rejection of a long prediction request by the admission control
+
+    Returns: HTTP response that tells the client when to try again
+
+    """
+    response = JsonResponse({'error': 'Too many requests.'}, status=503)
+    response['Retry-After'] = str(exception.retry_after)
+    return response
+
+
+def _get_full_predictor(prediction_model: str) -> str:
+    """
+
+    Args:
+        prediction_model: Prediction model of the user
+
+    Returns: Model used for long predictions
+
+    """
+    if prediction_model == PredictionModels.GPT2.name:
+        return PredictionModels.GPT2.name
+    return PredictionModels.DGPT2.name
+
+
+def _get_full_prediction(predictor: str, text: str) -> dict:
+    """
+
+    Args:
+        predictor: Model used for long predictions
+        text: Input text
+
+    Returns: Response of a long prediction request
+
+    """
+    return {'prediction': PredictionService.instance(predictor).get_full_prediction(text), 'input_text': text}
+
+
 @login_required
 def predict_view(request):
     """
@@ -123,13 +282,58 @@ def predict_view(request):
     Returns: HTTP response
 
     """
-    INPUT_KEY = 'input'
-    if request.method == 'GET' and request.is_ajax() and INPUT_KEY in request.GET:
-        # Encode a text inputs
-        text = request.GET[INPUT_KEY]
-        prediction = PredictionService.instance(request.user.settings.prediction_model).get_prediction(text)
-        return JsonResponse({'prediction': prediction, 'input_text': text})
-    return HttpResponseServerError('Empty request.')
+    parsed_request = _parse_predict_request(request, request.user.pk)
+    if isinstance(parsed_request, HttpResponse):
+        return parsed_request
+    text, session_key, k, seq = parsed_request
+    seq = sequence_tracker.advance(session_key, seq)
+    # Requests are not blocked while the model of the user is loading
+    prediction_model = PredictionService.get_ready_instance(request.user.settings.prediction_model)
+    if prediction_model is None:
+        return JsonResponse(get_empty_prediction_response(text, k))
+    try:
+        # Only inferences take an admission slot
+        with admission_controller.admit(request.user.pk, KEYSTROKE, not prediction_model.is_cached(text, k)):
+            return JsonResponse(get_prediction_response(prediction_model, text, session_key, k, seq))
+    except AdmissionRejected:
+        return JsonResponse(get_shed_prediction_response(text, k))
+
+
+async def async_predict_view(request):
+    """
+
+    Get a prediction. The prediction runs in a thread of the inference executor, so the connection doesn't hold
+    a worker while it waits.
+
+    Args:
+        request: HTTP request
+
+    Returns: HTTP response
+
+    """
+    user_data = await sync_to_async(_get_user_data)(request)
+    if user_data is None:
+        return redirect_to_login(request.get_full_path())
+    user_pk, user_prediction_model = user_data
+    parsed_request = _parse_predict_request(request, user_pk)
+    if isinstance(parsed_request, HttpResponse):
+        return parsed_request
+    text, session_key, k, seq = parsed_request
+    seq = sequence_tracker.advance(session_key, seq)
+    prediction_model = PredictionService.get_ready_instance(user_prediction_model)
+    if prediction_model is None:
+        return JsonResponse(get_empty_prediction_response(text, k))
+    try:
+        # The threads of the model that serves the request, which is the fallback model while the model of the
+        # user is loading
+        served_model = PredictionService.get_instance_name(prediction_model) or user_prediction_model
+        # Only inferences take an admission slot. Requests that wait for the result of another one take a thread.
+        async with admission_controller.admit_async(user_pk, KEYSTROKE, not prediction_model.is_cached(text, k)):
+            response = await inference_executor.run(served_model, get_prediction_response, prediction_model, text,
+                                                    session_key, k, seq)
+    except AdmissionRejected:
+        response = get_shed_prediction_response(text, k)
+    return JsonResponse(response)
 
 
 @login_required
@@ -144,14 +348,69 @@ def full_predict_view(request):
     Returns: HTTP response
 
     """
-    INPUT_KEY = 'input'
     if request.method == 'GET' and request.is_ajax() and INPUT_KEY in request.GET:
-        # Encode a text inputs
-        text = request.GET[INPUT_KEY]
-        if request.user.settings.prediction_model == PredictionModels.GPT2.name:
-            predictor = PredictionModels.GPT2.name
-        else:
-            predictor = PredictionModels.DGPT2.name
-        prediction = PredictionService.instance(predictor).get_full_prediction(text)
-        return JsonResponse({'prediction': prediction, 'input_text': text})
+        predictor = _get_full_predictor(request.user.settings.prediction_model)
+        try:
+            with admission_controller.admit(request.user.pk, COMPLETION):
+                return JsonResponse(_get_full_prediction(predictor, request.GET[INPUT_KEY]))
+        except AdmissionRejected as exception:
+            return _get_shed_completion_response(exception)
+    return HttpResponseServerError('Empty request.')
+
+
+async def async_full_predict_view(request):
+    """
+
+    Get a long prediction. It runs in a thread of the inference executor.
+
+    Args:
+        request: HTTP request
+
+    Returns: HTTP response
+
+    """
+    user_data = await sync_to_async(_get_user_data)(request)
+    if user_data is None:
+        return redirect_to_login(request.get_full_path())
+    if request.method == 'GET' and request.is_ajax() and INPUT_KEY in request.GET:
+        predictor = _get_full_predictor(user_data[1])
+        try:
+            async with admission_controller.admit_async(user_data[0], COMPLETION):
+                return JsonResponse(await inference_executor.run(predictor, _get_full_prediction, predictor,
+                                                                 request.GET[INPUT_KEY]))
+        except AdmissionRejected as exception:
+            return _get_shed_completion_response(exception)
     return HttpResponseServerError('Empty request.')
+
+
+def prediction_status_view(request):
+    """
+
+    Report whether the prediction models are loaded in this process. The memory and the traffic of the process are
+    only reported to staff users.
+
+    Args:
+        request: HTTP request
+
+    Returns: HTTP response. The status is 503 until a prediction model is ready.
+
+    """
+    states = PredictionService.get_states()
+    ready = MODEL_READY in states.values()
+    if not request.user.is_staff:
+        return JsonResponse({'ready': ready, 'models': states}, status=200 if ready else 503)
+    footprints = PredictionService.get_footprints()
+    return JsonResponse({
+        'ready': ready,
+        'models': states,
+        'memory_mb': {prediction_model: footprint / 2 ** 20 for prediction_model, footprint in footprints.items()},
+        'load_peak_mb': {prediction_model: peak / 2 ** 20
+                         for prediction_model, peak in PredictionService.get_load_peaks().items()},
+        'cache': prediction_cache.stats(),
+        'inference_pending': inference_executor.stats(),
+        'sequences': sequence_tracker.stats(),
+        'single_flight': single_flight.stats(),
+        'admission': admission_controller.stats(),
+        'pid': os.getpid(),
+        'process_memory_mb': {name: size / 2 ** 20 for name, size in get_memory_usage().items()},
+    }, status=200 if ready else 503)
@@ -0,0 +1,102 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from bisect import bisect_left
+
+# Markers of tokens that start a word in byte-level BPE (GPT-2) and SentencePiece (ALBERT) vocabularies
+WORD_START_MARKERS = ('Ġ', '▁')
+# Marker of tokens that continue a word in WordPiece (BERT) vocabularies
+WORD_CONTINUATION_MARKER = '##'
+
+
+class VocabularyIndex:
+    """ This class finds the tokens of a vocabulary that start a word with a given prefix """
+
+    def __init__(self, tokenizer):
+        """
+
+        Args:
+            tokenizer: Tokenizer whose vocabulary is indexed
+
+        Returns: An instance of a vocabulary index
+
+        """
+        vocabulary = tokenizer.get_vocab()
+        special_ids = set(tokenizer.all_special_ids)
+        is_wordpiece = any(token.startswith(WORD_CONTINUATION_MARKER) for token in vocabulary)
+        entries = []
+        for token, token_id in vocabulary.items():
+            if token_id in special_ids:
+                continue
+            if token.startswith(WORD_START_MARKERS):
+                word = tokenizer.convert_tokens_to_string([token]).strip()
+            elif is_wordpiece and not token.startswith(WORD_CONTINUATION_MARKER):
+                word = token
+            else:
+                continue
+            if word:
+                entries.append((word.lower(), token_id))
+        entries.sort()
+        # Words and token ids sorted by word, so the words with a prefix are contiguous
+        self._words = [word for word, _ in entries]
+        self._token_ids = [token_id for _, token_id in entries]
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def has_continuations(self, prefix: str) -> bool:
+        """
+
+        Args:
+            prefix: Beginning of a word
+
+        Returns: True if a token starts a word with the given prefix (case insensitive) and is longer
+
+        """
+        prefix = prefix.lower()
+        index = bisect_left(self._words, prefix)
+        while index < len(self._words) and self._words[index].startswith(prefix):
+            if len(self._words[index]) > len(prefix):
+                return True
+            index += 1
+        return False
+
+    def get_token_ids(self, prefix: str) -> list:
+        """
+
+        Args:
+            prefix: Beginning of a word
+
+        Returns: Ids of the tokens that start a word with the given prefix (case insensitive) and are longer
+
+        """
+        prefix = prefix.lower()
+        start = bisect_left(self._words, prefix)
+        end = bisect_left(self._words, prefix + '\uffff', start)
+        return [token_id for word, token_id in zip(self._words[start:end], self._token_ids[start:end])
+                if len(word) > len(prefix)]
+
+    def get_word_token_ids(self, word: str) -> list:
+        """
+
+        Args:
+            word: A word
+
+        Returns: Ids of the tokens that start a word and are the given word (case insensitive)
+
+        """
+        word = word.lower()
+        start = bisect_left(self._words, word)
+        end = bisect_left(self._words, word + '\0', start)
+        return self._token_ids[start:end]
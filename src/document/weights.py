@@ -0,0 +1,292 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import contextlib
+import functools
+import json
+import mmap
+import os
+import struct
+import threading
+
+import numpy
+import torch
+from django.conf import settings
+from transformers.file_utils import WEIGHTS_NAME, cached_path, hf_bucket_url
+from transformers.modeling_utils import PreTrainedModel
+from transformers.utils import logging
+
+# Tensors start at page boundaries, so they can be mapped and shared by several processes
+PAGE_SIZE = mmap.PAGESIZE
+# The file starts with the size of the JSON header as an unsigned 64-bit integer
+HEADER_SIZE_FORMAT = '<Q'
+FORMAT_VERSION = 1
+# Functions of torch.nn.init that are disabled while models are created without initializing their weights
+INIT_FUNCTIONS = ('uniform_', 'normal_', 'constant_', 'ones_', 'zeros_', 'eye_', 'dirac_', 'xavier_uniform_',
+                  'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_', 'trunc_normal_', 'orthogonal_', 'sparse_')
+
+logger = logging.get_logger(__name__)
+
+# The initialization is disabled for the whole process, so it is held while models are created: models created by
+# other threads meanwhile would not be initialized
+_construction_lock = threading.RLock()
+_saved_init = {}
+
+
+def get_weights_path(pretrained: str) -> str:
+    """
+
+    Args:
+        pretrained: Name of the pretrained model
+
+    Returns: Path of the flat weights file of the model
+
+    """
+    return os.path.join(settings.PREDICTION_ARTIFACTS_DIR, 'weights', f'{pretrained}.bin')
+
+
+def _align(offset: int) -> int:
+    return (offset + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+def save_flat_weights(model: torch.nn.Module, path: str):
+    """
+    Write the state dict of a model in a flat file. Tensors shared by several modules (tied weights) are written
+    once.
+
+    Args:
+        model: PyTorch model
+        path: Path of the file
+
+    """
+    entries = {}
+    tensors = []
+    aliases = {}
+    for name, tensor in model.state_dict().items():
+        key = (tensor.data_ptr(), tuple(tensor.shape), tensor.dtype)
+        if key in aliases:
+            entries[name] = {'alias': aliases[key]}
+            continue
+        if tensor.dtype == torch.bfloat16:
+            raise ValueError('bfloat16 tensors cannot be stored in flat weight files')
+        aliases[key] = name
+        array = tensor.detach().contiguous().numpy()
+        entries[name] = {'dtype': array.dtype.name, 'shape': list(array.shape), 'size': array.nbytes}
+        tensors.append((name, array))
+
+    # Offsets are relative to the first page after the header
+    offset = 0
+    for name, array in tensors:
+        entries[name]['offset'] = offset
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'version': FORMAT_VERSION, 'tensors': entries}).encode()
+    data_start = _align(struct.calcsize(HEADER_SIZE_FORMAT) + len(header))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as weights_file:
+        weights_file.write(struct.pack(HEADER_SIZE_FORMAT, len(header)))
+        weights_file.write(header)
+        for name, array in tensors:
+            weights_file.seek(data_start + entries[name]['offset'])
+            weights_file.write(array.tobytes())
+        weights_file.truncate(data_start + offset)
+
+
+def load_flat_weights(path: str) -> dict:
+    """
+    Map a flat weights file in memory. Tensors are views of the mapping, no data is copied. The mapping is
+    copy-on-write: the pages are shared by all the processes that map the file until a process writes to them,
+    and the file is never modified.
+
+    Args:
+        path: Path of the file
+
+    Returns: Tensors by name. Tied tensors are the same object.
+
+    """
+    buffer = numpy.memmap(path, dtype=numpy.uint8, mode='c')
+    header_size = struct.unpack_from(HEADER_SIZE_FORMAT, buffer)[0]
+    start = struct.calcsize(HEADER_SIZE_FORMAT)
+    header = json.loads(buffer[start:start + header_size].tobytes())
+    if header['version'] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported version of flat weights file: {header["version"]}')
+    data_start = _align(start + header_size)
+    tensors = {}
+    for name, entry in header['tensors'].items():
+        if 'alias' in entry:
+            continue
+        offset = data_start + entry['offset']
+        array = buffer[offset:offset + entry['size']].view(entry['dtype']).reshape(entry['shape'])
+        tensors[name] = torch.from_numpy(array)
+    for name, entry in header['tensors'].items():
+        if 'alias' in entry:
+            tensors[name] = tensors[entry['alias']]
+    return tensors
+
+
+def assign_weights(model: torch.nn.Module, tensors: dict):
+    """
+    Replace the parameters and buffers of a model with the given tensors without copying them. Tied parameters
+    stay tied.
+
+    Args:
+        model: PyTorch model
+        tensors: Tensors by name of the state dict of the model
+
+    """
+    parameters = {}
+    # New parameter of every replaced parameter, so that the modules that share it also get the new one
+    replacements = {}
+    for name, tensor in tensors.items():
+        module_name, _, attribute = name.rpartition('.')
+        module = functools.reduce(getattr, module_name.split('.'), model) if module_name else model
+        if attribute in module._parameters:
+            if id(tensor) not in parameters:
+                parameters[id(tensor)] = torch.nn.Parameter(tensor, requires_grad=False)
+            replacements[id(module._parameters[attribute])] = parameters[id(tensor)]
+        elif attribute in module._buffers:
+            module._buffers[attribute] = tensor
+        else:
+            raise ValueError(f'{name} is not a parameter or buffer of the model')
+    for module in model.modules():
+        for attribute, parameter in module._parameters.items():
+            if parameter is not None and id(parameter) in replacements:
+                module._parameters[attribute] = replacements[id(parameter)]
+
+
+def _skip(tensor, *args, **kwargs):
+    return tensor
+
+
+@contextlib.contextmanager
+def skip_init():
+    """
+    Models created in this context allocate their weights but do not initialize them. The operating system does
+    not back the allocated pages with memory until they are written, so creating a model costs almost no memory
+    if its weights are replaced afterwards. The functions of torch.nn.init are replaced in the whole process, so
+    models are created one at a time: other threads wait in skip_init or create_pretrained_model.
+    """
+    with _construction_lock:
+        if _saved_init:
+            # Nested context, the initialization is already disabled
+            yield
+            return
+        for name in INIT_FUNCTIONS:
+            if hasattr(torch.nn.init, name):
+                _saved_init[name] = getattr(torch.nn.init, name)
+                setattr(torch.nn.init, name, _skip)
+        # Only tie the weights, the random initialization of transformers is skipped
+        _saved_init['init_weights'] = PreTrainedModel.init_weights
+        PreTrainedModel.init_weights = PreTrainedModel.tie_weights
+        try:
+            yield
+        finally:
+            PreTrainedModel.init_weights = _saved_init.pop('init_weights')
+            for name, function in _saved_init.items():
+                setattr(torch.nn.init, name, function)
+            _saved_init.clear()
+
+
+def create_pretrained_model(head_model, pretrained: str, **kwargs) -> torch.nn.Module:
+    """
+    Create a model with from_pretrained. It is not created while another thread creates a model without
+    initializing its weights.
+
+    Args:
+        head_model: Class of prediction model
+        pretrained: Name or path of the pretrained model
+        **kwargs: Keyword arguments of from_pretrained
+
+    Returns: The pretrained model
+
+    """
+    with _construction_lock:
+        return head_model.from_pretrained(pretrained, **kwargs)
+
+
+def create_empty_model(head_model, config) -> torch.nn.Module:
+    """
+
+    Args:
+        head_model: Class of prediction model
+        config: Configuration of the model
+
+    Returns: A model whose weights are not initialized
+
+    """
+    with skip_init():
+        return head_model(config)
+
+
+def load_pretrained_weights(model: torch.nn.Module, pretrained: str):
+    """
+    Load the weights of a pretrained model into a model created with create_empty_model. The tensors of the
+    checkpoint become the weights of the model without being copied, so the peak memory is about the size of the
+    weights instead of twice as much.
+
+    The checkpoint is a pickle, which torch.load (torch 1.6) reads whole before any tensor is assigned, so the
+    weights are not streamed layer by layer. Flat weights files (see save_flat_weights) are mapped one tensor at a
+    time instead, and are used when PREDICTION_MMAP_WEIGHTS is set.
+
+    Args:
+        model: Model whose weights are not initialized
+        pretrained: Name of the pretrained model
+
+    """
+    checkpoint = torch.load(cached_path(hf_bucket_url(pretrained, filename=WEIGHTS_NAME)), map_location='cpu')
+    names = set(model.state_dict())
+    prefix = model.base_model_prefix
+    # Checkpoints of base models don't have the prefix of the base model in the model with head
+    add_prefix = bool(prefix) and hasattr(model, prefix) and not any(key.startswith(f'{prefix}.')
+                                                                     for key in checkpoint)
+    tensors = {}
+    for key in list(checkpoint):
+        # Old checkpoints use the names of TensorFlow
+        name = key.replace('gamma', 'weight') if 'gamma' in key else key.replace('beta', 'bias')
+        if add_prefix:
+            name = f'{prefix}.{name}'
+        # Every tensor is released as soon as it is assigned, unless it is used by the model
+        tensor = checkpoint.pop(key)
+        if name in names:
+            tensors[name] = tensor
+    assign_weights(model, tensors)
+    model.tie_weights()
+
+    loaded = {tensor.data_ptr() for tensor in tensors.values()}
+    for module in model.modules():
+        missing = [name for name, parameter in module._parameters.items()
+                   if parameter is not None and parameter.data_ptr() not in loaded]
+        if missing:
+            logger.warning(f'{pretrained} has no weights for {missing} of {type(module).__name__}. They are '
+                           f'initialized randomly.')
+            _init_missing_weights(model, module, missing)
+
+
+def _init_missing_weights(model: torch.nn.Module, module: torch.nn.Module, missing: list):
+    """
+    Initialize some parameters of a module. The initialization of transformers sets all the parameters of the
+    module, so the loaded ones are replaced by scratch copies meanwhile.
+
+    Args:
+        model: Pretrained model
+        module: Module of the model
+        missing: Names of the parameters of the module that have no weights
+
+    """
+    loaded = {name: parameter for name, parameter in module._parameters.items()
+              if parameter is not None and name not in missing}
+    for name, parameter in loaded.items():
+        module._parameters[name] = torch.nn.Parameter(torch.empty_like(parameter), requires_grad=False)
+    model._init_weights(module)
+    module._parameters.update(loaded)
@@ -0,0 +1,46 @@
+#  Copyright 2020 Julián Novoa Martín
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+
+# The prediction models are loaded in the master before the workers are forked, so all the workers share the
+# pages of the weights copy-on-write
+preload_app = True
+os.environ.setdefault('PREDICTION_PRELOAD', 'sync')
+
+# Threaded workers. The admission control, the sequence numbers and the batching of a process only apply to the
+# requests it serves at the same time, and a sync worker serves one request at a time. Async workers can be chosen
+# in the command line instead (see README).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Number of requests of a worker between reports of its memory
+MEMORY_REPORT_INTERVAL = int(os.environ.get('MEMORY_REPORT_INTERVAL', '1000'))
+
+
+def report_memory(log, pid: int):
+    from document.memory import get_memory_usage
+    names = {'rss': 'resident', 'shared': 'shared', 'private': 'private', 'pss': 'proportional'}
+    # Only the resident memory is known without procfs
+    usage = ', '.join(f'{size / 2 ** 20:.0f} MB {names[name]}' for name, size in get_memory_usage().items())
+    log.info('Worker %s memory: %s', pid, usage)
+
+
+def post_fork(server, worker):
+    report_memory(server.log, worker.pid)
+
+
+def post_request(worker, req, environ, resp):
+    if worker.nr % MEMORY_REPORT_INTERVAL == 0:
+        report_memory(worker.log, worker.pid)